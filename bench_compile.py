@@ -0,0 +1,216 @@
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import latex2sexp
+import latex_build
+
+# Full-compile benchmark: builds each arXiv document with the LaTeX toolchain and
+# with moganstem, N timed trials after warmup, and appends raw per-trial timings
+# plus a per-(benchmark, tool) summary to a JSONL file that draw_bench1.py plots.
+#
+# Documents live in <docs-dir>/<arXiv id without the "arXiv:" prefix>/, each with a
+# LaTeX entry point (main.tex) and the equivalent Mogan document (main.tmu).
+#
+# Cache modes:
+#   cold  every trial runs on a fresh copy of the document (no .aux/.bbl) and with
+#         an empty TEXMACS_HOME_PATH (no font/style caches)
+#   warm  all trials share one working copy and one TEXMACS_HOME_PATH, so the
+#         warmup runs populate the caches the timed trials then hit
+
+BENCHMARKS = [
+    "arXiv:1706.03762",
+    "arXiv:1405.4980",
+    "arXiv:1204.5721",
+    "arXiv:2312.10283",
+    "arXiv:2405.19674",
+    "arXiv:2502.17655",
+]
+
+TOOLS = ("latex", "moganstem")
+
+# Two-sided 95% Student t quantiles for df = 1..30; larger samples use the normal value
+T95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+       2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+       2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+def platform_name():
+    """Platform label used in the chart series ("Windows", "Linux", ...)."""
+    return platform.system() or "unknown"
+
+def summarize(samples):
+    """Mean, sample standard deviation and 95% confidence interval of the mean."""
+    n = len(samples)
+    mean = statistics.fmean(samples)
+    stddev = statistics.stdev(samples) if n > 1 else 0.0
+    half = (T95[n - 2] if n - 1 <= len(T95) else 1.96) * stddev / math.sqrt(n) if n > 1 else 0.0
+    return {"n": n, "mean": mean, "stddev": stddev, "ci95_low": mean - half, "ci95_high": mean + half}
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+def run_step(cmd, cwd, timeout, env=None):
+    result = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True,
+                            timeout=timeout, check=False)
+    return result.returncode
+
+def compile_latex(work_dir, main, latex_cmd, bibtex_cmd, timeout, converge=False):
+    """pdflatex, bibtex, pdflatex, pdflatex (the old build.bat sequence); returns elapsed ms.
+
+    With converge=True the latex_build.py driver is timed instead, which skips
+    unchanged bibliographies and stops once the auxiliary files are stable.
+    """
+    stem = os.path.splitext(main)[0]
+    if converge:
+        # Without the PDF the driver cannot report "up to date", so warm trials time a real
+        # rebuild that still reuses the .aux/.bbl state and the build manifest
+        pdf = os.path.join(work_dir, stem + ".pdf")
+        if os.path.exists(pdf):
+            os.remove(pdf)
+        start = time.perf_counter()
+        latex_build.build(work_dir, main, latex_cmd, bibtex_cmd, timeout=timeout, verbose=False)
+        return (time.perf_counter() - start) * 1000
+
+    latex = [latex_cmd, "-interaction=nonstopmode", "-halt-on-error", main]
+    start = time.perf_counter()
+    if run_step(latex, work_dir, timeout) != 0:
+        raise RuntimeError(f"{latex_cmd} failed on first pass")
+    # BibTeX errors are not fatal, as in build.bat
+    run_step([bibtex_cmd, stem], work_dir, timeout)
+    for _ in range(2):
+        if run_step(latex, work_dir, timeout) != 0:
+            raise RuntimeError(f"{latex_cmd} failed")
+    return (time.perf_counter() - start) * 1000
+
+def moganstem_script(source, output):
+    """Scheme script that loads a document, typesets it and exports it to PDF."""
+    return "\n".join([
+        ";; Benchmark script - generated by bench_compile.py",
+        f'(load-buffer (system->url "{source}"))',
+        f'(export-buffer-main (current-buffer) (system->url "{output}") "pdf" (list))',
+        "(quit)",
+        "",
+    ])
+
+def compile_moganstem(work_dir, main, home_dir, timeout):
+    """Typeset main.tmu to PDF with moganstem in batch mode; returns elapsed ms."""
+    source = os.path.join(work_dir, main).replace("\\", "/")
+    output = os.path.splitext(source)[0] + ".pdf"
+    scheme_file = os.path.join(work_dir, "bench.scm")
+    with open(scheme_file, "w", encoding="utf-8") as f:
+        f.write(moganstem_script(source, output))
+
+    start = time.perf_counter()
+    result = latex2sexp.run_moganstem(scheme_file, timeout, {"TEXMACS_HOME_PATH": home_dir})
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"moganstem returned {result.returncode}")
+    return elapsed
+
+def bench_document(doc_dir, tool, args):
+    """Warmup plus timed trials for one document and tool; returns the trial timings in ms."""
+    scratch = tempfile.mkdtemp(prefix="bench-")
+    try:
+        def fresh(i):
+            work_dir = os.path.join(scratch, f"doc-{i}")
+            shutil.copytree(doc_dir, work_dir)
+            home_dir = os.path.join(scratch, f"home-{i}")
+            os.makedirs(home_dir)
+            return work_dir, home_dir
+
+        def once(work_dir, home_dir):
+            if tool == "latex":
+                return compile_latex(work_dir, args.tex_main, args.latex, args.bibtex, args.timeout, args.converge)
+            return compile_moganstem(work_dir, args.tmu_main, home_dir, args.timeout)
+
+        shared = fresh("warm") if args.mode == "warm" else None
+        timings = []
+        for i in range(args.warmup + args.trials):
+            work_dir, home_dir = shared or fresh(i)
+            ms = once(work_dir, home_dir)
+            if i >= args.warmup:
+                timings.append(ms)
+        return timings
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark full compiles of the arXiv documents with LaTeX and moganstem.",
+        epilog="Example: python bench_compile.py bench-docs full-compile.jsonl --trials 5 --mode cold",
+    )
+    parser.add_argument("docs_dir", help="one subdirectory per arXiv id, e.g. bench-docs/1706.03762/")
+    parser.add_argument("output_jsonl", help="results are appended, so runs from several machines can share one file")
+    parser.add_argument("--tools", nargs="+", choices=TOOLS, default=list(TOOLS))
+    parser.add_argument("--benchmarks", nargs="+", default=BENCHMARKS)
+    parser.add_argument("--trials", type=int, default=3, help="timed trials per document (default: 3)")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before the trials (default: 1)")
+    parser.add_argument("--mode", choices=("cold", "warm"), default="cold", help="cache mode (default: cold)")
+    parser.add_argument("--timeout", type=int, default=600, help="seconds per compile step (default: 600)")
+    parser.add_argument("--tex-main", default="main.tex")
+    parser.add_argument("--tmu-main", default="main.tmu")
+    parser.add_argument("--latex", default="pdflatex", help="LaTeX engine command (default: pdflatex)")
+    parser.add_argument("--bibtex", default="bibtex")
+    parser.add_argument("--converge", action="store_true",
+                        help="build LaTeX with latex_build.py instead of the fixed four-step sequence")
+    parser.add_argument("--moganstem", default=None,
+                        help="moganstem binary (default: MOGANSTEM_PATH); a stand-in can be plugged in here")
+    parser.add_argument("--platform", default=platform_name(),
+                        help="platform label for the chart series (default: this machine)")
+    args = parser.parse_args()
+
+    if args.trials < 1:
+        parser.error("--trials must be at least 1")
+    # Compile steps run inside the working copy, so relative tool paths must be resolved first
+    args.latex, args.bibtex = (os.path.abspath(cmd) if os.sep in cmd or "/" in cmd else cmd
+                               for cmd in (args.latex, args.bibtex))
+    if args.moganstem:
+        latex2sexp.MOGANSTEM_PATH = os.path.abspath(args.moganstem)
+    if "moganstem" in args.tools and not latex2sexp.moganstem_available():
+        sys.exit(1)
+
+    failed = 0
+    with open(args.output_jsonl, "a", encoding="utf-8") as out:
+        for benchmark in args.benchmarks:
+            doc_dir = os.path.join(args.docs_dir, benchmark.split(":")[-1])
+            if not os.path.isdir(doc_dir):
+                print(f"Warning: {doc_dir} not found, skipping {benchmark}")
+                failed += 1
+                continue
+            for tool in args.tools:
+                base = {"benchmark": benchmark, "tool": tool, "platform": args.platform, "mode": args.mode}
+                if tool == "latex":
+                    base["driver"] = "converge" if args.converge else "fixed"
+                try:
+                    timings = bench_document(doc_dir, tool, args)
+                except (RuntimeError, subprocess.TimeoutExpired, OSError) as e:
+                    print(f"Warning: {benchmark} / {tool}: {e}")
+                    failed += 1
+                    continue
+
+                for trial, ms in enumerate(timings):
+                    out.write(json.dumps(dict(base, type="trial", trial=trial, ms=ms)) + "\n")
+                stats = summarize(timings)
+                out.write(json.dumps(dict(base, type="summary", warmup=args.warmup, **stats)) + "\n")
+                out.flush()
+                print(f"{benchmark:<20}{tool:<11}{stats['mean']:>10.0f} ms  "
+                      f"± {stats['stddev']:.0f}  (95% CI {stats['ci95_low']:.0f}-{stats['ci95_high']:.0f}, n={stats['n']})")
+
+    print(f"Saved to: {args.output_jsonl}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
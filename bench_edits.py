@@ -0,0 +1,324 @@
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+import bench_compile
+import latex2sexp
+
+# Incremental-update benchmark: applies a seeded sequence of the edits described in
+# the paper (add a section, add a table, change a label/ref relation, move content)
+# to the LaTeX sources and to the matching .tmu document, and times the rebuild of
+# each after every edit. Both sides draw the edit kind and its relative positions
+# from the same random stream, so a seed always yields the same edit script.
+#
+# Per-edit latencies and per-tool/per-edit-kind summaries (mean, CI, p50/p90/p99)
+# are appended to a JSONL file; the per-tool summaries use the bench_compile.py
+# record layout, so inc-update.jsonl can be plotted by draw_bench1.py directly.
+
+EDITS = ("add-section", "add-table", "relink", "move")
+
+ENV_RE = re.compile(r"\\(begin|end)\{([^}]*)\}")
+VERB_RE = re.compile(r"\\verb\*?(.).*?\1")
+VERBATIM_ENVS = ("lstlisting", "verbatim", "minted")
+
+class Document:
+    """A document as a list of (path, lines) files with top-level paragraph structure."""
+
+    def __init__(self, paths):
+        self.files = []
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                self.files.append((path, f.read().split("\n")))
+
+    def save(self):
+        for path, lines in self.files:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines))
+
+    def boundaries(self):
+        """Blank lines between top-level blocks, as (file index, line index)."""
+        result = []
+        for fi, (_, lines) in enumerate(self.files):
+            result.extend((fi, li) for li in self.top_level_blanks(lines))
+        return result
+
+    def paragraphs(self):
+        """Movable prose paragraphs, as (file index, first line, last line)."""
+        result = []
+        for fi, (_, lines) in enumerate(self.files):
+            blanks = self.top_level_blanks(lines)
+            for before, after in zip(blanks, blanks[1:]):
+                block = lines[before + 1:after]
+                if block and all(self.is_prose(line) for line in block):
+                    result.append((fi, before + 1, after - 1))
+        return result
+
+    def insert(self, where, block):
+        fi, li = where
+        self.files[fi][1][li + 1:li + 1] = block + [""]
+
+    def apply(self, kind, step, fracs):
+        """Apply one edit; fracs are the relative positions drawn for it. Returns a description."""
+        boundaries = self.boundaries()
+        pick = lambda items, frac: items[min(int(frac * len(items)), len(items) - 1)]
+
+        if kind == "add-section":
+            self.insert(pick(boundaries, fracs[0]), self.section_block(step))
+            return "section added"
+        if kind == "add-table":
+            self.insert(pick(boundaries, fracs[0]), self.table_block(step))
+            return "table added"
+        if kind == "relink":
+            refs = self.refs()
+            labels = sorted(set(self.labels()))
+            if not refs or len(labels) < 2:
+                return "no reference to relink"
+            fi, li, start, end, old = pick(refs, fracs[0])
+            new = pick([label for label in labels if label != old], fracs[1])
+            line = self.files[fi][1][li]
+            self.files[fi][1][li] = line[:start] + new + line[end:]
+            return f"{old} -> {new}"
+
+        paragraphs = self.paragraphs()
+        if not paragraphs:
+            return "no paragraph to move"
+        fi, first, last = pick(paragraphs, fracs[0])
+        lines = self.files[fi][1]
+        block = lines[first:last + 1]
+        # Drop the paragraph together with its trailing blank line, then reinsert it
+        del lines[first:last + 2]
+        self.insert(pick(self.boundaries(), fracs[1]), block)
+        return f"moved {len(block)} line(s)"
+
+    def refs(self):
+        found = []
+        for fi, (_, lines) in enumerate(self.files):
+            for li, line in enumerate(lines):
+                for m in self.REF_RE.finditer(line):
+                    found.append((fi, li, m.start(1), m.end(1), m.group(1)))
+        return found
+
+    def labels(self):
+        return [m.group(1) for _, lines in self.files for line in lines for m in self.LABEL_RE.finditer(line)]
+
+class TexDocument(Document):
+    REF_RE = re.compile(r"\\ref\{([^}]*)\}")
+    LABEL_RE = re.compile(r"\\label\{([^}]*)\}|label=\{([^}]*)\}")
+
+    def labels(self):
+        return [m.group(1) or m.group(2) for _, lines in self.files for line in lines
+                for m in self.LABEL_RE.finditer(line)]
+
+    @staticmethod
+    def top_level_blanks(lines):
+        # Blank lines inside environments (listings, tables) are not paragraph breaks;
+        # \verb|...| and the bodies of verbatim environments are not scanned for \begin/\end
+        depth = 0
+        verbatim = None
+        blanks = []
+        for li, line in enumerate(lines):
+            if not line.strip():
+                if depth == 0:
+                    blanks.append(li)
+                continue
+            for m in ENV_RE.finditer(VERB_RE.sub("", line)):
+                kind, env = m.groups()
+                if verbatim is not None and (kind, env) != ("end", verbatim):
+                    continue
+                if kind == "begin":
+                    depth += 1
+                    if env in VERBATIM_ENVS:
+                        verbatim = env
+                else:
+                    depth = max(0, depth - 1)
+                    verbatim = None
+        return blanks
+
+    @staticmethod
+    def is_prose(line):
+        return not line.lstrip().startswith(("\\", "%"))
+
+    @staticmethod
+    def section_block(step):
+        return [
+            f"\\section{{Added section {step}}}\\label{{sec:added-{step}}}",
+            "",
+            f"This section was inserted by edit {step} of the incremental-update benchmark.",
+        ]
+
+    @staticmethod
+    def table_block(step):
+        return [
+            "\\begin{table}[htbp]",
+            "    \\centering",
+            f"    \\caption{{Table added by edit {step}}}",
+            f"    \\label{{tab:added-{step}}}",
+            "    \\begin{tabular}{ccc}",
+            "        a & b & c \\\\",
+            f"        1 & 2 & {step} \\\\",
+            "    \\end{tabular}",
+            "\\end{table}",
+        ]
+
+class TmuDocument(Document):
+    REF_RE = re.compile(r"<(?:reference|smart-ref|eqref)\|([^>|]*)>")
+    LABEL_RE = re.compile(r"<label\|((?!bib-)[^>|]*)>")
+    SECTION_RE = re.compile(r"  <(?:sub)*(?:section|paragraph|chapter|appendix)\*?\|")
+
+    @staticmethod
+    def top_level_blanks(lines):
+        # Only the body after the first section heading is edited. Block contents are indented
+        # deeper than the block, so a blank line is at top level when both neighbours sit at
+        # body indentation (two spaces) and the next line does not close a block.
+        start = next((li for li, line in enumerate(lines) if line.startswith("  <section|")), None)
+        if start is None:
+            raise RuntimeError("no top-level <section|...> heading in the .tmu body; nothing to edit")
+        if "</body>" not in lines:
+            raise RuntimeError("no </body> line in the .tmu document")
+        end = lines.index("</body>")
+        at_body_level = lambda line: line.startswith("  ") and not line.startswith("   ")
+        return [
+            li for li in range(start + 1, end - 1)
+            if not lines[li].strip() and at_body_level(lines[li - 1]) and at_body_level(lines[li + 1])
+            and not lines[li + 1].startswith("  </")
+        ]
+
+    def is_prose(self, line):
+        return (line.startswith("  ") and not line.startswith(("   ", "  <\\", "  </"))
+                and not self.SECTION_RE.match(line))
+
+    @staticmethod
+    def section_block(step):
+        return [
+            f"  <section|Added section {step}><label|sec:added-{step}>",
+            "",
+            f"  This section was inserted by edit {step} of the incremental-update benchmark.",
+        ]
+
+    @staticmethod
+    def table_block(step):
+        return [
+            f"  <\\big-table|<tabular|<tformat|<table|<row|<cell|a>|<cell|b>|<cell|c>>|<row|<cell|1>|<cell|2>|<cell|{step}>>>>>>",
+            f"    <label|table:added-{step}>Table added by edit {step}",
+            "  </big-table>",
+        ]
+
+def edit_script(seed, count):
+    """The deterministic edit sequence for a seed: [(kind, fracs)]."""
+    rng = random.Random(seed)
+    return [(rng.choice(EDITS), (rng.random(), rng.random())) for _ in range(count)]
+
+def prepare(args, scratch):
+    """Working copies of both documents: (tool, document, rebuild function) per requested tool."""
+    targets = []
+    if "latex" in args.tools:
+        tex_dir = os.path.join(scratch, "tex")
+        shutil.copytree(args.tex_dir, tex_dir)
+        paths = sorted(glob.glob(os.path.join(tex_dir, args.tex_glob)))
+        rebuild = lambda: bench_compile.compile_latex(tex_dir, args.tex_main, args.latex, args.bibtex,
+                                                      args.timeout, args.converge)
+        targets.append(("latex", TexDocument(paths), rebuild))
+    if "moganstem" in args.tools:
+        tmu_dir = os.path.join(scratch, "tmu")
+        home_dir = os.path.join(scratch, "home")
+        os.makedirs(tmu_dir)
+        os.makedirs(home_dir)
+        tmu_main = os.path.basename(args.tmu)
+        shutil.copy(args.tmu, tmu_dir)
+        # Bring along the images the document links next to it
+        with open(args.tmu, "r", encoding="utf-8") as f:
+            for name in set(re.findall(r"<image\|([^|<>]+)\|", f.read())):
+                src = os.path.join(os.path.dirname(args.tmu), name)
+                if os.path.exists(src):
+                    shutil.copy(src, tmu_dir)
+        rebuild = lambda: bench_compile.compile_moganstem(tmu_dir, tmu_main, home_dir, args.timeout)
+        targets.append(("moganstem", TmuDocument([os.path.join(tmu_dir, tmu_main)]), rebuild))
+    return targets
+
+def summary_record(base, latencies):
+    stats = bench_compile.summarize(latencies)
+    ordered = sorted(latencies)
+    for p in (50, 90, 99):
+        stats[f"p{p}"] = bench_compile.percentile(ordered, p)
+    return dict(base, **stats)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Seeded incremental-edit benchmark over the arXiv sources and the matching .tmu document.",
+        epilog="Example: python bench_edits.py inc-update.jsonl --edits 50 --seed 1",
+    )
+    parser.add_argument("output_jsonl", help="results are appended")
+    parser.add_argument("--tex-dir", default="arXiv-submission", help="LaTeX project directory (default: arXiv-submission)")
+    parser.add_argument("--tex-main", default="main_en.tex")
+    parser.add_argument("--tex-glob", default="sec/*.tex", help="files that receive edits (default: sec/*.tex)")
+    parser.add_argument("--tmu", default="main_en.tmu", help="matching Mogan document (default: main_en.tmu)")
+    parser.add_argument("--tools", nargs="+", choices=bench_compile.TOOLS, default=list(bench_compile.TOOLS))
+    parser.add_argument("--edits", type=int, default=20, help="number of edits (default: 20)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the edit sequence (default: 0)")
+    parser.add_argument("--benchmark", default="arXiv-submission", help="benchmark label in the records")
+    parser.add_argument("--timeout", type=int, default=600, help="seconds per build step (default: 600)")
+    parser.add_argument("--latex", default="pdflatex")
+    parser.add_argument("--bibtex", default="bibtex")
+    parser.add_argument("--converge", action="store_true",
+                        help="rebuild LaTeX with latex_build.py instead of the fixed four-step sequence")
+    parser.add_argument("--moganstem", default=None, help="moganstem binary (default: MOGANSTEM_PATH)")
+    parser.add_argument("--platform", default=bench_compile.platform_name())
+    args = parser.parse_args()
+
+    args.latex, args.bibtex = (os.path.abspath(cmd) if os.sep in cmd or "/" in cmd else cmd
+                               for cmd in (args.latex, args.bibtex))
+    if args.moganstem:
+        latex2sexp.MOGANSTEM_PATH = os.path.abspath(args.moganstem)
+    if "moganstem" in args.tools and not latex2sexp.moganstem_available():
+        sys.exit(1)
+
+    script = edit_script(args.seed, args.edits)
+    scratch = tempfile.mkdtemp(prefix="bench-edits-")
+    print(f"{'tool':<11}{'edit':<13}{'n':>5}{'mean(ms)':>10}{'p50':>10}{'p90':>10}{'p99':>10}")
+    try:
+        with open(args.output_jsonl, "a", encoding="utf-8") as out:
+            for tool, document, rebuild in prepare(args, scratch):
+                base = {"benchmark": args.benchmark, "tool": tool, "platform": args.platform,
+                        "mode": "incremental", "seed": args.seed}
+                if tool == "latex":
+                    base["driver"] = "converge" if args.converge else "fixed"
+                try:
+                    # Untimed initial build so every timed rebuild starts from up-to-date auxiliary state
+                    rebuild()
+                    latencies = defaultdict(list)
+                    for step, (kind, fracs) in enumerate(script):
+                        detail = document.apply(kind, step, fracs)
+                        document.save()
+                        ms = rebuild()
+                        latencies[kind].append(ms)
+                        out.write(json.dumps(dict(base, type="edit", step=step, edit=kind, detail=detail, ms=ms)) + "\n")
+                except (RuntimeError, subprocess.TimeoutExpired, OSError) as e:
+                    print(f"Warning: {tool}: {e}")
+                    continue
+
+                everything = [ms for values in latencies.values() for ms in values]
+                record = summary_record(dict(base, type="summary"), everything)
+                out.write(json.dumps(record) + "\n")
+                print(f"{tool:<11}{'(all)':<13}{record['n']:>5}{record['mean']:>10.0f}"
+                      f"{record['p50']:>10.0f}{record['p90']:>10.0f}{record['p99']:>10.0f}")
+                for kind in EDITS:
+                    if latencies[kind]:
+                        record = summary_record(dict(base, type="edit-summary", edit=kind), latencies[kind])
+                        out.write(json.dumps(record) + "\n")
+                        print(f"{'':<11}{kind:<13}{record['n']:>5}{record['mean']:>10.0f}"
+                              f"{record['p50']:>10.0f}{record['p90']:>10.0f}{record['p99']:>10.0f}")
+                out.flush()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    print(f"Saved to: {args.output_jsonl}")
+
+if __name__ == "__main__":
+    main()
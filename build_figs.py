@@ -0,0 +1,149 @@
+import argparse
+import hashlib
+import json
+import os
+import runpy
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+# One entry point for all paper figures (replaces running the draw_* scripts by hand
+# and copy_figs.bat). Scripts run unchanged in a process pool on the non-interactive
+# Agg backend; their PDFs are written straight into arXiv-submission/figure and their
+# PNGs stay next to the .tmu documents that embed them.
+#
+# A figure is rebuilt only when the content hash of its script or of one of its
+# input files differs from the manifest, or one of its outputs is missing. A script
+# draws all of its figures in one run, so it runs when any of them is stale.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIGURE_DIR = os.path.join(ROOT, "arXiv-submission", "figure")
+MANIFEST = os.path.join(ROOT, ".figures-manifest.json")
+
+# figure name -> (script, data inputs); missing optional inputs hash as absent
+FIGURES = {
+    "full-compile": ("draw_bench1.py", ["full-compile.txt", "full-compile.jsonl"]),
+    "inc-update": ("draw_bench1.py", ["inc-update.txt", "inc-update.jsonl"]),
+    "writing": ("draw_bench2.py", ["writing.txt"]),
+    "reading": ("draw_bench2.py", ["reading.txt"]),
+    "debugging": ("draw_bench2.py", ["debugging.txt"]),
+    "fine-tune": ("draw_bench3.py", ["train_log.py", "log_latex.jsonl", "log_texmacs.jsonl"]),
+    "iso_size": ("draw_iso_size.py", ["iso.csv"]),
+}
+
+def file_hash(path):
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def figure_key(name):
+    """Content hash over the figure's script and data inputs."""
+    script, inputs = FIGURES[name]
+    h = hashlib.sha256()
+    for path in [script] + inputs:
+        h.update(f"{path}={file_hash(os.path.join(ROOT, path))}\n".encode("utf-8"))
+    return h.hexdigest()
+
+def outputs(name):
+    return [os.path.join(FIGURE_DIR, name + ".pdf"), os.path.join(ROOT, name + ".png")]
+
+def load_manifest():
+    if not os.path.exists(MANIFEST):
+        return {}
+    with open(MANIFEST, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def run_script(script):
+    """Run one draw_* script headless (pool worker); returns (script, elapsed seconds)."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.figure import Figure
+
+    savefig = Figure.savefig
+
+    def redirect(fig, fname, *args, **kwargs):
+        # Scripts save "<name>.pdf" relative to the working directory; PDFs belong to the paper
+        if isinstance(fname, str) and fname.endswith(".pdf") and not os.path.isabs(fname):
+            fname = os.path.join(FIGURE_DIR, os.path.basename(fname))
+        return savefig(fig, fname, *args, **kwargs)
+
+    Figure.savefig = redirect
+    start = time.perf_counter()
+    os.chdir(ROOT)
+    try:
+        with warnings.catch_warnings():
+            # plt.show() on Agg only warns that it cannot open a window
+            warnings.simplefilter("ignore", UserWarning)
+            runpy.run_path(os.path.join(ROOT, script), run_name="__main__")
+    finally:
+        plt.close("all")
+        Figure.savefig = savefig
+    return script, time.perf_counter() - start
+
+def build_figures(names=None, workers=None, force=False):
+    """Rebuild stale figures; returns the list of scripts that ran."""
+    names = list(names or FIGURES)
+    manifest = load_manifest()
+    keys = {name: figure_key(name) for name in names}
+    stale = [
+        name for name in names
+        if force or manifest.get(name) != keys[name] or not all(os.path.exists(p) for p in outputs(name))
+    ]
+    for name in names:
+        if name not in stale:
+            print(f"[skip] {name} (unchanged)")
+    scripts = sorted({FIGURES[name][0] for name in stale})
+    if not scripts:
+        return []
+
+    os.makedirs(FIGURE_DIR, exist_ok=True)
+    failed = set()
+    with ProcessPoolExecutor(max_workers=min(len(scripts), workers or os.cpu_count() or 1)) as pool:
+        futures = {script: pool.submit(run_script, script) for script in scripts}
+        for script, future in futures.items():
+            try:
+                _, seconds = future.result()
+                print(f"[done] {script} ({seconds:.1f} s)")
+            except Exception as e:
+                print(f"[error] {script}: {e}")
+                failed.add(script)
+
+    # Only figures whose script succeeded are recorded, so failures are retried next time
+    for name in names:
+        if FIGURES[name][0] in scripts and FIGURES[name][0] not in failed:
+            manifest[name] = keys[name]
+    with open(MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    if failed:
+        raise RuntimeError(f"{len(failed)} script(s) failed: {', '.join(sorted(failed))}")
+    return scripts
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build all paper figures in parallel, skipping unchanged ones.",
+        epilog="Example: python build_figs.py            (or: python build_figs.py fine-tune --force)",
+    )
+    parser.add_argument("figures", nargs="*", help=f"figures to build (default: all of {', '.join(FIGURES)})")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="rebuild even if nothing changed")
+    args = parser.parse_args()
+    unknown = [name for name in args.figures if name not in FIGURES]
+    if unknown:
+        parser.error(f"unknown figure(s): {', '.join(unknown)}")
+
+    start = time.perf_counter()
+    try:
+        scripts = build_figures(args.figures, args.jobs, args.force)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(f"{len(scripts)} script(s) run in {time.perf_counter() - start:.1f} s. PDFs in: {FIGURE_DIR}")
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,5 @@
 @echo off
-setlocal enabledelayedexpansion
-
-set "SRC_DIR=%~dp0"
-set "DEST_DIR=%~dp0arXiv-submission\figure"
-
-if not exist "%DEST_DIR%" (
-    mkdir "%DEST_DIR%"
-    echo Created directory: %DEST_DIR%
-)
-
-set "COUNT=0"
-
-for %%f in ("%SRC_DIR%*.pdf") do (
-    if exist "%%f" (
-        set "FILENAME=%%~nxf"
-        set "SKIP=0"
-        echo "%%~nxf" | findstr /i "main" >nul && set "SKIP=1"
-        if !SKIP!==0 (
-            copy /Y "%%f" "%DEST_DIR%" >nul
-            echo Copied: %%~nxf
-            set /a COUNT+=1
-        )
-    )
-)
-
-echo.
-echo Total files copied: %COUNT%
-echo Destination: %DEST_DIR%
-pause
+rem Figures are now built by build_figs.py, which writes the PDFs straight into
+rem arXiv-submission\figure and skips figures whose script and data are unchanged.
+python "%~dp0build_figs.py" %*
+if errorlevel 1 pause
@@ -1,3 +1,5 @@
+import json
+import os
 import re
 import numpy as np
 import matplotlib.pyplot as plt
@@ -40,11 +42,55 @@ series_hatch = {
     "MoganSTEM on Linux":    "///",
 }
 
+# (tool, platform) written by bench_compile.py for each series
+series_keys = {
+    "LaTeX on Windows":      ("latex", "Windows"),
+    "LaTeX on Linux":        ("latex", "Linux"),
+    "MoganSTEM on Windows":  ("moganstem", "Windows"),
+    "MoganSTEM on Linux":    ("moganstem", "Linux"),
+}
+
+# Benchmark results (JSONL) are used when present, the hand-entered matrices otherwise
 charts = [
-    {"name": "full-compile", "data_path": "full-compile.txt", "ylim": (0, 21500)},
-    {"name": "inc-update", "data_path": "inc-update.txt", "ylim": (0, 12000)},
+    {"name": "full-compile", "bench_path": "full-compile.jsonl", "data_path": "full-compile.txt", "ylim": (0, 21500)},
+    {"name": "inc-update", "bench_path": "inc-update.jsonl", "data_path": "inc-update.txt", "ylim": (0, 12000)},
 ]
 
+
+def load_bench(path):
+    """Means and 95% CI half-widths (4 x benchmarks) from the summary records, plus the column labels.
+
+    The latest run wins. Benchmarks recorded under other labels (bench_edits.py defaults to
+    "arXiv-submission") are plotted as extra columns after the six papers.
+    """
+    summaries = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                if rec.get("type") == "summary":
+                    summaries[(rec["tool"], rec["platform"], rec["benchmark"])] = rec
+
+    labels = benchmarks + sorted({key[2] for key in summaries} - set(benchmarks))
+    data = np.full((len(series_names), len(labels)), np.nan)
+    err = np.zeros_like(data)
+    for i, name in enumerate(series_names):
+        for j, bench in enumerate(labels):
+            rec = summaries.get(series_keys[name] + (bench,))
+            if rec is not None:
+                data[i, j] = rec["mean"]
+                err[i, j] = rec["ci95_high"] - rec["mean"]
+    return data, err, labels
+
+
+def load_matrix(path):
+    with open(path, "r", encoding="utf-8") as f:
+        rows = [
+            list(map(float, re.split(r"[,\s]+", line.strip())))
+            for line in f if line.strip()
+        ]
+    return np.array(rows, dtype=float), None, benchmarks
+
 plt.rcParams.update({
     "font.family": "serif",
     "axes.labelsize": 12,
@@ -60,19 +106,16 @@ label_fontsize = 8
 offsets = (np.arange(len(series_names)) - (len(series_names) - 1) / 2) * (bar_w + 0.02)
 
 for cfg in charts:
-    with open(cfg["data_path"], "r", encoding="utf-8") as f:
-        rows = [
-            list(map(float, re.split(r"[,\s]+", line.strip())))
-            for line in f if line.strip()
-        ]
-
-    data = np.array(rows, dtype=float)
+    if os.path.exists(cfg["bench_path"]):
+        data, err, labels = load_bench(cfg["bench_path"])
+    else:
+        data, err, labels = load_matrix(cfg["data_path"])
 
-    if data.shape != (4, 6):
-        raise ValueError(f"Expect 4 rows x 6 cols, got {data.shape}. Check your data file.")
+    if data.shape != (4, len(labels)):
+        raise ValueError(f"Expect 4 rows x {len(labels)} cols, got {data.shape}. Check your data file.")
 
-    fig, ax = plt.subplots(figsize=(11, 6))
-    x = np.arange(len(benchmarks))
+    fig, ax = plt.subplots(figsize=(11 + 1.5 * (len(labels) - len(benchmarks)), 6))
+    x = np.arange(len(labels))
 
     # Grid
     ax.set_axisbelow(True)
@@ -93,11 +136,13 @@ for cfg in charts:
 
         bars = ax.bar(
             x + offsets[i],
-            vals,
+            np.nan_to_num(vals),
             width=bar_w,
             label=name,
             color=series_colors[name],
             hatch=series_hatch[name],
+            yerr=None if err is None else err[i],
+            error_kw={"elinewidth": 0.8, "capsize": 2, "zorder": 4},
             zorder=3,
         )
 
@@ -112,6 +157,8 @@ for cfg in charts:
 
         # Value labels
         for b, v in zip(bars, vals):
+            if np.isnan(v):
+                continue
             ax.text(
                 b.get_x() + b.get_width() / 2,
                 b.get_height() + label_offset,
@@ -124,7 +171,7 @@ for cfg in charts:
 
     # Axes
     ax.set_xticks(x)
-    ax.set_xticklabels(benchmarks, rotation=-35, ha="left", rotation_mode="anchor")
+    ax.set_xticklabels(labels, rotation=-35, ha="left", rotation_mode="anchor")
     ax.tick_params(axis="x", pad=6)
 
     ax.set_ylabel("Time (ms)")
@@ -1,8 +1,10 @@
 from __future__ import annotations
-import argparse, json, os
+import argparse, os
 import matplotlib.pyplot as plt
 from typing import List, Tuple
 
+from train_log import TrainLog, moving_avg
+
 
 # Fixed smoothing window for the displayed moving average
 SMOOTH_WINDOW = 7
@@ -20,43 +22,14 @@ plt.rcParams.update({
 })
 
 
-def moving_avg(xs: List[float], k: int) -> List[float]:
-	if k <= 1:
-		return xs
-	out, acc = [], 0.0
-	for i, v in enumerate(xs):
-		acc += v
-		if i >= k:
-			acc -= xs[i - k]
-		out.append(acc / min(i + 1, k))
-	return out
-
-
 def parse_jsonl_loss(path: str) -> Tuple[List[int], List[float]]:
-	steps, losses = [], []
-	with open(path, 'r', encoding='utf-8') as f:
-		for idx, line in enumerate(f, start=1):
-			if not line.strip():
-				continue
-			try:
-				obj = json.loads(line)
-			except json.JSONDecodeError:
-				continue
-			if 'loss' not in obj:
-				continue
-			loss_val = obj['loss']
-			try:
-				loss_float = float(loss_val)
-			except (TypeError, ValueError):
-				continue
-			step_val = obj.get('step', obj.get('current_steps', idx))
-			steps.append(step_val)
-			losses.append(loss_float)
-	return steps, losses
+	log = TrainLog(path)
+	log.update(flush=True)
+	return log.steps.tolist(), log.losses.tolist()
 
 
 def plot_loss(ax, steps: List[int], losses: List[float], color: str, label: str, smooth: int):
-	if not steps:
+	if len(steps) == 0:
 		return False
 	loss_s = moving_avg(losses, smooth)
 	ax.plot(steps, losses, label=f'{label} (raw)', color=color, alpha=0.3)
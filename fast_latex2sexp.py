@@ -0,0 +1,378 @@
+import re
+import sys
+
+# gen_latex 所用数学子集的纯Python转换器，输出与 latex->texmacs 一致的 stree。
+# 遇到子集之外或 TeXmacs 导入行为不稳定的写法时抛出 Unsupported，由调用方回退到 moganstem。
+
+SYMBOLS = {
+    'alpha': '<alpha>', 'beta': '<beta>', 'theta': '<theta>',
+    'pi': '<pi>', 'infty': '<infty>',
+}
+OPERATORS = {
+    '+': '+', '-': '-', '=': '=', '>': '<gtr>', '<': '<less>',
+    'approx': '<approx>', 'times': '<times>', 'cdot': '<cdot>',
+}
+FUNCTIONS = {'sin', 'cos', 'log', 'ln', 'det'}
+BIG_OPERATORS = {'int'}
+DELIMITERS = {'(': '(', ')': ')', '[': '[', ']': ']', '\\{': '{', '\\}': '}'}
+MATRIX_ENVS = {'pmatrix', 'bmatrix', 'vmatrix', 'array', 'cases'}
+
+TOKEN_RE = re.compile(r'\\[a-zA-Z]+|\\.|\d+|\s+|.', re.S)
+
+class Unsupported(Exception):
+    """输入超出快速路径支持的子集"""
+
+def is_ordinary(tok):
+    """数字串或单个ASCII字母"""
+    return tok.isascii() and (tok.isdigit() or (len(tok) == 1 and tok.isalpha()))
+
+def tokenize(latex):
+    """切分为控制序列、数字串、空白和单字符"""
+    latex = latex.strip()
+    if latex.startswith('$') and latex.endswith('$') and len(latex) >= 2:
+        latex = latex[1:-1]
+    if '$' in latex:
+        raise Unsupported('嵌套数学模式')
+    tokens = []
+    for tok in TOKEN_RE.findall(latex):
+        tokens.append(' ' if tok.isspace() else tok)
+    return tokens
+
+# ---------------------------------------------------------------------------
+# 解析：token序列 -> 节点列表
+# 节点为元组：('ord', 文本) 普通符号，('op', 文本) 运算符/关系符，('func', 名称)，
+# ('big', 名称)，('script', 'rsub'|'rsup', 节点列表)，('frac', 分子, 分母)，
+# ('sqrt', 节点列表)，('around', 星号?, 左, 节点列表, 右)，('text', 文本)，
+# ('table', 环境, 列格式, 行列表)，('group', 节点列表)
+# ---------------------------------------------------------------------------
+
+class Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self, skip_space=True):
+        pos = self.pos
+        while skip_space and pos < len(self.tokens) and self.tokens[pos] == ' ':
+            pos += 1
+        return self.tokens[pos] if pos < len(self.tokens) else None
+
+    def next(self, skip_space=True):
+        if skip_space:
+            self.skip_space()
+        if self.pos >= len(self.tokens):
+            raise Unsupported('意外的输入结尾')
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
+
+    def skip_space(self):
+        while self.pos < len(self.tokens) and self.tokens[self.pos] == ' ':
+            self.pos += 1
+
+    def expect(self, tok):
+        got = self.next()
+        if got != tok:
+            raise Unsupported(f'期望 {tok}，得到 {got}')
+
+    def parse(self):
+        nodes = self.parse_sequence(())
+        if self.pos < len(self.tokens):
+            raise Unsupported(f'多余的输入 {self.tokens[self.pos]}')
+        return nodes
+
+    def parse_sequence(self, stops):
+        """解析到 stops 中的token（不消耗）为止；处理 \\over"""
+        nodes = []
+        numerator = None
+        while True:
+            tok = self.peek()
+            if tok is None or tok in stops:
+                break
+            if tok == '\\over':
+                if numerator is not None:
+                    raise Unsupported('多个 \\over')
+                self.next()
+                numerator, nodes = nodes, []
+                continue
+            nodes.append(self.parse_item())
+        if numerator is not None:
+            # TeXmacs 对与环境同层的 \over 导入结果不稳定（会出现空分子或 document 包裹）
+            if contains_bare_table(numerator + nodes):
+                raise Unsupported('\\over 与环境同层')
+            return [('frac', numerator, nodes)]
+        return nodes
+
+    def parse_argument(self):
+        """宏参数：花括号组或单个token"""
+        tok = self.peek()
+        if tok == '{':
+            self.next()
+            nodes = self.parse_sequence(('}',))
+            self.expect('}')
+            return nodes
+        if tok is None or tok in ('}', '&', '\\\\', '^', '_'):
+            raise Unsupported('缺少参数')
+        self.next()
+        return [self.atom(tok)]
+
+    def atom(self, tok):
+        if is_ordinary(tok):
+            return ('ord', tok)
+        if tok.startswith('\\') and tok[1:] in SYMBOLS:
+            return ('ord', SYMBOLS[tok[1:]])
+        raise Unsupported(f'不支持的参数 {tok}')
+
+    def parse_item(self):
+        tok = self.next()
+        if tok == '{':
+            nodes = self.parse_sequence(('}',))
+            self.expect('}')
+            return ('group', nodes)
+        if tok in ('^', '_'):
+            return ('script', 'rsup' if tok == '^' else 'rsub', self.parse_argument())
+        if tok in OPERATORS:
+            return ('op', OPERATORS[tok])
+        if tok == '(':
+            body = self.parse_sequence((')',))
+            self.expect(')')
+            return ('around', False, '(', body, ')')
+        if is_ordinary(tok):
+            return ('ord', tok)
+        if not tok.startswith('\\') or len(tok) < 2:
+            raise Unsupported(f'不支持的字符 {tok}')
+
+        name = tok[1:]
+        if name in SYMBOLS:
+            return ('ord', SYMBOLS[name])
+        if name in OPERATORS:
+            return ('op', OPERATORS[name])
+        if name in FUNCTIONS:
+            return ('func', name)
+        if name in BIG_OPERATORS:
+            return ('big', name)
+        if name == 'frac':
+            return ('frac', self.parse_argument(), self.parse_argument())
+        if name == 'sqrt':
+            if self.peek() == '[':
+                raise Unsupported('带次数的根式')
+            return ('sqrt', self.parse_argument())
+        if name == 'text':
+            return self.parse_text()
+        if name == 'left':
+            return self.parse_left_right()
+        if name == 'begin':
+            return self.parse_environment()
+        raise Unsupported(f'不支持的控制序列 {tok}')
+
+    def parse_text(self):
+        self.expect('{')
+        chars = []
+        while True:
+            tok = self.next(skip_space=False)
+            if tok == '}':
+                break
+            if tok == '{' or tok.startswith('\\'):
+                raise Unsupported('\\text 中的复杂内容')
+            chars.append(tok)
+        return ('text', ''.join(chars))
+
+    def parse_delimiter(self):
+        tok = self.next()
+        if tok not in DELIMITERS:
+            raise Unsupported(f'不支持的定界符 {tok}')
+        return DELIMITERS[tok]
+
+    def parse_left_right(self):
+        left = self.parse_delimiter()
+        body = self.parse_sequence(('\\right',))
+        self.expect('\\right')
+        right = self.parse_delimiter()
+        return ('around', True, left, body, right)
+
+    def parse_environment(self):
+        env = self.read_braced_word()
+        if env not in MATRIX_ENVS:
+            raise Unsupported(f'不支持的环境 {env}')
+        spec = self.read_braced_word() if env == 'array' else None
+        if spec is not None and (not spec or set(spec) != {'c'}):
+            raise Unsupported(f'不支持的列格式 {spec}')
+
+        rows = []
+        row = []
+        while True:
+            cell = self.parse_sequence(('&', '\\\\', '\\end'))
+            row.append(cell)
+            tok = self.next()
+            if tok == '&':
+                continue
+            rows.append(row)
+            row = []
+            if tok == '\\end':
+                break
+        if self.read_braced_word() != env:
+            raise Unsupported('环境不匹配')
+        if spec is not None and any(len(r) != len(spec) for r in rows):
+            raise Unsupported('array 列数与格式不符')
+        return ('table', env, spec, rows)
+
+    def read_braced_word(self):
+        self.expect('{')
+        word = []
+        while True:
+            tok = self.next()
+            if tok == '}':
+                return ''.join(word)
+            word.append(tok)
+
+# ---------------------------------------------------------------------------
+# 生成：节点列表 -> stree（字符串或列表）
+# ---------------------------------------------------------------------------
+
+def flatten(nodes):
+    """展开不带语义的花括号组"""
+    out = []
+    for node in nodes:
+        if node[0] == 'group':
+            out.extend(flatten(node[1]))
+        else:
+            out.append(node)
+    return out
+
+def contains_bare_table(nodes):
+    """是否有未被上下标、分式或根式隔开的环境"""
+    for node in nodes:
+        if node[0] == 'table':
+            return True
+        if node[0] == 'group' and contains_bare_table(node[1]):
+            return True
+        if node[0] == 'around' and contains_bare_table(node[3]):
+            return True
+    return False
+
+def is_multiplicand(node):
+    if node[0] == 'table':
+        # 只有 bmatrix 导入为 around*，其余环境后不插入乘号
+        return node[1] == 'bmatrix'
+    return node[0] in ('ord', 'frac', 'sqrt', 'around')
+
+def render_sequence(nodes):
+    """渲染为concat：合并相邻字符串，并在相邻乘数之间插入 *"""
+    pieces = []
+    prev_operand = False
+    for node in flatten(nodes):
+        kind = node[0]
+        if kind == 'script':
+            # 上下标不改变前一项是否为乘数
+            pieces.append([node[1], render(node[2])])
+            continue
+        if prev_operand and is_multiplicand(node):
+            pieces.append('*')
+        if kind == 'ord' or kind == 'op':
+            pieces.append(node[1])
+        elif kind == 'func':
+            pieces.append(node[1] + ' ')
+        elif kind == 'big':
+            pieces.append(['big', node[1]])
+        else:
+            pieces.append(render_node(node))
+        prev_operand = is_multiplicand(node)
+
+    merged = []
+    for piece in pieces:
+        if isinstance(piece, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += piece
+        else:
+            merged.append(piece)
+    return merged
+
+def render(nodes):
+    merged = render_sequence(nodes)
+    if not merged:
+        return ''
+    if len(merged) == 1:
+        return merged[0]
+    return ['concat'] + merged
+
+def render_node(node):
+    kind = node[0]
+    if kind == 'frac':
+        return ['frac', render(node[1]), render(node[2])]
+    if kind == 'sqrt':
+        return ['sqrt', render(node[1])]
+    if kind == 'text':
+        return ['text', node[1]]
+    if kind == 'around':
+        _, star, left, body, right = node
+        return ['around*' if star else 'around', left, render(body), right]
+    if kind == 'table':
+        return render_table(node)
+    raise Unsupported(f'无法渲染 {kind}')
+
+def render_table(node):
+    _, env, spec, rows = node
+    table = ['table'] + [['row'] + [['cell', render(cell)] for cell in row] for row in rows]
+    tformat = ['tformat']
+    if spec is not None:
+        for col, align in enumerate(spec, 1):
+            c = str(col)
+            tformat.append(['cwith', '1', '-1', c, c, 'cell-halign', align])
+            if col == 1:
+                tformat.append(['cwith', '1', '-1', c, c, 'cell-lborder', '0ln'])
+            if col == len(spec):
+                tformat.append(['cwith', '1', '-1', c, c, 'cell-rborder', '0ln'])
+    tformat.append(table)
+
+    if env == 'cases':
+        return ['choice', tformat]
+    if env == 'pmatrix':
+        return ['matrix', tformat]
+    if env == 'vmatrix':
+        return ['det', tformat]
+    if env == 'bmatrix':
+        return ['around*', '[', ['tabular*', tformat], ']']
+    return ['tabular*', tformat]
+
+def write_stree(tree):
+    """按 Scheme write 的格式输出 stree"""
+    if isinstance(tree, str):
+        return '"' + tree.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return '(' + ' '.join([tree[0]] + [write_stree(child) for child in tree[1:]]) + ')'
+
+def convert(latex):
+    """转换一条LaTeX表达式；空行返回空串，不支持时返回None"""
+    if not latex.strip():
+        return ''
+    try:
+        nodes = Parser(tokenize(latex)).parse()
+        return write_stree(['math', render(nodes)])
+    except (Unsupported, RecursionError):
+        return None
+
+def check_golden(latex_file, texmacs_file):
+    """逐行对照 moganstem 的转换结果，返回(一致, 不一致, 回退)计数"""
+    matched = mismatched = fallback = 0
+    with open(latex_file, 'r', encoding='utf-8') as fl, open(texmacs_file, 'r', encoding='utf-8') as ft:
+        for line_no, (latex, expected) in enumerate(zip(fl, ft), 1):
+            result = convert(latex.rstrip('\n'))
+            if result is None:
+                fallback += 1
+            elif result == expected.rstrip('\n'):
+                matched += 1
+            else:
+                mismatched += 1
+                print(f"第{line_no}行不一致：")
+                print(f"  期望: {expected.rstrip()[:200]}")
+                print(f"  得到: {result[:200]}")
+    return matched, mismatched, fallback
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("用法：python3 fast_latex2sexp.py complex_latex.txt complex_texmacs.txt")
+        print("对照已有的moganstem转换结果检查快速路径的正确性")
+        sys.exit(1)
+
+    matched, mismatched, fallback = check_golden(sys.argv[1], sys.argv[2])
+    total = matched + mismatched + fallback
+    print(f"共 {total} 行：一致 {matched}，不一致 {mismatched}，回退moganstem {fallback}")
+    sys.exit(1 if mismatched else 0)
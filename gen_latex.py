@@ -1,8 +1,19 @@
+import argparse
+import hashlib
+import math
+import os
 import random
+from contextlib import ExitStack
+from multiprocessing import Pool
+
+import fast_latex2sexp
 
 NUM_SAMPLES = 1000
 MAX_DEPTH = 4
 OUTPUT_RAW_TXT = "complex_latex.txt"
+NUM_WORKERS = 1
+WRITE_BUFFER = 1 << 20
+BLOOM_ERROR_RATE = 1e-4
 
 VARS = ['x', 'y', 'z', 't', '\\alpha', '\\beta', '\\theta', 'n', 'k', 'a', 'b']
 NUMS = ['1', '2', '0', '\\pi', '\\infty', 'e', '10']
@@ -11,47 +22,73 @@ FUNCS = ['\\sin', '\\cos', '\\log', '\\ln', '\\det']
 def get_atom():
     return random.choice(VARS + NUMS)
 
-def format_frac(num, den):
-    """随机分式写法"""
-    choices = [
-        f"\\frac{{{num}}}{{{den}}}",
-        f"{{{num} \\over {den}}}",
-        f"\\frac {num} {den}" if len(num)<2 and len(den)<2 else f"\\frac{{{num}}}{{{den}}}"
-    ]
-    return random.choice(choices)
-
-def format_group(content):
-    """随机括号写法"""
-    choices = [
-        f"\\left( {content} \\right)",
-        f"({content})",
-        f"\\left[ {content} \\right]",
-        f"\\left\\{{ {content} \\right\\}}"
-    ]
-    res = random.choice(choices)
-    if random.random() < 0.3:
+# ---------------------------------------------------------------------------
+# AST：所有随机选择（结构与写法噪声）都在建树时确定，渲染过程是确定的。
+#   ('atom', tex)                        ('op', 左, 运算符, 右)
+#   ('frac', 分子, 分母, 写法)           ('sqrt', 内容, 省略括号?)
+#   ('pow', 底数, 指数, 省略括号?, 空格?) ('sub', 变量, 下标)
+#   ('func', 函数, 内容, 括号写法, 加空格?)
+#   ('integral', 下限, 上限, 被积式, 积分变量)   下限/上限可为 None
+#   ('matrix', 环境, 行列表)              ('cases', 第一支, 第二支)
+# ---------------------------------------------------------------------------
+
+FRAC_STYLES = ['frac', 'over', 'short']
+GROUP_STYLES = ['left(', '(', 'left[', 'left{']
+
+def format_frac(num, den, style):
+    """分式写法"""
+    if style == 'over':
+        return f"{{{num} \\over {den}}}"
+    if style == 'short' and len(num) < 2 and len(den) < 2:
+        return f"\\frac {num} {den}"
+    return f"\\frac{{{num}}}{{{den}}}"
+
+def format_group(content, style, spaced):
+    """括号写法"""
+    choices = {
+        'left(': f"\\left( {content} \\right)",
+        '(': f"({content})",
+        'left[': f"\\left[ {content} \\right]",
+        'left{': f"\\left\\{{ {content} \\right\\}}",
+    }
+    res = choices[style]
+    if spaced:
         res = res.replace("(", "( ").replace(")", " )")
     return res
 
-def format_pow(base, exp):
-    """随机上下标写法"""
+def format_pow(base, exp, omit, gap):
+    """上下标写法"""
     can_omit_brace = len(exp) == 1 and not exp.startswith('\\')
-    
-    if can_omit_brace and random.random() > 0.5:
+
+    if can_omit_brace and omit:
         return f"{base}^{exp}"
     else:
-        gap = " " if random.random() < 0.3 else ""
-        return f"{base}^{gap}{{{exp}}}"
+        return f"{base}^{' ' if gap else ''}{{{exp}}}"
 
-def format_sqrt(content):
-    if random.random() < 0.3:
+def format_sqrt(content, bare):
+    if bare:
         return f"\\sqrt {content}" if len(content)==1 else f"\\sqrt{{{content}}}"
     return f"\\sqrt{{{content}}}"
 
-def gen_expr(depth):
+def has_bare_table(node):
+    """是否有未被上下标、分式或根式隔开的矩阵/cases"""
+    kind = node[0]
+    if kind in ('matrix', 'cases'):
+        return True
+    if kind == 'op':
+        return has_bare_table(node[1]) or has_bare_table(node[3])
+    if kind == 'pow':
+        return has_bare_table(node[1])
+    if kind == 'func':
+        return has_bare_table(node[2])
+    if kind == 'integral':
+        return has_bare_table(node[3])
+    return False
+
+def gen_ast(depth):
     """递归生成器"""
     if depth <= 0 or (depth < MAX_DEPTH and random.random() < 0.15):
-        return get_atom()
+        return ('atom', get_atom())
 
     structure_type = random.choice([
         'op', 'frac', 'sqrt', 'power', 'sub', 
@@ -61,69 +98,276 @@ def gen_expr(depth):
     try:
         if structure_type == 'op':
             op = random.choice(['+', '-', '=', '\\approx', '\\times', '\\cdot'])
-            sep = " "
-            return f"{gen_expr(depth-1)}{sep}{op}{sep}{gen_expr(depth-1)}"
+            return ('op', gen_ast(depth-1), op, gen_ast(depth-1))
         
         elif structure_type == 'frac':
-            return format_frac(gen_expr(depth-1), gen_expr(depth-1))
+            num, den = gen_ast(depth-1), gen_ast(depth-1)
+            style = random.choice(FRAC_STYLES)
+            # TeXmacs 对与环境同层的 \over 导入结果不稳定，此时改用 \frac
+            if style == 'over' and (has_bare_table(num) or has_bare_table(den)):
+                style = 'frac'
+            return ('frac', num, den, style)
         
         elif structure_type == 'sqrt':
-            return format_sqrt(gen_expr(depth-1))
+            return ('sqrt', gen_ast(depth-1), random.random() < 0.3)
         
         elif structure_type == 'power':
-            return format_pow(gen_expr(depth-1), gen_expr(depth-1))
+            base, exp = gen_ast(depth-1), gen_ast(depth-1)
+            return ('pow', base, exp, random.random() > 0.5, random.random() < 0.3)
 
         elif structure_type == 'sub':
-            return f"{random.choice(VARS)}_{{{gen_expr(depth-1)}}}"
+            return ('sub', random.choice(VARS), gen_ast(depth-1))
 
         elif structure_type == 'func':
-            return f"{random.choice(FUNCS)}{format_group(gen_expr(depth-1))}"
+            func = random.choice(FUNCS)
+            content = gen_ast(depth-1)
+            return ('func', func, content, random.choice(GROUP_STYLES), random.random() < 0.3)
 
         elif structure_type == 'integral':
             if random.random() < 0.5:
-                return f"\\int_{{{gen_expr(depth-2)}}}^{{{gen_expr(depth-2)}}} {gen_expr(depth-1)} d{random.choice(['x','t'])}"
+                lower, upper = gen_ast(depth-2), gen_ast(depth-2)
+                return ('integral', lower, upper, gen_ast(depth-1), random.choice(['x','t']))
             else:
-                return f"\\int {gen_expr(depth-1)} d{random.choice(['x','t'])}"
+                return ('integral', None, None, gen_ast(depth-1), random.choice(['x','t']))
 
         elif structure_type == 'matrix':
             env = random.choice(['pmatrix', 'bmatrix', 'vmatrix', 'array'])
             rows = random.randint(2, 3)
             cols = random.randint(2, 3)
-            content = ""
-            for r in range(rows):
-                row = [gen_expr(depth-2) for _ in range(cols)]
-                content += " & ".join(row)
-                if r < rows - 1:
-                    content += " \\\\ "
-            
-            if env == 'array':
-                align = "c" * cols
-                return f"\\begin{{array}}{{{align}}} {content} \\end{{array}}"
-            return f"\\begin{{{env}}} {content} \\end{{{env}}}"
+            return ('matrix', env, [[gen_ast(depth-2) for _ in range(cols)] for _ in range(rows)])
 
         elif structure_type == 'cases':
-            content = f"{gen_expr(depth-1)} & \\text{{if }} x > 0 \\\\ {gen_expr(depth-1)} & \\text{{otherwise}}"
-            return f"\\begin{{cases}} {content} \\end{{cases}}"
+            return ('cases', gen_ast(depth-1), gen_ast(depth-1))
 
     except RecursionError:
-        return get_atom()
-    return get_atom()
+        return ('atom', get_atom())
+    return ('atom', get_atom())
+
+def render_latex(node):
+    """AST -> 带噪声的LaTeX"""
+    kind = node[0]
+    if kind == 'atom':
+        return node[1]
+    if kind == 'op':
+        sep = " "
+        return f"{render_latex(node[1])}{sep}{node[2]}{sep}{render_latex(node[3])}"
+    if kind == 'frac':
+        return format_frac(render_latex(node[1]), render_latex(node[2]), node[3])
+    if kind == 'sqrt':
+        return format_sqrt(render_latex(node[1]), node[2])
+    if kind == 'pow':
+        return format_pow(render_latex(node[1]), render_latex(node[2]), node[3], node[4])
+    if kind == 'sub':
+        return f"{node[1]}_{{{render_latex(node[2])}}}"
+    if kind == 'func':
+        return f"{node[1]}{format_group(render_latex(node[2]), node[3], node[4])}"
+    if kind == 'integral':
+        _, lower, upper, body, var = node
+        if lower is not None:
+            return f"\\int_{{{render_latex(lower)}}}^{{{render_latex(upper)}}} {render_latex(body)} d{var}"
+        return f"\\int {render_latex(body)} d{var}"
+    if kind == 'matrix':
+        _, env, rows = node
+        content = " \\\\ ".join(" & ".join(render_latex(cell) for cell in row) for row in rows)
+        if env == 'array':
+            align = "c" * len(rows[0])
+            return f"\\begin{{array}}{{{align}}} {content} \\end{{array}}"
+        return f"\\begin{{{env}}} {content} \\end{{{env}}}"
+    if kind == 'cases':
+        content = f"{render_latex(node[1])} & \\text{{if }} x > 0 \\\\ {render_latex(node[2])} & \\text{{otherwise}}"
+        return f"\\begin{{cases}} {content} \\end{{cases}}"
+    raise ValueError(f"unknown node {kind}")
+
+def texmacs_atom(tex):
+    if tex.startswith('\\'):
+        return ('ord', fast_latex2sexp.SYMBOLS[tex[1:]])
+    return ('ord', tex)
+
+def texmacs_nodes(node):
+    """AST -> fast_latex2sexp 的节点序列（与 latex->texmacs 对渲染出的LaTeX的理解一致）"""
+    kind = node[0]
+    if kind == 'atom':
+        return [texmacs_atom(node[1])]
+    if kind == 'op':
+        op = node[2].lstrip('\\')
+        return texmacs_nodes(node[1]) + [('op', fast_latex2sexp.OPERATORS[op])] + texmacs_nodes(node[3])
+    if kind == 'frac':
+        return [('frac', texmacs_nodes(node[1]), texmacs_nodes(node[2]))]
+    if kind == 'sqrt':
+        return [('sqrt', texmacs_nodes(node[1]))]
+    if kind == 'pow':
+        return texmacs_nodes(node[1]) + [('script', 'rsup', texmacs_nodes(node[2]))]
+    if kind == 'sub':
+        return [texmacs_atom(node[1]), ('script', 'rsub', texmacs_nodes(node[2]))]
+    if kind == 'func':
+        _, func, content, style, _ = node
+        star = style.startswith('left')
+        left = style[-1]
+        right = {'(': ')', '[': ']', '{': '}'}[left]
+        return [('func', func[1:]), ('around', star, left, texmacs_nodes(content), right)]
+    if kind == 'integral':
+        _, lower, upper, body, var = node
+        nodes = [('big', 'int')]
+        if lower is not None:
+            nodes += [('script', 'rsub', texmacs_nodes(lower)), ('script', 'rsup', texmacs_nodes(upper))]
+        return nodes + texmacs_nodes(body) + [('ord', 'd'), ('ord', var)]
+    if kind == 'matrix':
+        _, env, rows = node
+        spec = "c" * len(rows[0]) if env == 'array' else None
+        return [('table', env, spec, [[texmacs_nodes(cell) for cell in row] for row in rows])]
+    if kind == 'cases':
+        condition = [('text', 'if '), ('ord', 'x'), ('op', '<gtr>'), ('ord', '0')]
+        rows = [[texmacs_nodes(node[1]), condition], [texmacs_nodes(node[2]), [('text', 'otherwise')]]]
+        return [('table', 'cases', None, rows)]
+    raise ValueError(f"unknown node {kind}")
+
+def render_texmacs(node):
+    """AST -> 规范 TeXmacs stree（与 complex_texmacs.txt 同格式）"""
+    return fast_latex2sexp.write_stree(['math', fast_latex2sexp.render(texmacs_nodes(node))])
+
+def gen_expr(depth):
+    """生成一条带噪声的LaTeX表达式"""
+    return render_latex(gen_ast(depth))
+
+def gen_sample(dual=False):
+    """生成一条长度达标的表达式（含数学模式定界符）；dual 时同时返回 TeXmacs stree"""
+    while True:
+        ast = gen_ast(MAX_DEPTH)
+        expr = render_latex(ast)
+        if len(expr) >= 20:
+            return f"${expr}$", (render_texmacs(ast) if dual else None)
+
+def expr_hash(expr):
+    """64位内容哈希，用于去重"""
+    return int.from_bytes(hashlib.blake2b(expr.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def derive_seed(master_seed, index):
+    """由主种子和分片编号派生子种子"""
+    return expr_hash(f"{master_seed}:{index}")
+
+class BloomFilter:
+    """基于64位哈希的布隆过滤器（双重哈希取k个位置）"""
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        capacity = max(1, capacity)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.k = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, h):
+        """加入哈希值；若此前（可能）已存在则返回False"""
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        new = False
+        for i in range(self.k):
+            pos = (h1 + i * h2) % self.size
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                new = True
+        return new
+
+def open_pair(stack, path, texmacs_path, mode):
+    """打开LaTeX文件以及（可选的）对齐的TeXmacs文件，由 stack 负责关闭"""
+    f = stack.enter_context(open(path, mode, encoding='utf-8', buffering=WRITE_BUFFER))
+    g = stack.enter_context(open(texmacs_path, mode, encoding='utf-8', buffering=WRITE_BUFFER)) if texmacs_path else None
+    return f, g
+
+def gen_shard(task):
+    """单个worker：用派生种子生成本分片内不重复的表达式并写出"""
+    index, count, seed, path, texmacs_path = task
+    random.seed(seed)
+    seen = BloomFilter(count)
+    written = 0
+    try:
+        with ExitStack() as stack:
+            f, g = open_pair(stack, path, texmacs_path, 'w')
+            while written < count:
+                expr, stree = gen_sample(dual=g is not None)
+                if seen.add(expr_hash(expr)):
+                    f.write(expr + "\n")
+                    if g is not None:
+                        g.write(stree + "\n")
+                    written += 1
+    except BaseException:
+        # 不留下不完整的分片
+        for shard in (path, texmacs_path):
+            if shard and os.path.exists(shard):
+                os.remove(shard)
+        raise
+    return path, texmacs_path
+
+def generate_sharded(num_samples, workers, master_seed, output, keep_shards=False, texmacs_output=None):
+    """多进程分片生成，再按分片顺序做跨分片去重并合并
+
+    结果只取决于 (master_seed, workers, num_samples)。跨分片的重复项被丢弃后，
+    由主进程用额外的派生种子补足数量。给出 texmacs_output 时同时写出逐行对齐的 stree。
+    """
+    base, extra = divmod(num_samples, workers)
+    tasks = [
+        (i, base + (1 if i < extra else 0), derive_seed(master_seed, i), f"{output}.shard-{i:03d}",
+         f"{texmacs_output}.shard-{i:03d}" if texmacs_output else None)
+        for i in range(workers)
+    ]
+    if workers > 1:
+        with Pool(workers) as pool:
+            shards = pool.map(gen_shard, tasks)
+    else:
+        shards = [gen_shard(task) for task in tasks]
+
+    seen = BloomFilter(num_samples)
+    written = dropped = 0
+    with ExitStack() as outputs:
+        out, out_texmacs = open_pair(outputs, output, texmacs_output, 'w')
+        for path, texmacs_path in shards:
+            with ExitStack() as inputs:
+                f, g = open_pair(inputs, path, texmacs_path, 'r')
+                for line in f:
+                    stree = next(g) if g is not None else None
+                    if seen.add(expr_hash(line.rstrip("\n"))):
+                        out.write(line)
+                        if out_texmacs is not None:
+                            out_texmacs.write(stree)
+                        written += 1
+                    else:
+                        dropped += 1
+            if not keep_shards:
+                os.remove(path)
+                if texmacs_path:
+                    os.remove(texmacs_path)
+
+        random.seed(derive_seed(master_seed, workers))
+        while written < num_samples:
+            expr, stree = gen_sample(dual=out_texmacs is not None)
+            if seen.add(expr_hash(expr)):
+                out.write(expr + "\n")
+                if out_texmacs is not None:
+                    out_texmacs.write(stree + "\n")
+                written += 1
+
+    return written, dropped
 
 def main():
-    print(f"Generating {NUM_SAMPLES} noisy LaTeX expressions...")
-    with open(OUTPUT_RAW_TXT, 'w', encoding='utf-8') as f:
-        unique_set = set()
-        while len(unique_set) < NUM_SAMPLES:
-            expr = gen_expr(MAX_DEPTH)
-            if len(expr) < 20: continue
-            
-            final_expr = f"${expr}$"
-            
-            if final_expr not in unique_set:
-                unique_set.add(final_expr)
-                f.write(final_expr + "\n")
-    
-    print(f"Saved raw noisy LaTeX to: {OUTPUT_RAW_TXT}")
+    parser = argparse.ArgumentParser(description="Generate noisy LaTeX math expressions.")
+    parser.add_argument("--samples", type=int, default=NUM_SAMPLES)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--seed", type=int, default=None,
+                        help="master seed; fixed seed + worker count gives identical output")
+    parser.add_argument("--output", default=OUTPUT_RAW_TXT)
+    parser.add_argument("--texmacs-output", default=None,
+                        help="also write the aligned TeXmacs stree for every line (e.g. complex_texmacs.txt)")
+    parser.add_argument("--keep-shards", action="store_true",
+                        help="keep the per-worker shard files next to the output")
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else int.from_bytes(os.urandom(4), 'little')
+    print(f"Generating {args.samples} noisy LaTeX expressions "
+          f"({args.workers} workers, seed {seed})...")
+    written, dropped = generate_sharded(args.samples, max(1, args.workers), seed,
+                                        args.output, args.keep_shards, args.texmacs_output)
+    print(f"Dropped {dropped} cross-shard duplicates")
+    print(f"Saved raw noisy LaTeX to: {args.output}")
+    if args.texmacs_output:
+        print(f"Saved aligned TeXmacs stree to: {args.texmacs_output}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
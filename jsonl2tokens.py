@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import sys
+from array import array
+
+# Export instruction/input/output JSONL records (tex2jsonl output) as flat,
+# memmap-able token arrays so training does not re-tokenize text every run.
+#
+# For a dataset written under <prefix> the files are:
+#   <prefix>.tokens.bin   uint16 (vocab <= 65536) or uint32 token ids, all records back to back
+#   <prefix>.offsets.bin  uint64, n_records + 1 entries; record i is tokens[off[i]:off[i+1]]
+#   <prefix>.prompt.bin   uint32, per record number of leading prompt tokens (instruction + input)
+#   <prefix>.meta.json    dtype, counts, the vocabulary used and the tokenizer backend
+#                         ("tokenizers", or "greedy" for the approximate --greedy mode)
+
+PROMPT_TEMPLATE = "{instruction}\n{input}"
+UNK_TOKENS = ("<unk>", "[UNK]", "<|unk|>")
+
+def bytes_to_unicode():
+    """GPT-2 byte-level alphabet: every byte maps to a printable character."""
+    bs = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, map(chr, cs)))
+
+def load_vocab(path):
+    """Read {token: id} from vocab.json, a HF tokenizer.json, or a one-token-per-line vocab.txt."""
+    if path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict) and 'model' in data:
+            model = data['model']
+            if isinstance(model.get('vocab'), dict):
+                # BPE, WordPiece and WordLevel: {token: id}
+                vocab = dict(model['vocab'])
+            elif model.get('type') == 'Unigram' and isinstance(model.get('vocab'), list):
+                # Unigram: [[piece, score], ...], the id is the position
+                vocab = {piece: i for i, (piece, _) in enumerate(model['vocab'])}
+            else:
+                raise ValueError(f"unsupported tokenizer model type {model.get('type')!r} in {path}")
+            for token in data.get('added_tokens', []):
+                vocab[token['content']] = token['id']
+            return vocab
+        return dict(data)
+    with open(path, 'r', encoding='utf-8') as f:
+        return {line.rstrip('\n'): i for i, line in enumerate(f)}
+
+class Tokenizer:
+    """Tokenize with a local vocabulary file.
+
+    A HF tokenizer.json is run through the `tokenizers` package, which gives the
+    model's exact ids. With greedy=True tokens are instead matched greedily
+    (longest first) against the vocabulary, in byte-level ("Ġ") or
+    SentencePiece ("▁") space convention as the vocabulary suggests; counts are
+    then close to, but not identical with, the real BPE segmentation, so the ids
+    are only fit for estimates. vocab.json and vocab.txt can only be used greedily.
+    """
+
+    def __init__(self, vocab_path, greedy=False):
+        self.vocab = load_vocab(vocab_path)
+        self.vocab_size = max(self.vocab.values()) + 1
+        self.backend = None
+        if not greedy:
+            if not vocab_path.endswith('tokenizer.json'):
+                raise ValueError(f"{vocab_path} is not a tokenizer.json; exact ids need one (or pass --greedy)")
+            try:
+                from tokenizers import Tokenizer as HFTokenizer
+            except ImportError:
+                raise RuntimeError("the `tokenizers` package is required for tokenizer.json "
+                                   "(pip install tokenizers, or pass --greedy)") from None
+            self.backend = HFTokenizer.from_file(vocab_path)
+        self.backend_name = "greedy" if greedy else "tokenizers"
+
+        self.byte_level = any('Ġ' in token for token in self.vocab)
+        self.sentencepiece = not self.byte_level and any('▁' in token for token in self.vocab)
+        self.byte_encoder = bytes_to_unicode() if self.byte_level else None
+        self.max_len = max(len(token) for token in self.vocab)
+        self.unk = next((self.vocab[t] for t in UNK_TOKENS if t in self.vocab), None)
+
+    def normalize(self, text):
+        if self.byte_level:
+            return ''.join(self.byte_encoder[b] for b in text.encode('utf-8'))
+        if self.sentencepiece:
+            return text.replace(' ', '▁')
+        return text
+
+    def encode(self, text):
+        if self.backend is not None:
+            return self.backend.encode(text, add_special_tokens=False).ids
+
+        text = self.normalize(text)
+        ids = []
+        i = 0
+        n = len(text)
+        vocab = self.vocab
+        while i < n:
+            for length in range(min(self.max_len, n - i), 0, -1):
+                token_id = vocab.get(text[i:i + length])
+                if token_id is not None:
+                    ids.append(token_id)
+                    i += length
+                    break
+            else:
+                if self.unk is None:
+                    raise ValueError(f"character {text[i]!r} is not in the vocabulary and it has no unk token")
+                ids.append(self.unk)
+                i += 1
+        return ids
+
+def export_dataset(input_file, prefix, tokenizer):
+    """Tokenize one JSONL dataset into <prefix>.* files and return its token counts."""
+    typecode = 'H' if tokenizer.vocab_size <= 1 << 16 else 'I'
+    offsets = array('Q', [0])
+    prompt_lengths = array('I')
+    total = prompt_total = records = 0
+
+    with open(input_file, 'r', encoding='utf-8') as fin, open(prefix + '.tokens.bin', 'wb') as ftok:
+        for line in fin:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            prompt = tokenizer.encode(PROMPT_TEMPLATE.format(instruction=entry['instruction'], input=entry['input']))
+            response = tokenizer.encode(entry['output'])
+            array(typecode, prompt + response).tofile(ftok)
+
+            total += len(prompt) + len(response)
+            prompt_total += len(prompt)
+            records += 1
+            offsets.append(total)
+            prompt_lengths.append(len(prompt))
+
+    with open(prefix + '.offsets.bin', 'wb') as f:
+        offsets.tofile(f)
+    with open(prefix + '.prompt.bin', 'wb') as f:
+        prompt_lengths.tofile(f)
+
+    stats = {
+        "source": os.path.basename(input_file),
+        "dtype": "uint16" if typecode == 'H' else "uint32",
+        "records": records,
+        "tokens": total,
+        "prompt_tokens": prompt_total,
+        "response_tokens": total - prompt_total,
+        "vocab_size": tokenizer.vocab_size,
+        "tokenizer_backend": tokenizer.backend_name,
+        "prompt_template": PROMPT_TEMPLATE,
+    }
+    with open(prefix + '.meta.json', 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=2)
+    return stats
+
+def load_shard(prefix):
+    """Open an exported dataset as (tokens, offsets, prompt_lengths) numpy memmaps."""
+    import numpy as np
+
+    with open(prefix + '.meta.json', 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    tokens = np.memmap(prefix + '.tokens.bin', dtype=meta['dtype'], mode='r')
+    offsets = np.memmap(prefix + '.offsets.bin', dtype=np.uint64, mode='r')
+    prompt_lengths = np.memmap(prefix + '.prompt.bin', dtype=np.uint32, mode='r')
+    return tokens, offsets, prompt_lengths
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-tokenize instruction/input/output JSONL datasets into memmap-able token arrays.",
+        epilog="Example: python jsonl2tokens.py tokenizer.json shards train_latex.jsonl train_texmacs.jsonl",
+    )
+    parser.add_argument("vocab", help="vocab.json, tokenizer.json or vocab.txt")
+    parser.add_argument("output_dir")
+    parser.add_argument("datasets", nargs="+", help="JSONL files produced by tex2jsonl.py")
+    parser.add_argument("--greedy", action="store_true",
+                        help="greedy longest-match against the vocabulary instead of the tokenizers package; "
+                             "ids only approximate the model's segmentation")
+    args = parser.parse_args()
+
+    for path in args.datasets:
+        if not os.path.exists(path):
+            print(f"Error: Input file '{path}' not found.")
+            sys.exit(1)
+
+    try:
+        tokenizer = Tokenizer(args.vocab, greedy=args.greedy)
+    except (RuntimeError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    os.makedirs(args.output_dir, exist_ok=True)
+    print(f"Vocabulary: {args.vocab} ({tokenizer.vocab_size} ids, "
+          f"{'tokenizers backend' if tokenizer.backend else 'greedy longest-match'})")
+    if args.greedy:
+        print("Warning: greedy ids approximate the model's segmentation; do not train on them")
+
+    print(f"\n{'dataset':<24}{'records':>10}{'prompt':>12}{'response':>12}{'total':>12}")
+    for path in args.datasets:
+        name = os.path.splitext(os.path.basename(path))[0]
+        stats = export_dataset(path, os.path.join(args.output_dir, name), tokenizer)
+        print(f"{name:<24}{stats['records']:>10}{stats['prompt_tokens']:>12}"
+              f"{stats['response_tokens']:>12}{stats['tokens']:>12}")
+    print(f"\nSaved to: {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,24 @@
 import sys
 import os
+import argparse
+import hashlib
+import json
+import shutil
 import subprocess
 import tempfile
+import threading
 import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
-# 路径配置
-MOGANSTEM_PATH = "/home/lty/mogan/build/linux/x86_64/release/moganstem"
-TEXMACS_PATH = "/home/lty/mogan/TeXmacs"
+import fast_latex2sexp
+from sexp_cache import ConversionCache, moganstem_version
+from sexp_cost import CostModel, best_plan
+
+# 路径配置（可用环境变量覆盖，便于替换为测试用的moganstem）
+MOGANSTEM_PATH = os.environ.get("MOGANSTEM_PATH", "/home/lty/mogan/build/linux/x86_64/release/moganstem")
+TEXMACS_PATH = os.environ.get("TEXMACS_PATH", "/home/lty/mogan/TeXmacs")
+SERVER_CRASH_LIMIT = 2  # 一行使常驻服务退出的次数达到该值即放弃
 
 def escape_latex_for_scheme(latex_str):
     """转义LaTeX字符串中的特殊字符"""
@@ -17,7 +29,10 @@ def escape_latex_for_scheme(latex_str):
     # 转义双引号
     latex = latex.replace('"', '\\"')
 
-    # 确保数学模式
+    return wrap_math_mode(latex)
+
+def wrap_math_mode(latex):
+    """确保数学模式"""
     if not latex.startswith('$'):
         latex = '$' + latex
     if not latex.endswith('$'):
@@ -25,8 +40,12 @@ def escape_latex_for_scheme(latex_str):
 
     return latex
 
-def generate_scheme_script(latex_lines, output_file_path):
-    """生成Scheme脚本，将结果写入文件"""
+def generate_scheme_script(latex_lines, output_file_path, timing_file_path=None):
+    """生成Scheme脚本，将结果写入文件
+
+    给出 timing_file_path 时，每条转换前后用 texmacs-time 计时，
+    以 "行号 毫秒" 的形式逐行写入该文件（行号从0开始，空行不计时）。
+    """
     scheme_lines = [
         ";; 批量LaTeX转换脚本 - 文件输出版本",
         ";; 自动生成 - 请勿手动编辑",
@@ -34,7 +53,11 @@ def generate_scheme_script(latex_lines, output_file_path):
     ]
 
     # 打开输出文件
-    scheme_lines.append(f'(let ((out-port (open-output-file "{output_file_path}")))')
+    if timing_file_path:
+        scheme_lines.append(f'(let ((out-port (open-output-file "{output_file_path}"))')
+        scheme_lines.append(f'      (time-port (open-output-file "{timing_file_path}")))')
+    else:
+        scheme_lines.append(f'(let ((out-port (open-output-file "{output_file_path}")))')
     scheme_lines.append('  (dynamic-wind')
     scheme_lines.append('    (lambda () #f)')
     scheme_lines.append('    (lambda ()')
@@ -47,13 +70,28 @@ def generate_scheme_script(latex_lines, output_file_path):
             continue
 
         escaped = escape_latex_for_scheme(latex)
-        # 执行转换并写入文件
-        scheme_lines.append(f'      (write (tree->stree (latex->texmacs (parse-latex "{escaped}"))) out-port)')
+        convert = f'(write (tree->stree (latex->texmacs (parse-latex "{escaped}"))) out-port)'
+        if timing_file_path:
+            # 计时并写入计时文件
+            scheme_lines.append('      (let ((start (texmacs-time)))')
+            scheme_lines.append(f'        {convert}')
+            scheme_lines.append(f'        (display "{i} " time-port)')
+            scheme_lines.append('        (write (- (texmacs-time) start) time-port)')
+            scheme_lines.append('        (newline time-port))')
+        else:
+            # 执行转换并写入文件
+            scheme_lines.append(f'      {convert}')
         scheme_lines.append('      (newline out-port)')
 
     # 关闭文件和处理
+    if timing_file_path:
+        scheme_lines.append('      (close-output-port time-port)')
     scheme_lines.append('      (close-output-port out-port))')
     scheme_lines.append('    (lambda ()')
+    if timing_file_path:
+        scheme_lines.append('      (if (port? time-port)')
+        scheme_lines.append('          (close-output-port time-port)')
+        scheme_lines.append('          #f)')
     scheme_lines.append('      (if (port? out-port)')
     scheme_lines.append('          (close-output-port out-port)')
     scheme_lines.append('          #f))))')
@@ -64,29 +102,529 @@ def generate_scheme_script(latex_lines, output_file_path):
 
     return '\n'.join(scheme_lines)
 
-def batch_convert(input_file, output_file, timeout=120):
-    """批量转换主函数"""
-    # 检查路径
-    if not os.path.exists(MOGANSTEM_PATH):
-        print(f"错误：moganstem未找到：{MOGANSTEM_PATH}")
-        return False
+def generate_server_script():
+    """生成常驻转换服务的Scheme脚本：逐行读取stdin，逐行输出结果"""
+    scheme_lines = [
+        ";; 常驻LaTeX转换服务 - 行协议版本",
+        ";; 自动生成 - 请勿手动编辑",
+        ";; 每读入一行LaTeX，输出一行 STREE <结果> 或 ERROR <信息>",
+        "",
+        "(define (serve-one line)",
+        "  (catch #t",
+        "    (lambda ()",
+        "      (let ((result (tree->stree (latex->texmacs (parse-latex line)))))",
+        '        (display "STREE ")',
+        "        (write result)))",
+        "    (lambda args",
+        '      (display "ERROR ")',
+        "      (write (car args))))",
+        "  (newline)",
+        "  (flush-output-port))",
+        "",
+        '(display "READY")',
+        "(newline)",
+        "(flush-output-port)",
+        "",
+        "(let loop ((line (read-line)))",
+        "  (if (not (eof-object? line))",
+        "      (begin",
+        "        (serve-one line)",
+        "        (loop (read-line)))))",
+        "",
+    ]
 
-    if not os.path.exists(TEXMACS_PATH):
-        print(f"错误：TeXmacs路径未找到：{TEXMACS_PATH}")
-        return False
+    return '\n'.join(scheme_lines)
 
-    # 读取输入
+def run_moganstem(scheme_file, timeout, extra_env=None):
+    """以headless批处理模式执行一个Scheme脚本（extra_env 覆盖额外的环境变量）"""
+    env = os.environ.copy()
+    env['TEXMACS_PATH'] = TEXMACS_PATH
+    if extra_env:
+        env.update(extra_env)
+
+    return subprocess.run(
+        [MOGANSTEM_PATH, '-headless', '-b', scheme_file, '-q'],
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+        check=False
+    )
+
+class ServerExitedError(RuntimeError):
+    """转换服务进程已退出；culprit 表示该行是进程退出时正在转换的那一行"""
+
+    def __init__(self, message, culprit=False):
+        super().__init__(message)
+        self.culprit = culprit
+
+class ConversionServer:
+    """常驻moganstem转换进程的客户端
+
+    只启动一次moganstem，之后每个表达式通过stdin发送、从stdout按行取回。
+    submit() 立即返回Future，结果按提交顺序由后台线程填充。
+    """
+
+    READY_MARK = "READY"
+    RESULT_PREFIX = "STREE "
+    ERROR_PREFIX = "ERROR "
+
+    def __init__(self, startup_timeout=120):
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._reader = None
+        self._script_file = None
+        self._exited = False
+
+    def start(self):
+        """启动moganstem并等待服务就绪"""
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.scm', delete=False, encoding='utf-8') as f:
+            f.write(generate_server_script())
+            self._script_file = f.name
+
+        env = os.environ.copy()
+        env['TEXMACS_PATH'] = TEXMACS_PATH
+
+        self.process = subprocess.Popen(
+            [MOGANSTEM_PATH, '-headless', '-b', self._script_file, '-q'],
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding='utf-8',
+            bufsize=1,
+        )
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+        if not self._ready.wait(self.startup_timeout) or self.process.poll() is not None:
+            self.close()
+            raise RuntimeError("moganstem转换服务启动失败或超时")
+        return self
+
+    def _read_loop(self):
+        """后台读取stdout，按FIFO顺序完成挂起的Future"""
+        for line in self.process.stdout:
+            line = line.rstrip('\n')
+            if not self._ready.is_set():
+                # 忽略TeXmacs启动时的输出
+                if line.strip() == self.READY_MARK:
+                    self._ready.set()
+                continue
+
+            if line.startswith(self.RESULT_PREFIX):
+                with self._lock:
+                    future = self._pending.popleft()
+                future.set_result(line[len(self.RESULT_PREFIX):])
+            elif line.startswith(self.ERROR_PREFIX):
+                with self._lock:
+                    future = self._pending.popleft()
+                future.set_exception(RuntimeError(f"转换失败：{line[len(self.ERROR_PREFIX):]}"))
+
+        # 进程退出：唤醒等待者并让剩余请求失败，队首即退出时正在转换的一行
+        self._ready.set()
+        with self._lock:
+            pending, self._pending = self._pending, deque()
+            self._exited = True
+        for i, future in enumerate(pending):
+            future.set_exception(ServerExitedError("moganstem转换服务已退出", culprit=i == 0))
+
+    def submit(self, latex):
+        """异步提交一条LaTeX表达式，返回Future[str]"""
+        future = Future()
+        if not latex.strip():
+            # 空行直接返回空结果，与批处理脚本一致
+            future.set_result("")
+            return future
+
+        request = wrap_math_mode(latex.strip().replace('\n', ' '))
+        with self._lock:
+            if self._exited:
+                future.set_exception(ServerExitedError("moganstem转换服务已退出"))
+                return future
+            self._pending.append(future)
+            try:
+                self.process.stdin.write(request + '\n')
+                self.process.stdin.flush()
+            except OSError:
+                # 进程已退出但读线程尚未收尾：该请求随剩余请求一起失败
+                pass
+        return future
+
+    def alive(self):
+        return self.process is not None and not self._exited and self.process.poll() is None
+
+    def kill(self):
+        """强制结束卡住的进程，读线程随之让挂起的请求失败"""
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+
+    def convert(self, latex, timeout=None):
+        """同步转换一条LaTeX表达式"""
+        return self.submit(latex).result(timeout)
+
+    def close(self):
+        """关闭stdin让Scheme循环结束，并回收进程"""
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            if self._reader is not None:
+                self._reader.join()
+            self.process = None
+
+        if self._script_file:
+            try:
+                os.unlink(self._script_file)
+            except OSError:
+                pass
+            self._script_file = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+def server_convert(latex_lines, output_file, timeout=120, workers=1):
+    """通过常驻转换服务转换，多个服务时轮流分发，按原始行序写出
+
+    某个服务进程退出时重启它，并把其上未完成的行重新分发；进程退出时正在转换的行
+    累计使进程退出 SERVER_CRASH_LIMIT 次后记为失败。转换超时的服务视为已卡死，
+    结束并按同样的方式处理。
+    """
+    servers = [ConversionServer() for _ in range(max(1, workers))]
+    results = [None] * len(latex_lines)
+    crashes = [0] * len(latex_lines)
+    errors = 0
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            latex_lines = [line.rstrip('\n') for line in f]
-    except Exception as e:
-        print(f"读取输入文件失败：{e}")
-        return False
+        for server in servers:
+            server.start()
+
+        todo = list(range(len(latex_lines)))
+        while todo:
+            futures = []
+            for k, i in enumerate(todo):
+                server = servers[k % len(servers)]
+                futures.append((i, server, server.submit(latex_lines[i])))
+            retry = []
+            progress = False
+            for i, server, future in futures:
+                try:
+                    results[i] = future.result(timeout)
+                    progress = True
+                except (ServerExitedError, TimeoutError) as e:
+                    if isinstance(e, TimeoutError):
+                        # 服务卡死：结束进程，其后排队的行随之失败并重新分发
+                        server.kill()
+                    if isinstance(e, TimeoutError) or e.culprit:
+                        crashes[i] += 1
+                        progress = True
+                    if crashes[i] < SERVER_CRASH_LIMIT:
+                        retry.append(i)
+                        continue
+                    errors += 1
+                    print(f"警告：第{i + 1}行使转换服务退出或超时 {crashes[i]} 次，已跳过")
+                except Exception as e:
+                    # 失败的行以空行占位，保持与输入行对齐
+                    errors += 1
+                    print(f"警告：第{i + 1}行{e}")
+
+            if retry and not progress:
+                # 服务反复退出却定位不到问题行：放弃剩余的行
+                errors += len(retry)
+                print(f"警告：转换服务反复退出，{len(retry)} 行未能转换")
+                break
+            for k, server in enumerate(servers):
+                if not server.alive():
+                    print("警告：转换服务已退出，重新启动")
+                    server.close()
+                    servers[k] = ConversionServer().start()
+            todo = retry
+
+        with open(output_file, 'w', encoding='utf-8') as out:
+            for result in results:
+                out.write((result or '') + '\n')
+
+        if errors:
+            print(f"警告：{errors} 行转换失败")
+        return errors == 0
+    finally:
+        for server in servers:
+            server.close()
+
+def split_shards(latex_lines, workers):
+    """按原始顺序把输入行切成至多workers个连续分片"""
+    workers = max(1, min(workers, len(latex_lines)))
+    size, extra = divmod(len(latex_lines), workers)
+    shards = []
+    start = 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        shards.append(latex_lines[start:end])
+        start = end
+    return shards
+
+def convert_shard(index, shard_lines, work_dir, timeout):
+    """转换单个分片：独立的Scheme脚本和输出分片文件"""
+    shard_output = os.path.join(work_dir, f"shard-{index:04d}.out")
+    scheme_file = os.path.join(work_dir, f"shard-{index:04d}.scm")
+    with open(scheme_file, 'w', encoding='utf-8') as f:
+        f.write(generate_scheme_script(shard_lines, shard_output))
+    if os.path.exists(shard_output):
+        os.unlink(shard_output)
 
-    total_lines = len(latex_lines)
-    non_empty = sum(1 for line in latex_lines if line.strip())
-    print(f"读取 {total_lines} 行，其中 {non_empty} 行非空")
+    try:
+        result = run_moganstem(scheme_file, timeout)
+    except subprocess.TimeoutExpired:
+        return index, None, f"分片{index}超时（{timeout}秒）"
+
+    if not os.path.exists(shard_output):
+        return index, None, f"分片{index}未生成输出，返回码: {result.returncode}"
+
+    with open(shard_output, 'r', encoding='utf-8') as f:
+        lines = [line.rstrip('\n') for line in f]
 
+    message = None
+    if result.returncode != 0:
+        message = f"分片{index}返回非零代码: {result.returncode}"
+    return index, lines, message
+
+def parallel_convert(latex_lines, output_file, timeout=120, workers=2):
+    """多个moganstem进程并行转换，按原始行序合并分片"""
+    shards = split_shards(latex_lines, workers)
+    work_dir = tempfile.mkdtemp(prefix='latex2sexp-')
+    print(f"分为 {len(shards)} 个分片，工作目录: {work_dir}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            futures = [
+                pool.submit(convert_shard, i, shard, work_dir, timeout)
+                for i, shard in enumerate(shards)
+            ]
+            results = sorted(future.result() for future in futures)
+
+        failed = False
+        with open(output_file, 'w', encoding='utf-8') as out:
+            for (index, lines, message), shard in zip(results, shards):
+                if message:
+                    print(f"警告：{message}")
+                if lines is None:
+                    # 失败的分片以空行占位，保持与输入行对齐
+                    failed = True
+                    lines = [''] * len(shard)
+                if len(lines) != len(shard):
+                    print(f"警告：分片{index}输出行数({len(lines)})与输入行数({len(shard)})不匹配")
+                for line in lines:
+                    out.write(line + '\n')
+
+        return not failed
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def balanced_convert(latex_lines, output_file, cost_model, timeout=120, workers=2):
+    """按预测代价均衡分批并行转换：代价大的批次先提交，按原始行号写回
+
+    批次数连同每批的启动开销一起按预测总耗时选取（与 sexp_cost.py plan 相同）；
+    预测不优于按行数等分的连续分片时退回 parallel_convert。
+    """
+    costs = [cost_model.predict(latex) for latex in latex_lines]
+    batches, predicted, contiguous = best_plan(costs, workers, cost_model.startup)
+    model_name = '已校准' if cost_model.calibrated else '未校准'
+    if batches is None:
+        print(f"均衡分批预测不优于等行数分片（{model_name}模型，{contiguous / 1000:.1f} 秒），使用连续分片")
+        return parallel_convert(latex_lines, output_file, timeout, workers)
+    work_dir = tempfile.mkdtemp(prefix='latex2sexp-')
+    print(f"按预测代价分为 {len(batches)} 批（{model_name}模型），预测 {predicted / 1000:.1f} 秒"
+          f"（等行数分片 {contiguous / 1000:.1f} 秒），工作目录: {work_dir}")
+
+    try:
+        results = [''] * len(latex_lines)
+        failed = False
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = [
+                pool.submit(convert_shard, i, [latex_lines[j] for j in members], work_dir, timeout)
+                for i, (_, members) in enumerate(batches)
+            ]
+            for future, (_, members) in zip(futures, batches):
+                index, lines, message = future.result()
+                if message:
+                    print(f"警告：{message}")
+                if lines is None:
+                    # 失败的批次以空行占位，保持与输入行对齐
+                    failed = True
+                    continue
+                if len(lines) != len(members):
+                    print(f"警告：分片{index}输出行数({len(lines)})与输入行数({len(members)})不匹配")
+                for j, line in zip(members, lines):
+                    results[j] = line
+
+        with open(output_file, 'w', encoding='utf-8') as out:
+            for line in results:
+                out.write(line + '\n')
+        return not failed
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def try_convert_chunk(start, chunk_lines, work_dir, timeout):
+    """转换一个分块，任何超时、非零返回码或行数不符都视为失败（返回None）"""
+    _, lines, message = convert_shard(start, chunk_lines, work_dir, timeout)
+    if message or lines is None or len(lines) != len(chunk_lines):
+        return None
+    return lines
+
+def isolate_failures(start, chunk_lines, work_dir, timeout, failures):
+    """二分定位失败分块中的问题行：问题行以空行占位，其余行照常输出"""
+    results = try_convert_chunk(start, chunk_lines, work_dir, timeout)
+    if results is not None:
+        return results
+
+    if len(chunk_lines) == 1:
+        failures.append(start)
+        return ['']
+
+    mid = len(chunk_lines) // 2
+    return (isolate_failures(start, chunk_lines[:mid], work_dir, timeout, failures)
+            + isolate_failures(start + mid, chunk_lines[mid:], work_dir, timeout, failures))
+
+def convert_chunk(start, chunk_lines, work_dir, timeout):
+    """转换一个分块，失败时自动二分，返回(结果行, 问题行号列表)"""
+    failures = []
+    results = isolate_failures(start, chunk_lines, work_dir, timeout, failures)
+    return results, failures
+
+def load_checkpoint(checkpoint_file, input_digest, chunk_size):
+    """读取检查点；输入或分块大小变化时视为无效"""
+    if not checkpoint_file or not os.path.exists(checkpoint_file):
+        return None
+    try:
+        with open(checkpoint_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('input') != input_digest or state.get('chunk_size') != chunk_size:
+        print("检查点与当前输入不匹配，忽略并从头开始")
+        return None
+    return state
+
+def file_covers(path, size):
+    """path 存在且至少有检查点记录的 size 字节"""
+    return size is not None and os.path.exists(path) and os.path.getsize(path) >= size
+
+def save_checkpoint(checkpoint_file, state):
+    """原子地写入检查点"""
+    tmp_file = checkpoint_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, checkpoint_file)
+
+def chunked_convert(latex_lines, output_file, timeout=120, workers=1, chunk_size=1000,
+                    checkpoint_file=None, errors_file=None, on_chunk=None):
+    """分块转换：每块独立超时，按块写出并记录检查点，中断后可续跑
+
+    失败的块自动二分到具体行，问题行写入errors_file并在输出中以空行占位，
+    输出始终与输入逐行对齐。on_chunk(块输入行, 块结果行) 在每块写出后调用。
+    有行转换失败时返回False。
+    """
+    digest = hashlib.sha256('\n'.join(latex_lines).encode('utf-8')).hexdigest()
+    state = load_checkpoint(checkpoint_file, digest, chunk_size)
+    if state is not None and not (
+            file_covers(output_file, state['output_bytes'])
+            and (not errors_file or file_covers(errors_file, state.get('errors_bytes')))):
+        print("检查点之前的输出已缺失或不完整，忽略检查点并从头开始")
+        state = None
+    if state is None:
+        state = {'input': digest, 'chunk_size': chunk_size,
+                 'lines_done': 0, 'output_bytes': 0, 'errors_bytes': 0, 'errors': 0}
+        mode = 'w'
+    else:
+        print(f"从检查点恢复：已完成 {state['lines_done']} 行")
+        mode = 'r+'
+
+    starts = range(state['lines_done'], len(latex_lines), chunk_size)
+    print(f"分块执行：每块 {chunk_size} 行，剩余 {len(starts)} 块，每块超时 {timeout} 秒")
+
+    work_dir = tempfile.mkdtemp(prefix='latex2sexp-')
+    errors = open(errors_file, mode, encoding='utf-8', newline='\n') if errors_file else None
+    try:
+        if errors is not None:
+            # 与输出一样，截掉上次中断时检查点之后写出的问题行
+            errors.seek(state['errors_bytes'])
+            errors.truncate()
+        with open(output_file, mode, encoding='utf-8', newline='\n') as out, \
+                ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            # 截掉上次中断时检查点之后写出的部分
+            out.seek(state['output_bytes'])
+            out.truncate()
+
+            chunks = pool.map(
+                lambda start: convert_chunk(start, latex_lines[start:start + chunk_size], work_dir, timeout),
+                starts,
+            )
+            for start, (results, failures) in zip(starts, chunks):
+                for line in results:
+                    out.write(line + '\n')
+                out.flush()
+
+                for line_no in failures:
+                    print(f"警告：第{line_no + 1}行转换失败，已记录")
+                    if errors is not None:
+                        errors.write(json.dumps({'line': line_no + 1, 'latex': latex_lines[line_no]},
+                                                ensure_ascii=False) + '\n')
+                if errors is not None:
+                    errors.flush()
+
+                if on_chunk is not None:
+                    on_chunk(latex_lines[start:start + chunk_size], results)
+
+                state['lines_done'] = start + len(results)
+                state['output_bytes'] = out.tell()
+                state['errors_bytes'] = errors.tell() if errors is not None else 0
+                state['errors'] += len(failures)
+                if checkpoint_file:
+                    save_checkpoint(checkpoint_file, state)
+    finally:
+        if errors is not None:
+            errors.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if state['errors']:
+        print(f"警告：共 {state['errors']} 行转换失败" + (f"，详见 {errors_file}" if errors_file else ""))
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        os.unlink(checkpoint_file)
+    return state['errors'] == 0
+
+def report_output(output_file, total_lines):
+    """显示输出示例并检查行数"""
+    with open(output_file, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    print(f"输出文件包含 {len(lines)} 行")
+
+    # 显示示例
+    if lines:
+        print("\n前3个转换结果:")
+        for i, line in enumerate(lines[:3], 1):
+            line = line.rstrip('\n')
+            print(f"{i}. {line[:80]}{'...' if len(line) > 80 else ''}")
+
+    # 验证行数
+    if len(lines) != total_lines:
+        print(f"警告：输出行数({len(lines)})与输入行数({total_lines})不匹配")
+        print("可能是某些转换失败或产生了多行输出")
+
+def single_convert(latex_lines, output_file, timeout=120):
+    """单个moganstem进程转换全部输入行"""
     # 创建临时Scheme脚本
     scheme_code = generate_scheme_script(latex_lines, output_file)
 
@@ -98,20 +636,9 @@ def batch_convert(input_file, output_file, timeout=120):
     print(f"输出将直接写入: {output_file}")
 
     try:
-        # 设置环境
-        env = os.environ.copy()
-        env['TEXMACS_PATH'] = TEXMACS_PATH
-
         # 执行moganstem
         print("执行转换...（可能需要一些时间，取决于表达式数量和复杂度）")
-        result = subprocess.run(
-            [MOGANSTEM_PATH, '-headless', '-b', scheme_file, '-q'],
-            env=env,
-            capture_output=True,
-            text=True,
-            timeout=timeout,
-            check=False
-        )
+        result = run_moganstem(scheme_file, timeout)
 
         print(f"执行完成，返回码: {result.returncode}")
 
@@ -122,23 +649,6 @@ def batch_convert(input_file, output_file, timeout=120):
 
         # 检查输出文件
         if os.path.exists(output_file):
-            with open(output_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            print(f"输出文件包含 {len(lines)} 行")
-
-            # 显示示例
-            if lines:
-                print("\n前3个转换结果:")
-                for i, line in enumerate(lines[:3], 1):
-                    line = line.rstrip('\n')
-                    print(f"{i}. {line[:80]}{'...' if len(line) > 80 else ''}")
-
-            # 验证行数
-            if len(lines) != total_lines:
-                print(f"警告：输出行数({len(lines)})与输入行数({total_lines})不匹配")
-                print("可能是某些转换失败或产生了多行输出")
-
             return True
         else:
             print(f"错误：输出文件未创建: {output_file}")
@@ -149,9 +659,6 @@ def batch_convert(input_file, output_file, timeout=120):
         print(f"错误：转换超时（{timeout}秒）")
         print("建议：增加超时时间或减少批量大小")
         return False
-    except Exception as e:
-        print(f"转换过程中出错：{e}")
-        return False
     finally:
         # 清理临时文件
         try:
@@ -159,31 +666,249 @@ def batch_convert(input_file, output_file, timeout=120):
         except:
             pass
 
-def main():
-    if len(sys.argv) != 3:
-        print("用法：python3 latex_to_scheme_final.py 输入文件.txt 输出文件.scm")
-        print("示例：python3 latex_to_scheme_final.py latex.txt results.scm")
-        print("\n选项：")
-        print("  输入文件：每行一条LaTeX表达式")
-        print("  输出文件：每行一个S-expression结果")
-        sys.exit(1)
+def convert_lines(latex_lines, output_file, timeout=120, workers=1, server=False,
+                  chunk_size=0, checkpoint_file=None, errors_file=None, on_chunk=None,
+                  cost_model=None):
+    """按所选模式把latex_lines转换到output_file，输出与输入逐行对齐
+
+    给出 cost_model 时，多进程模式按预测代价均衡分批，而不是按行数等分。
+    """
+    if chunk_size > 0:
+        return chunked_convert(latex_lines, output_file, timeout, workers, chunk_size,
+                               checkpoint_file, errors_file, on_chunk)
+
+    if server:
+        print(f"通过常驻转换服务执行转换（{workers} 个moganstem进程）...")
+        return server_convert(latex_lines, output_file, timeout, workers)
+
+    if workers > 1 and len(latex_lines) > 1:
+        print(f"并行执行转换（{workers} 个moganstem进程）...")
+        if cost_model is not None:
+            return balanced_convert(latex_lines, output_file, cost_model, timeout, workers)
+        return parallel_convert(latex_lines, output_file, timeout, workers)
+
+    return single_convert(latex_lines, output_file, timeout)
+
+def write_errors(errors_file, latex_lines, results):
+    """以原始输入行号记录转换失败（非空输入却无结果）的行"""
+    with open(errors_file, 'w', encoding='utf-8') as errors:
+        for line_no, (latex, result) in enumerate(zip(latex_lines, results), 1):
+            if latex.strip() and not result:
+                errors.write(json.dumps({'line': line_no, 'latex': latex}, ensure_ascii=False) + '\n')
+
+def fast_convert(latex_lines, output_file, convert_rest, workers=1, errors_file=None):
+    """先用纯Python快速路径转换，只把它不支持的表达式交给 convert_rest(行, 输出文件)"""
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(fast_latex2sexp.convert, latex_lines, chunksize=256))
+    else:
+        results = [fast_latex2sexp.convert(latex) for latex in latex_lines]
+
+    rest = [latex for latex, result in zip(latex_lines, results) if result is None]
+    print(f"快速路径转换 {len(latex_lines) - len(rest)} 行，{len(rest)} 行回退moganstem")
+
+    ok = True
+    if rest:
+        # 固定的回退输出路径，使分块模式的检查点在重跑时依然有效
+        rest_output = output_file + '.fallback'
+        ok = convert_rest(rest, rest_output)
+        converted = []
+        if os.path.exists(rest_output):
+            with open(rest_output, 'r', encoding='utf-8') as f:
+                converted = [line.rstrip('\n') for line in f]
+            os.unlink(rest_output)
+        converted = iter(converted)
+        results = [next(converted, '') if result is None else result for result in results]
+
+    with open(output_file, 'w', encoding='utf-8') as out:
+        for result in results:
+            out.write(result + '\n')
+
+    if errors_file:
+        write_errors(errors_file, latex_lines, results)
+    return ok
+
+def cached_convert(latex_lines, output_file, cache, timeout=120, workers=1, server=False,
+                   chunk_size=0, errors_file=None, cost_model=None):
+    """只把缓存未命中的表达式（去重后）送入moganstem，再按原始行序写出"""
+    results = {}
+    misses = []
+    hits = 0
+    for latex in latex_lines:
+        if not latex.strip() or latex in results:
+            continue
+        cached = cache.get(latex)
+        if cached is None:
+            results[latex] = None
+            misses.append(latex)
+        else:
+            results[latex] = cached
+            hits += 1
+
+    ok = True
+    if misses:
+        print(f"缓存未命中 {len(misses)} 条，送入moganstem转换")
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.out', delete=False) as f:
+            miss_output = f.name
+        def store_chunk(chunk_lines, chunk_results):
+            # 分块模式下每块写入缓存，中断后重跑只会转换剩余的未命中项
+            for latex, result in zip(chunk_lines, chunk_results):
+                if result.strip():
+                    cache.put(latex, result)
+            cache.commit()
+
+        try:
+            ok = convert_lines(misses, miss_output, timeout, workers, server,
+                               chunk_size, None, None, store_chunk, cost_model)
+            if os.path.exists(miss_output):
+                with open(miss_output, 'r', encoding='utf-8') as f:
+                    converted = [line.rstrip('\n') for line in f]
+                for latex, result in zip(misses, converted):
+                    if result.strip():
+                        results[latex] = result
+                        cache.put(latex, result)
+        finally:
+            os.unlink(miss_output)
+    cache.commit()
+
+    with open(output_file, 'w', encoding='utf-8') as out:
+        for latex in latex_lines:
+            out.write((results.get(latex) or '') + '\n')
+
+    if errors_file:
+        write_errors(errors_file, latex_lines, [results.get(latex) for latex in latex_lines])
+
+    lookups = hits + len(misses)
+    rate = hits / lookups if lookups else 0.0
+    print(f"缓存统计：命中 {hits} 条，未命中 {len(misses)} 条（命中率 {rate:.1%}）")
+    return ok
+
+def moganstem_available():
+    """检查moganstem与TeXmacs路径"""
+    if not os.path.exists(MOGANSTEM_PATH):
+        print(f"错误：moganstem未找到：{MOGANSTEM_PATH}")
+        return False
+
+    if not os.path.exists(TEXMACS_PATH):
+        print(f"错误：TeXmacs路径未找到：{TEXMACS_PATH}")
+        return False
+
+    return True
+
+def batch_convert(input_file, output_file, timeout=120, workers=1, server=False, cache_path=None,
+                  chunk_size=0, fast=False, cost_model=None):
+    """批量转换主函数"""
+    # 检查路径（快速路径模式下仅在需要回退时检查）
+    if not fast and not moganstem_available():
+        return False
+
+    # 读取输入
+    try:
+        with open(input_file, 'r', encoding='utf-8') as f:
+            latex_lines = [line.rstrip('\n') for line in f]
+    except Exception as e:
+        print(f"读取输入文件失败：{e}")
+        return False
 
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+    total_lines = len(latex_lines)
+    non_empty = sum(1 for line in latex_lines if line.strip())
+    print(f"读取 {total_lines} 行，其中 {non_empty} 行非空")
+
+    # 分块模式的检查点和问题行记录放在输出文件旁边
+    errors_file = output_file + '.errors.jsonl' if chunk_size > 0 else None
+    checkpoint_file = output_file + '.ckpt' if chunk_size > 0 else None
+
+    def convert_with_moganstem(lines, target, errors_file):
+        if not moganstem_available():
+            return False
+        if cache_path:
+            with ConversionCache(cache_path, moganstem_version(MOGANSTEM_PATH, TEXMACS_PATH)) as cache:
+                print(f"使用转换缓存: {cache_path}（{len(cache)} 条）")
+                return cached_convert(lines, target, cache, timeout, workers, server,
+                                      chunk_size, errors_file, cost_model)
+        return convert_lines(lines, target, timeout, workers, server,
+                             chunk_size, checkpoint_file, errors_file, cost_model=cost_model)
+
+    try:
+        if fast:
+            # 回退部分的问题行由 fast_convert 按原始行号统一记录
+            ok = fast_convert(latex_lines, output_file,
+                              lambda lines, target: convert_with_moganstem(lines, target, None),
+                              workers, errors_file)
+        else:
+            ok = convert_with_moganstem(latex_lines, output_file, errors_file)
+    except Exception as e:
+        print(f"转换过程中出错：{e}")
+        return False
+
+    if os.path.exists(output_file):
+        report_output(output_file, total_lines)
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="批量LaTeX到Scheme S-expression转换",
+        epilog="示例：python3 latex2sexp.py latex.txt results.scm --workers 8",
+    )
+    parser.add_argument("input_file", help="输入文件：每行一条LaTeX表达式")
+    parser.add_argument("output_file", help="输出文件：每行一个S-expression结果")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="并行moganstem进程数（默认1）")
+    parser.add_argument("--timeout", type=int, default=120,
+                        help="每个moganstem进程（分块模式下为每块）的超时秒数（默认120）")
+    parser.add_argument("--chunk-size", type=int, default=0,
+                        help="分块执行的每块行数；启用后支持检查点续跑和问题行自动隔离")
+    parser.add_argument("--cache", metavar="PATH",
+                        help="SQLite转换缓存文件，只有未命中的表达式送入moganstem")
+    parser.add_argument("--fast", action="store_true",
+                        help="先用纯Python快速路径转换gen_latex子集，其余回退moganstem")
+    parser.add_argument("--server", action="store_true",
+                        help="使用常驻转换服务（逐行协议），避免重复启动TeXmacs")
+    parser.add_argument("--balance", action="store_true",
+                        help="多进程时按预测转换代价均衡分批，代价大的批次先转换")
+    parser.add_argument("--cost-model", metavar="PATH",
+                        help="sexp_cost.py calibrate 生成的代价模型（隐含 --balance）")
+    args = parser.parse_args()
+
+    input_file = args.input_file
+    output_file = args.output_file
 
     if not os.path.exists(input_file):
         print(f"输入文件不存在：{input_file}")
         sys.exit(1)
 
+    cost_model = None
+    if (args.balance or args.cost_model) and (args.chunk_size > 0 or args.server):
+        print("错误：--balance/--cost-model 只用于多进程文件模式，不能与 --chunk-size 或 --server 同时使用")
+        sys.exit(1)
+    if (args.balance or args.cost_model) and args.workers <= 1:
+        print("警告：--workers 为 1 时不分批，--balance/--cost-model 无效")
+    elif args.cost_model:
+        try:
+            cost_model = CostModel.load(args.cost_model)
+        except (OSError, ValueError) as e:
+            print(f"读取代价模型失败：{e}")
+            sys.exit(1)
+    elif args.balance:
+        cost_model = CostModel()
+
     print("批量LaTeX到Scheme S-expression转换（文件输出版）")
     print("=" * 60)
     print(f"输入文件: {input_file} ({os.path.getsize(input_file)} 字节)")
     print(f"输出文件: {output_file}")
     print(f"moganstem路径: {MOGANSTEM_PATH}")
-    print(f"超时时间: 120秒")
+    print(f"并行进程数: {args.workers}")
+    print(f"常驻服务模式: {'是' if args.server else '否'}")
+    print(f"转换缓存: {args.cache or '未启用'}")
+    print(f"分块大小: {args.chunk_size or '不分块'}")
+    print(f"快速路径: {'启用' if args.fast else '未启用'}")
+    print(f"均衡分批: {args.cost_model or ('粗略代价模型' if cost_model else '未启用')}")
+    print(f"超时时间: {args.timeout}秒")
     print("=" * 60)
 
-    if batch_convert(input_file, output_file, timeout=120):
+    if batch_convert(input_file, output_file, timeout=args.timeout,
+                     workers=args.workers, server=args.server, cache_path=args.cache,
+                     chunk_size=args.chunk_size, fast=args.fast, cost_model=cost_model):
         print("\n✅ 转换成功完成！")
         print(f"结果保存在: {output_file}")
     else:
@@ -0,0 +1,176 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Convergence-aware LaTeX build for arXiv-submission (replaces the fixed
+# pdflatex -> bibtex -> pdflatex -> pdflatex sequence of build.bat).
+#
+# - Nothing runs when no input (main .tex, sec/*.tex, .bib/.sty/.cls/.bst, figures)
+#   changed since the last successful build and the PDF is still there.
+# - bibtex runs only when the citations/\bibdata/\bibstyle recorded in the .aux
+#   or the .bib files changed, or the .bbl is missing.
+# - pdflatex passes stop as soon as .aux/.toc/.out reach a fixed point (and a
+#   new .bbl has been read), so a small edit usually costs a single pass.
+
+MANIFEST = ".build-manifest.json"
+STATE_EXTS = (".aux", ".toc", ".out", ".lof", ".lot")
+CLEAN_EXTS = (".aux", ".log", ".out", ".toc", ".bbl", ".blg", ".synctex.gz", ".fdb_latexmk",
+              ".fls", ".nav", ".snm", ".vrb", ".lof", ".lot")
+INPUT_PATTERNS = ("*.tex", "sec/**/*.tex", "*.bib", "*.sty", "*.cls", "*.bst", "figure/**/*")
+
+class BuildError(RuntimeError):
+    pass
+
+def file_hash(path):
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def input_hashes(project_dir):
+    """{relative path: sha256} of every file that can influence the PDF."""
+    paths = set()
+    for pattern in INPUT_PATTERNS:
+        paths.update(glob.glob(os.path.join(project_dir, pattern), recursive=True))
+    return {
+        os.path.relpath(path, project_dir).replace("\\", "/"): file_hash(path)
+        for path in sorted(paths) if os.path.isfile(path)
+    }
+
+def aux_state(project_dir, stem):
+    return {ext: file_hash(os.path.join(project_dir, stem + ext)) for ext in STATE_EXTS}
+
+def bibliography_key(project_dir, stem, inputs):
+    """Fingerprint of everything bibtex reads: citation lines of the .aux plus the .bib files."""
+    h = hashlib.sha256()
+    aux = os.path.join(project_dir, stem + ".aux")
+    if os.path.exists(aux):
+        with open(aux, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if line.startswith(("\\citation", "\\bibdata", "\\bibstyle")):
+                    h.update(line.encode("utf-8"))
+    for path, digest in inputs.items():
+        if path.endswith((".bib", ".bst")):
+            h.update(f"{path}={digest}\n".encode("utf-8"))
+    return h.hexdigest()
+
+def load_manifest(project_dir):
+    path = os.path.join(project_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(project_dir, manifest):
+    with open(os.path.join(project_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+def run_step(cmd, cwd, timeout):
+    start = time.perf_counter()
+    result = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, timeout=timeout, check=False)
+    return result.returncode, (time.perf_counter() - start) * 1000
+
+def build(project_dir="arXiv-submission", main="main_en.tex", latex="pdflatex", bibtex="bibtex",
+          max_passes=5, force=False, timeout=600, verbose=True):
+    """Build the PDF; returns [(step, ms)] for the steps that ran (empty when up to date).
+
+    Raises BuildError when a pdflatex pass fails; bibtex errors are reported but not fatal.
+    """
+    stem = os.path.splitext(main)[0]
+    log = print if verbose else (lambda *a: None)
+    manifest = load_manifest(project_dir)
+    inputs = input_hashes(project_dir)
+    pdf = os.path.join(project_dir, stem + ".pdf")
+    if not force and manifest.get("inputs") == inputs and os.path.exists(pdf):
+        log("Up to date, nothing to do.")
+        return []
+
+    steps = []
+    latex_cmd = [latex, "-interaction=nonstopmode", "-halt-on-error", main]
+
+    def latex_pass():
+        code, ms = run_step(latex_cmd, project_dir, timeout)
+        number = sum(name.startswith("pdflatex") for name, _ in steps) + 1
+        steps.append((f"pdflatex pass {number}", ms))
+        log(f"[{steps[-1][0]}] {ms:.0f} ms")
+        if code != 0:
+            raise BuildError(f"pdflatex failed, see {stem}.log")
+
+    before = aux_state(project_dir, stem)
+    latex_pass()
+
+    bbl = os.path.join(project_dir, stem + ".bbl")
+    bib_key = bibliography_key(project_dir, stem, inputs)
+    bbl_changed = False
+    if force or bib_key != manifest.get("bibliography") or not os.path.exists(bbl):
+        old_bbl = file_hash(bbl)
+        code, ms = run_step([bibtex, stem], project_dir, timeout)
+        steps.append(("bibtex", ms))
+        log(f"[bibtex] {ms:.0f} ms")
+        if code != 0:
+            log("[WARNING] BibTeX returned errors, continuing...")
+            bib_key = None
+        bbl_changed = file_hash(bbl) != old_bbl
+    else:
+        log("[bibtex] skipped, citations and .bib unchanged")
+
+    passes = 1
+    while True:
+        after = aux_state(project_dir, stem)
+        if after == before and not bbl_changed:
+            break
+        if passes >= max_passes:
+            log(f"[WARNING] auxiliary files did not converge after {max_passes} passes")
+            break
+        before = after
+        bbl_changed = False
+        latex_pass()
+        passes += 1
+
+    save_manifest(project_dir, {"inputs": inputs, "bibliography": bib_key})
+    log(f"Done: {passes} pdflatex pass(es), {sum(ms for _, ms in steps):.0f} ms total. Output: {stem}.pdf")
+    return steps
+
+def clean(project_dir="arXiv-submission", main="main_en.tex"):
+    stem = os.path.splitext(main)[0]
+    for path in [os.path.join(project_dir, stem + ext) for ext in CLEAN_EXTS] + [os.path.join(project_dir, MANIFEST)]:
+        if os.path.exists(path):
+            os.remove(path)
+    print("Clean complete.")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convergence-aware LaTeX build for the arXiv submission.",
+        epilog="Example: python latex_build.py compile",
+    )
+    parser.add_argument("command", nargs="?", choices=("compile", "clean", "all"), default="compile",
+                        help="compile (default), clean auxiliary files, or all (clean then compile)")
+    parser.add_argument("--dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "arXiv-submission"),
+                        help="project directory (default: arXiv-submission next to this script)")
+    parser.add_argument("--main", default="main_en.tex")
+    parser.add_argument("--latex", default="pdflatex")
+    parser.add_argument("--bibtex", default="bibtex")
+    parser.add_argument("--max-passes", type=int, default=5, help="upper bound on pdflatex passes (default: 5)")
+    parser.add_argument("--force", action="store_true", help="rebuild even if no input changed")
+    parser.add_argument("--timeout", type=int, default=600, help="seconds per step (default: 600)")
+    args = parser.parse_args()
+
+    if args.command in ("clean", "all"):
+        clean(args.dir, args.main)
+    if args.command in ("compile", "all"):
+        try:
+            build(args.dir, args.main, args.latex, args.bibtex, args.max_passes, args.force, args.timeout)
+        except (BuildError, subprocess.TimeoutExpired, OSError) as e:
+            print(f"[ERROR] {e}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
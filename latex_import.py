@@ -0,0 +1,311 @@
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import latex2sexp
+from sexp_cache import moganstem_version
+from tmu_parser import TmuDocument
+from tmu_xref import XrefEngine
+
+# 整篇 LaTeX 文档（如 arXiv-submission/main_en.tex）到 .tmu 的批量导入。
+#
+# 1. 从主文件出发解析 \input/\include 树（跳过注释、verbatim 类环境与 \verb），
+#    导言区中的 \input 直接内联；正文切分为若干单元：每个被 \input 的文件一个单元，
+#    主文件中夹在 \input 之间的文字（\maketitle、\bibliography 等）也各成一个单元。
+# 2. 每个单元套上完整导言区成为独立文档，由 headless moganstem 并行转换为 .tmu。
+#    含 \bibliography 的单元前面补上 \nocite{全文引用的键…}（按首次引用的顺序），
+#    使单独转换时参考文献仍由整篇文档的引用生成。
+# 3. 转换结果按 sha256(导入器版本 + moganstem 版本 + 导言区 + 单元文本) 缓存在
+#    .import-cache/ 中：只改了一个章节时只有该章节重新转换；导言区改动则全部重新转换。
+#    参考文献单元的键还包含 .bib 与 .bbl 文件的内容。
+# 4. 按顺序拼接各单元的 <\body>，文件头、style 与 initial 取自第一个单元，
+#    最后用 tmu_xref 生成 <\references> 中的编号（页码需在编辑器中排版后才有）。
+
+IMPORTER_VERSION = 2
+CACHE_DIR = ".import-cache"
+BEGIN_DOCUMENT_RE = re.compile(r"\\begin\{document\}")
+END_DOCUMENT_RE = re.compile(r"\\end\{document\}")
+INPUT_RE = re.compile(r"\\(?:input|include)\s*\{([^}]*)\}")
+VERBATIM_RE = re.compile(r"\\begin\{(lstlisting|verbatim|minted)\}.*?\\end\{\1\}", re.S)
+VERB_RE = re.compile(r"\\verb\*?(.).*?\1")
+COMMENT_RE = re.compile(r"(?<!\\)%.*")
+BIBLIOGRAPHY_RE = re.compile(r"\\bibliography\s*\{([^}]*)\}")
+CITE_RE = re.compile(r"\\(?:no)?cite[a-zA-Z]*\*?\s*(?:\[[^\]]*\]\s*)*\{([^}]*)\}")
+
+class LatexImportError(RuntimeError):
+    pass
+
+def mask(text):
+    """把注释、verbatim 环境与 \\verb 替换为等长空白，保持偏移不变，供查找 \\input、\\cite 等用"""
+    for pattern in (VERBATIM_RE, VERB_RE, COMMENT_RE):
+        text = pattern.sub(lambda m: " " * len(m.group()), text)
+    return text
+
+def read_tex(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def input_path(project_dir, name):
+    """\\input 的目标文件：相对于主文件所在目录，缺省扩展名为 .tex"""
+    path = os.path.join(project_dir, name.strip())
+    if not os.path.exists(path) and os.path.exists(path + ".tex"):
+        path += ".tex"
+    if not os.path.isfile(path):
+        raise LatexImportError(f"\\input 的文件不存在：{name}")
+    return path
+
+def inline_inputs(text, project_dir, stack):
+    """把 text 中的 \\input 递归展开为文件内容（用于导言区）"""
+    parts = []
+    pos = 0
+    for m in INPUT_RE.finditer(mask(text)):
+        path = input_path(project_dir, m.group(1))
+        if path in stack:
+            raise LatexImportError(f"\\input 出现循环：{path}")
+        parts.append(text[pos:m.start()])
+        parts.append(inline_inputs(read_tex(path), project_dir, stack + [path]))
+        pos = m.end()
+    parts.append(text[pos:])
+    return "".join(parts)
+
+def split_units(text, name, project_dir, stack):
+    """把正文按 \\input 切分为 [(单元名, 文本)]，被 \\input 的文件递归切分"""
+    units = []
+    pos = 0
+    part = 0
+
+    def add_text(segment):
+        nonlocal part
+        if segment.strip():
+            units.append((f"{name}#{part}", segment))
+            part += 1
+
+    for m in INPUT_RE.finditer(mask(text)):
+        path = input_path(project_dir, m.group(1))
+        if path in stack:
+            raise LatexImportError(f"\\input 出现循环：{path}")
+        add_text(text[pos:m.start()])
+        child = os.path.relpath(path, project_dir).replace("\\", "/")
+        child_units = split_units(read_tex(path), child, project_dir, stack + [path])
+        # 不含 \input 的文件整体作为一个单元，名字就是文件名
+        if len(child_units) == 1:
+            child_units = [(child, child_units[0][1])]
+        units.extend(child_units)
+        pos = m.end()
+    add_text(text[pos:])
+    return units
+
+def resolve_document(main_file):
+    """返回 (导言区, [(单元名, 文本)])"""
+    project_dir = os.path.dirname(os.path.abspath(main_file))
+    text = read_tex(main_file)
+    masked = mask(text)
+    begin = BEGIN_DOCUMENT_RE.search(masked)
+    end = END_DOCUMENT_RE.search(masked, begin.end() if begin else 0)
+    if begin is None or end is None:
+        raise LatexImportError(f"{main_file} 中没有 \\begin{{document}} … \\end{{document}}")
+    stack = [os.path.abspath(main_file)]
+    preamble = inline_inputs(text[:begin.start()], project_dir, stack)
+    units = split_units(text[begin.end():end.start()], os.path.basename(main_file), project_dir, stack)
+    return preamble, units
+
+def citations(units):
+    """全文引用的键，按首次出现的顺序"""
+    keys = {}
+    for _, text in units:
+        for m in CITE_RE.finditer(mask(text)):
+            for key in m.group(1).split(","):
+                if key.strip():
+                    keys.setdefault(key.strip(), None)
+    return list(keys)
+
+def bibliography_inputs(main_file, unit_text):
+    """单元中 \\bibliography 用到的 .bib 文件，以及主文件旁已有的 .bbl"""
+    project_dir = os.path.dirname(os.path.abspath(main_file))
+    paths = []
+    for m in BIBLIOGRAPHY_RE.finditer(mask(unit_text)):
+        for name in m.group(1).split(","):
+            path = os.path.join(project_dir, name.strip())
+            if not path.endswith(".bib"):
+                path += ".bib"
+            if not os.path.isfile(path):
+                raise LatexImportError(f"参考文献数据库不存在：{name.strip()}")
+            paths.append(path)
+    if paths:
+        bbl = os.path.splitext(os.path.abspath(main_file))[0] + ".bbl"
+        if os.path.isfile(bbl):
+            paths.append(bbl)
+    return paths
+
+def unit_key(version, preamble, unit_text, inputs=()):
+    """缓存键；inputs 为内容也参与转换的文件（.bib、.bbl）"""
+    h = hashlib.sha256()
+    h.update(f"{IMPORTER_VERSION}\n{version}\n".encode("utf-8"))
+    h.update(preamble.encode("utf-8"))
+    h.update(b"\0")
+    h.update(unit_text.encode("utf-8"))
+    for path in inputs:
+        h.update(b"\0")
+        h.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+def import_script(source, output):
+    """载入 LaTeX 文档并导出为 .tmu 的 Scheme 脚本"""
+    return "\n".join([
+        ";; 整篇导入脚本 - 由 latex_import.py 生成",
+        f'(load-buffer (system->url "{source}"))',
+        f'(export-buffer-main (current-buffer) (system->url "{output}") "tmu" (list))',
+        "(quit)",
+        "",
+    ])
+
+def convert_unit(project_dir, cache_dir, key, preamble, unit_text, timeout):
+    """把一个单元转换为 cache_dir/<key>.tmu，返回耗时（毫秒）
+
+    包装文档写在主文件所在目录，使图片、.bib 等相对路径照常可用，转换后删除。
+    """
+    source = os.path.join(project_dir, f".import-{key[:16]}.tex")
+    output = os.path.join(cache_dir, f"{key}.tmu")
+    partial = output + ".part"
+    scheme_file = os.path.join(cache_dir, f"{key[:16]}.scm")
+    with open(source, "w", encoding="utf-8") as f:
+        f.write(preamble)
+        f.write("\\begin{document}\n")
+        f.write(unit_text)
+        f.write("\n\\end{document}\n")
+    with open(scheme_file, "w", encoding="utf-8") as f:
+        f.write(import_script(source.replace("\\", "/"), partial.replace("\\", "/")))
+
+    start = time.perf_counter()
+    try:
+        result = latex2sexp.run_moganstem(scheme_file, timeout)
+        if result.returncode != 0 or not os.path.exists(partial):
+            raise LatexImportError(f"moganstem 返回 {result.returncode}：{result.stderr.strip()[-200:]}")
+        os.replace(partial, output)
+    finally:
+        for path in (source, scheme_file, partial):
+            if os.path.exists(path):
+                os.remove(path)
+    return (time.perf_counter() - start) * 1000
+
+def assemble(tmu_files):
+    """拼接各单元的正文；文件头、style 与 initial 取自第一个单元"""
+    bodies = []
+    head = None
+    for path in tmu_files:
+        doc = TmuDocument.load(path)
+        body = doc.block("body")
+        if body is None or not body.children:
+            continue
+        if head is None:
+            head = [doc.block(tag) and doc.text(doc.block(tag)) for tag in ("TMU", "style", "initial")]
+        text = doc.text(body.children[0]).strip()
+        if text:
+            bodies.append(text)
+    if head is None:
+        raise LatexImportError("所有单元都没有正文")
+    header, style, initial = head
+    parts = [header, style, "<\\body>\n  " + "\n\n  ".join(bodies) + "\n</body>", initial]
+    return "\n\n".join(p for p in parts if p) + "\n"
+
+def import_document(main_file, output_file, workers=4, timeout=600, cache_dir=None, refs=True, prune=False):
+    """导入整篇文档；返回 [(单元名, 状态, 毫秒)]，状态为 cached 或 converted"""
+    project_dir = os.path.dirname(os.path.abspath(main_file))
+    cache_dir = cache_dir or os.path.join(project_dir, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    preamble, units = resolve_document(main_file)
+    version = moganstem_version(latex2sexp.MOGANSTEM_PATH, latex2sexp.TEXMACS_PATH)
+    cited = citations(units)
+    keys = []
+    for i, (name, text) in enumerate(units):
+        inputs = bibliography_inputs(main_file, text)
+        if inputs and cited:
+            # 参考文献单元单独转换时看不到其他单元的 \cite
+            text = f"\\nocite{{{','.join(cited)}}}\n{text}"
+            units[i] = (name, text)
+        keys.append(unit_key(version, preamble, text, inputs))
+
+    report = {}
+    pending = [(name, text, key) for (name, text), key in zip(units, keys)
+               if not os.path.exists(os.path.join(cache_dir, f"{key}.tmu"))]
+    for (name, _), key in zip(units, keys):
+        report.setdefault(name, "cached")
+    failed = []
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+            futures = {
+                name: pool.submit(convert_unit, project_dir, cache_dir, key, preamble, text, timeout)
+                for name, text, key in pending
+            }
+            for name, future in futures.items():
+                try:
+                    report[name] = ("converted", future.result())
+                except Exception as e:
+                    report[name] = ("failed", str(e))
+                    failed.append(name)
+    if failed:
+        raise LatexImportError(f"{len(failed)} 个单元转换失败：{', '.join(failed)}")
+
+    data = assemble([os.path.join(cache_dir, f"{key}.tmu") for key in keys]).encode("utf-8")
+    if refs:
+        engine = XrefEngine(TmuDocument(data))
+        engine.refresh()
+        data = bytes(engine.doc.data)
+    with open(output_file, "wb") as f:
+        f.write(data)
+
+    if prune:
+        used = {f"{key}.tmu" for key in keys}
+        for entry in os.listdir(cache_dir):
+            if entry.endswith(".tmu") and entry not in used:
+                os.remove(os.path.join(cache_dir, entry))
+    return [(name,) + (report[name] if isinstance(report[name], tuple) else (report[name], 0.0))
+            for name, _ in units]
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="整篇 LaTeX 文档到 .tmu 的并行导入（按章节缓存）",
+        epilog="示例：python3 latex_import.py arXiv-submission/main_en.tex -o imported.tmu --workers 4",
+    )
+    parser.add_argument("main_file", help="主 .tex 文件")
+    parser.add_argument("-o", "--output", help="输出 .tmu（默认与主文件同名）")
+    parser.add_argument("--workers", type=int, default=4, help="并行moganstem进程数（默认4）")
+    parser.add_argument("--timeout", type=int, default=600, help="每个单元的超时秒数（默认600）")
+    parser.add_argument("--cache-dir", help=f"单元缓存目录（默认主文件目录下的 {CACHE_DIR}）")
+    parser.add_argument("--no-refs", action="store_true", help="不生成 references 块")
+    parser.add_argument("--prune", action="store_true", help="删除本次未用到的缓存条目")
+    parser.add_argument("--list", action="store_true", help="只列出单元，不转换")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.main_file):
+        print(f"输入文件不存在：{args.main_file}")
+        sys.exit(1)
+    if args.list:
+        _, units = resolve_document(args.main_file)
+        for name, text in units:
+            print(f"{name}  {len(text.encode('utf-8'))} 字节")
+        return
+    if not latex2sexp.moganstem_available():
+        sys.exit(1)
+
+    output = args.output or os.path.splitext(args.main_file)[0] + ".tmu"
+    start = time.perf_counter()
+    try:
+        report = import_document(args.main_file, output, args.workers, args.timeout, args.cache_dir,
+                                 not args.no_refs, args.prune)
+    except (LatexImportError, OSError) as e:
+        print(f"导入失败：{e}")
+        sys.exit(1)
+    for name, status, ms in report:
+        print(f"[{status}] {name}" + (f"  {ms:.0f} ms" if status == "converted" else ""))
+    converted = sum(status == "converted" for _, status, _ in report)
+    print(f"{len(report)} 个单元，转换 {converted} 个，用时 {time.perf_counter() - start:.1f} 秒：{output}")
+
+if __name__ == "__main__":
+    main()
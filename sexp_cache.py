@@ -0,0 +1,143 @@
+import hashlib
+import os
+import re
+import sqlite3
+
+# 默认缓存上限（按结果字节数计），超出后按LRU淘汰
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+def normalize_latex(latex_str):
+    """规范化LaTeX：去首尾空白、补全数学模式、合并连续空白"""
+    latex = re.sub(r'\s+', ' ', latex_str.strip())
+    if not latex.startswith('$'):
+        latex = '$' + latex
+    if not latex.endswith('$'):
+        latex = latex + '$'
+    return latex
+
+def hash_file(digest, path):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+def moganstem_version(moganstem_path, texmacs_path=None):
+    """以moganstem可执行文件与TeXmacs的Scheme程序（texmacs_path/progs）内容的哈希作为版本标识
+
+    转换结果同时取决于二者，只改progs而不重编moganstem时旧条目也随之失效。
+    """
+    digest = hashlib.sha256()
+    hash_file(digest, moganstem_path)
+    progs = os.path.join(texmacs_path, 'progs') if texmacs_path else None
+    if progs and os.path.isdir(progs):
+        for root, dirs, files in os.walk(progs):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                # 相对路径也计入，文件改名或移动同样使版本变化
+                digest.update(os.path.relpath(path, progs).replace(os.sep, '/').encode('utf-8') + b'\0')
+                hash_file(digest, path)
+    return digest.hexdigest()[:16]
+
+class ConversionCache:
+    """LaTeX→S-expression 转换结果的单文件持久缓存（SQLite）
+
+    键为 sha256(版本 + 规范化LaTeX)，更换moganstem或TeXmacs程序后旧条目自然失效；
+    总大小超过 max_bytes 时按最近使用时间淘汰。
+    """
+
+    def __init__(self, path, version, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.version = version
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " result TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (last_used)")
+        total, clock = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(last_used), 0) FROM cache"
+        ).fetchone()
+        self.total_bytes = total
+        self.clock = clock
+
+    def key(self, latex):
+        text = f"{self.version}\n{normalize_latex(latex)}"
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _tick(self):
+        self.clock += 1
+        return self.clock
+
+    def get(self, latex):
+        """查询缓存，命中时刷新最近使用时间"""
+        key = self.key(latex)
+        row = self.conn.execute("SELECT result FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE cache SET last_used = ? WHERE key = ?", (self._tick(), key))
+        return row[0]
+
+    def put(self, latex, result):
+        """写入一条转换结果，必要时淘汰最久未用的条目"""
+        key = self.key(latex)
+        size = len(result.encode('utf-8'))
+        old = self.conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+        if old is not None:
+            self.total_bytes -= old[0]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO cache (key, result, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, result, size, self._tick()),
+        )
+        self.total_bytes += size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """按LRU淘汰，直到总大小降到上限的90%"""
+        target = self.max_bytes * 9 // 10
+        rows = self.conn.execute("SELECT key, size FROM cache ORDER BY last_used")
+        doomed = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            doomed.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM cache WHERE key = ?", doomed)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 2:
+        print("用法：python3 sexp_cache.py 缓存文件.sqlite")
+        sys.exit(1)
+    if not os.path.exists(sys.argv[1]):
+        print(f"缓存文件不存在：{sys.argv[1]}")
+        sys.exit(1)
+
+    conn = sqlite3.connect(sys.argv[1])
+    count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+    print(f"缓存条目: {count}")
+    print(f"结果总大小: {total} 字节")
+    conn.close()
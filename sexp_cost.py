@@ -0,0 +1,291 @@
+import argparse
+import heapq
+import json
+import re
+import sys
+
+# 转换耗时的代价模型与按代价均衡的分批。
+#
+# gen_latex 生成的表达式从单个符号到多层嵌套的矩阵/cases 都有，按行数等分的分片
+# 耗时差异很大，最慢的分片决定总时间。这里用廉价的词法特征（长度、嵌套深度、
+# 环境数、单元格数等）的线性模型估计每条表达式的耗时，模型系数可用
+# sexp_profile.py 记录的实测耗时校准；再把表达式装入预测代价大致相等的批次，
+# 预测代价大的批次先提交，使并行转换的尾部等待最短。每个批次是一个新的moganstem
+# 进程，模型另含每批的固定启动开销：批次数在若干候选中按预测总耗时选取，
+# 预测不优于按行数等分的连续分片时就用连续分片。
+
+MATRIX_ENVS = ('pmatrix', 'bmatrix', 'vmatrix', 'array')
+
+CONSTRUCT_PATTERNS = {
+    'frac': r'\\frac(?![a-zA-Z])',
+    'over': r'\\over(?![a-zA-Z])',
+    'sqrt': r'\\sqrt(?![a-zA-Z])',
+    'int': r'\\int(?![a-zA-Z])',
+    'left-right': r'\\left(?![a-zA-Z])',
+    'func': r'\\(?:sin|cos|log|ln|det)(?![a-zA-Z])',
+    'sup': r'\^',
+    'sub': r'_',
+    'text': r'\\text(?![a-zA-Z])',
+    'matrix': r'\\begin\{(?:pmatrix|bmatrix|vmatrix|array)\}',
+    'cases': r'\\begin\{cases\}',
+}
+CONSTRUCT_RES = {name: re.compile(pattern) for name, pattern in CONSTRUCT_PATTERNS.items()}
+BEGIN_RE = re.compile(r'\\begin\{([a-zA-Z*]+)\}')
+CONTROL_WORD_RE = re.compile(r'\\[a-zA-Z]+')
+
+# 参与线性模型的数值特征
+FEATURES = ('length', 'depth', 'envs', 'matrices', 'cases', 'cells', 'commands')
+
+# 未校准时的粗略系数（毫秒）
+DEFAULT_WEIGHTS = {'length': 0.05, 'depth': 1.0, 'envs': 2.0, 'matrices': 2.0, 'cases': 2.0,
+                   'cells': 0.5, 'commands': 0.3}
+DEFAULT_INTERCEPT = 1.0
+DEFAULT_STARTUP = 2000.0  # 启动一个moganstem（载入TeXmacs）的毫秒数
+MODEL_VERSION = 2
+BATCHES_PER_WORKER = 4  # 候选批次数：进程数的 1…4 倍
+
+def brace_depth(latex):
+    """花括号与环境的最大嵌套深度"""
+    depth = deepest = 0
+    for tok in re.finditer(r'\\begin\{[^}]*\}|\\end\{[^}]*\}|\\[{}]|[{}]', latex):
+        text = tok.group()
+        if text in ('\\{', '\\}'):
+            continue
+        if text == '{' or text.startswith('\\begin'):
+            depth += 1
+            deepest = max(deepest, depth)
+        else:
+            depth = max(0, depth - 1)
+    return deepest
+
+def line_features(latex):
+    """输入行的廉价结构特征"""
+    envs = BEGIN_RE.findall(latex)
+    matrices = sum(1 for env in envs if env in MATRIX_ENVS)
+    cases = sum(1 for env in envs if env == 'cases')
+    # 环境内 & 与 \\ 的数量近似单元格数
+    cells = latex.count('&') + latex.count('\\\\') if envs else 0
+    return {
+        'length': len(latex),
+        'depth': brace_depth(latex),
+        'envs': len(envs),
+        'matrices': matrices,
+        'cases': cases,
+        'cells': cells,
+        'commands': len(CONTROL_WORD_RE.findall(latex)),
+        'constructs': [name for name, regex in CONSTRUCT_RES.items() if regex.search(latex)],
+    }
+
+def solve(matrix, vector):
+    """高斯消元（列主元）解小规模线性方程组"""
+    n = len(vector)
+    rows = [list(row) + [value] for row, value in zip(matrix, vector)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        if abs(rows[col][col]) < 1e-12:
+            continue
+        for r in range(n):
+            if r != col and rows[r][col]:
+                factor = rows[r][col] / rows[col][col]
+                rows[r] = [a - factor * b for a, b in zip(rows[r], rows[col])]
+    return [row[n] / row[i] if abs(row[i]) >= 1e-12 else 0.0 for i, row in enumerate(rows)]
+
+def least_squares(samples, targets, ridge=1e-6):
+    """非负最小二乘：系数为负的特征逐个剔除后重新拟合（截距不受约束）
+
+    samples 每行第一列为常数 1。
+    """
+    active = list(range(len(samples[0])))
+    while True:
+        gram = [[sum(x[i] * x[j] for x in samples) + (ridge if i == j else 0.0) for j in active]
+                for i in active]
+        moment = [sum(x[i] * y for x, y in zip(samples, targets)) for i in active]
+        coef = dict(zip(active, solve(gram, moment)))
+        negative = [i for i in active[1:] if coef[i] < 0]
+        if not negative:
+            return [coef.get(i, 0.0) for i in range(len(samples[0]))]
+        active.remove(min(negative, key=lambda i: coef[i]))
+
+class CostModel:
+    """按特征线性组合预测单条表达式的转换耗时（毫秒）"""
+
+    def __init__(self, intercept=DEFAULT_INTERCEPT, weights=None, startup=DEFAULT_STARTUP, calibrated=False):
+        self.intercept = intercept
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        self.startup = startup  # 每批（每个moganstem进程）的固定开销
+        self.calibrated = calibrated
+
+    def predict_features(self, features):
+        return max(0.0, self.intercept + sum(w * features.get(name, 0) for name, w in self.weights.items()))
+
+    def predict(self, latex):
+        if not latex.strip():
+            return 0.0
+        return self.predict_features(line_features(latex))
+
+    @classmethod
+    def fit(cls, records, startup=None):
+        """用 sexp_profile 的 JSONL 明细（含实测 ms 与特征）校准
+
+        启动开销取明细中分片开销记录的中位数；startup 给出时以它为准，
+        两者都没有时用 DEFAULT_STARTUP。
+        """
+        overheads = sorted(float(r['startup_ms']) for r in records if 'startup_ms' in r)
+        records = [r for r in records if 'ms' in r]
+        if len(records) < len(FEATURES) + 1:
+            raise ValueError(f"校准至少需要 {len(FEATURES) + 1} 条记录，只有 {len(records)} 条")
+        samples = [[1.0] + [float(r.get(name, 0)) for name in FEATURES] for r in records]
+        coef = least_squares(samples, [float(r['ms']) for r in records])
+        if startup is None:
+            startup = overheads[len(overheads) // 2] if overheads else DEFAULT_STARTUP
+        return cls(coef[0], dict(zip(FEATURES, coef[1:])), startup, calibrated=True)
+
+    def evaluate(self, records):
+        """返回 (R², 平均绝对误差)"""
+        actual = [float(r['ms']) for r in records]
+        predicted = [self.predict_features(r) for r in records]
+        mean = sum(actual) / len(actual)
+        total = sum((y - mean) ** 2 for y in actual)
+        residual = sum((y - p) ** 2 for y, p in zip(actual, predicted))
+        mae = sum(abs(y - p) for y, p in zip(actual, predicted)) / len(actual)
+        return (1 - residual / total if total else 1.0), mae
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != MODEL_VERSION:
+            raise ValueError(f"代价模型版本不符：{path}")
+        return cls(data['intercept'], data['weights'], data['startup'], calibrated=True)
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MODEL_VERSION, 'intercept': self.intercept, 'weights': self.weights,
+                       'startup': self.startup}, f, indent=2)
+
+def plan_batches(costs, batches, startup=0.0, order=None):
+    """把各条按预测代价装入至多 batches 个批次，返回 [(批次代价, [行号…])]
+
+    代价从大到小依次放入当前代价最小的批次（LPT），批内保持原始行序；
+    批次代价含启动开销 startup，按从大到小排列，即提交顺序。
+    order 为按代价从大到小排好的行号，多次调用时可复用。
+    """
+    batches = max(1, min(batches, len(costs)))
+    heap = [(startup, i) for i in range(batches)]
+    members = [[] for _ in range(batches)]
+    totals = [startup] * batches
+    if order is None:
+        order = sorted(range(len(costs)), key=lambda i: costs[i], reverse=True)
+    for index in order:
+        total, b = heapq.heappop(heap)
+        members[b].append(index)
+        totals[b] = total + costs[index]
+        heapq.heappush(heap, (totals[b], b))
+    plan = [(totals[b], sorted(members[b])) for b in range(batches) if members[b]]
+    plan.sort(key=lambda item: item[0], reverse=True)
+    return plan
+
+def makespan(batch_costs, workers):
+    """按给定顺序把批次交给 workers 个进程（先空闲先取）时的预测总耗时"""
+    finish = [0.0] * max(1, workers)
+    for cost in batch_costs:
+        heapq.heapreplace(finish, finish[0] + cost)
+    return max(finish)
+
+def shard_costs(costs, workers, startup=0.0):
+    """latex2sexp.split_shards 按行数等分的连续分片各自的预测代价（含启动开销）"""
+    workers = max(1, min(workers, len(costs)))
+    size, extra = divmod(len(costs), workers)
+    result = []
+    start = 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        result.append(startup + sum(costs[start:end]))
+        start = end
+    return result
+
+def best_plan(costs, workers, startup, batches=0):
+    """选取预测总耗时最短的分批，返回 (分批, 预测总耗时, 连续分片的预测总耗时)
+
+    batches 为 0 时在进程数的 1…BATCHES_PER_WORKER 倍中选取批次数。
+    分批预测不优于连续分片时返回的分批为 None。
+    """
+    workers = max(1, workers)
+    order = sorted(range(len(costs)), key=lambda i: costs[i], reverse=True)
+    candidates = [batches] if batches else [workers * k for k in range(1, BATCHES_PER_WORKER + 1)]
+    best, best_time = None, None
+    for count in candidates:
+        plan = plan_batches(costs, count, startup, order)
+        predicted = makespan([cost for cost, _ in plan], workers)
+        if best_time is None or predicted < best_time:
+            best, best_time = plan, predicted
+    contiguous = makespan(shard_costs(costs, workers, startup), workers)
+    if not batches and best_time >= contiguous:
+        return None, contiguous, contiguous
+    return best, best_time, contiguous
+
+def load_records(profile_file):
+    with open(profile_file, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="转换耗时代价模型：校准与分批预览")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    calibrate = sub.add_parser("calibrate", help="用 sexp_profile.py 的 JSONL 明细校准模型")
+    calibrate.add_argument("profile_file", help="sexp_profile.py run 输出的 JSONL 明细")
+    calibrate.add_argument("model_file", help="输出的模型 JSON")
+    calibrate.add_argument("--startup", type=float,
+                           help="每个moganstem进程的启动开销（毫秒），默认取明细中分片开销的中位数")
+
+    plan = sub.add_parser("plan", help="预览输入文件的分批与预测耗时")
+    plan.add_argument("input_file", help="输入文件：每行一条LaTeX表达式")
+    plan.add_argument("--model", help="校准后的模型 JSON（默认使用粗略系数）")
+    plan.add_argument("--workers", type=int, default=4, help="并行moganstem进程数（默认4）")
+    plan.add_argument("--batches", type=int, default=0,
+                      help=f"批次数（默认在进程数的 1…{BATCHES_PER_WORKER} 倍中按预测耗时选取）")
+    plan.add_argument("--startup", type=float, help="覆盖模型中每批的启动开销（毫秒）")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "calibrate":
+            records = load_records(args.profile_file)
+            model = CostModel.fit(records, args.startup)
+            records = [r for r in records if 'ms' in r]
+            r2, mae = model.evaluate(records)
+            model.save(args.model_file)
+            print(f"用 {len(records)} 条记录校准，R² = {r2:.3f}，平均绝对误差 {mae:.2f} ms")
+            print(f"  {'截距':<10}{model.intercept:>10.3f}")
+            for name in FEATURES:
+                print(f"  {name:<10}{model.weights[name]:>10.3f}")
+            print(f"  {'启动开销':<8}{model.startup:>10.1f}")
+            print(f"模型写入: {args.model_file}")
+            return
+
+        model = CostModel.load(args.model) if args.model else CostModel()
+        with open(args.input_file, 'r', encoding='utf-8') as f:
+            costs = [model.predict(line.rstrip('\n')) for line in f]
+    except (OSError, ValueError) as e:
+        print(f"失败：{e}")
+        sys.exit(1)
+
+    if args.startup is not None:
+        model.startup = args.startup
+    workers = max(1, args.workers)
+    batches, predicted, contiguous = best_plan(costs, workers, model.startup, args.batches)
+
+    print(f"{len(costs)} 行，预测总代价 {sum(costs):.0f} ms，每批启动开销 {model.startup:.0f} ms"
+          f"（{'已校准' if model.calibrated else '未校准'}模型）")
+    if batches is None:
+        print(f"均衡分批预测不优于等行数分片（{contiguous:.0f} ms），latex2sexp 将使用连续分片")
+        return
+    print(f"{'批次':<6}{'行数':>8}{'预测(ms)':>12}")
+    for i, (cost, members) in enumerate(batches):
+        print(f"{i:<6}{len(members):>8}{cost:>12.0f}")
+    print(f"预测总耗时：均衡分批 {predicted:.0f} ms，等行数分片 {contiguous:.0f} ms，"
+          f"下限 {sum(costs) / workers + model.startup:.0f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+import argparse
+import hashlib
+import json
+import sys
+import time
+from collections import Counter
+from itertools import zip_longest
+
+from fast_latex2sexp import write_stree
+from sexp_store import parse_sexp
+
+# 两次转换结果（每行一个 stree，空行表示转换失败）的结构化比较。
+#
+# 两个文件逐行流式读取，内存只与单行大小有关。文本完全相同的行直接跳过，不解析；
+# 其余行解析后自底向上计算每个子树的 Merkle 哈希（标签 + 子节点哈希），
+# 比较时哈希相同的子树 O(1) 跳过。标签与子节点数都相同时逐个子节点深入；
+# 子节点数不同时先按哈希对齐公共前缀与后缀，剩下一对一时继续深入，否则该节点
+# 就是最小差异子树。差异按节点标签（frac、around*、tabular* …）归类，
+# 只有叶子文字不同时归入所在节点的标签。
+
+DIGEST_SIZE = 16
+SNIPPET_CHARS = 160
+
+def merkle(tree):
+    """返回与树同形的哈希树：复合节点为 (哈希, 标签, [子哈希树…])，叶子为 (哈希, 字符串, None)
+
+    后序遍历用显式栈，不受递归深度限制。
+    """
+    def leaf(text):
+        return (hashlib.blake2b(b'"' + text.encode('utf-8'), digest_size=DIGEST_SIZE).digest(), text, None)
+
+    if isinstance(tree, str):
+        return leaf(tree)
+    root = []
+    stack = [(tree, 1, [], root)]
+    while stack:
+        node, i, done, out = stack[-1]
+        if i < len(node):
+            stack[-1] = (node, i + 1, done, out)
+            child = node[i]
+            if isinstance(child, str):
+                done.append(leaf(child))
+            else:
+                stack.append((child, 1, [], done))
+            continue
+        stack.pop()
+        h = hashlib.blake2b(b'(' + node[0].encode('utf-8'), digest_size=DIGEST_SIZE)
+        for child in done:
+            h.update(child[0])
+        out.append((h.digest(), node[0], done))
+    return root[0]
+
+def unhash(hashed):
+    """哈希树还原为 parse_sexp 的形式，用于输出片段"""
+    digest, label, children = hashed
+    if children is None:
+        return label
+    return [label] + [unhash(child) for child in children]
+
+def snippet(hashed):
+    if hashed is None:
+        return None
+    text = write_stree(unhash(hashed))
+    return text if len(text) <= SNIPPET_CHARS else text[:SNIPPET_CHARS - 1] + '…'
+
+def node_kind(path, x, y):
+    """差异的类别：旧（或新）子树是复合节点时为其标签，两侧都是叶子时为所在节点的标签"""
+    for side in (x, y):
+        if side is not None and side[2] is not None:
+            return side[1]
+    return path[-1] if path else '<leaf>'
+
+def diff_trees(a, b):
+    """两棵哈希树的最小差异子树：[(路径, 类别, 旧子树, 新子树)]
+
+    路径为从根到差异处（不含）的复合节点标签；子树缺失的一侧为 None。
+    """
+    result = []
+    stack = [(a, b, ())]
+    while stack:
+        x, y, path = stack.pop()
+        if x[0] == y[0]:
+            continue
+        if x[2] is None or y[2] is None or x[1] != y[1]:
+            result.append((path, node_kind(path, x, y), x, y))
+            continue
+        xs, ys = x[2], y[2]
+        inner = path + (x[1],)
+        if len(xs) == len(ys):
+            stack.extend((cx, cy, inner) for cx, cy in reversed(list(zip(xs, ys))))
+            continue
+        # 子节点数不同：按哈希去掉公共前缀与后缀
+        lo = 0
+        while lo < min(len(xs), len(ys)) and xs[lo][0] == ys[lo][0]:
+            lo += 1
+        hi = 0
+        while hi < min(len(xs), len(ys)) - lo and xs[-1 - hi][0] == ys[-1 - hi][0]:
+            hi += 1
+        rest_x, rest_y = xs[lo:len(xs) - hi], ys[lo:len(ys) - hi]
+        if len(rest_x) == 1 and len(rest_y) == 1:
+            stack.append((rest_x[0], rest_y[0], inner))
+        elif not rest_x or not rest_y:
+            for child in rest_x:
+                result.append((inner, node_kind(inner, child, None), child, None))
+            for child in rest_y:
+                result.append((inner, node_kind(inner, None, child), None, child))
+        else:
+            result.append((path, x[1], x, y))
+    return result
+
+def read_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+def diff_files(old_file, new_file, details=None, examples=3):
+    """逐行比较两个 stree 文件，返回统计结果；details 为逐条差异的 JSONL 文件对象
+
+    行号从 1 开始，与编辑器和 sed -n 一致。
+    """
+    stats = Counter()
+    kinds = Counter()
+    samples = {}
+    for line_no, (old, new) in enumerate(zip_longest(read_lines(old_file), read_lines(new_file)), start=1):
+        stats['lines'] += 1
+        if old == new:
+            stats['identical'] += 1
+            continue
+        try:
+            old_tree = parse_sexp(old) if old else None
+            new_tree = parse_sexp(new) if new else None
+        except ValueError as e:
+            # 截断或损坏的行：记为无法解析，继续比较后面的行
+            stats['unparsable'] += 1
+            if details:
+                details.write(json.dumps({
+                    'line': line_no, 'status': 'unparsable', 'error': str(e),
+                    'old': old or None, 'new': new or None,
+                }, ensure_ascii=False) + '\n')
+            continue
+        if old_tree is None or new_tree is None:
+            # 一侧转换失败或行数不同
+            if old_tree is None and new_tree is None:
+                stats['identical'] += 1
+                continue
+            stats['fixed' if old_tree is None else 'broken'] += 1
+            if details:
+                details.write(json.dumps({
+                    'line': line_no, 'status': 'fixed' if old_tree is None else 'broken',
+                    'old': old or None, 'new': new or None,
+                }, ensure_ascii=False) + '\n')
+            continue
+        differences = diff_trees(merkle(old_tree), merkle(new_tree))
+        if not differences:
+            stats['formatting'] += 1  # 文本不同但结构相同
+            continue
+        stats['changed'] += 1
+        for path, kind, x, y in differences:
+            kinds[kind] += 1
+            stats['subtrees'] += 1
+            record = {'line': line_no, 'kind': kind, 'path': '/'.join(path), 'old': snippet(x), 'new': snippet(y)}
+            bucket = samples.setdefault(kind, [])
+            if len(bucket) < examples:
+                bucket.append(record)
+            if details:
+                details.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return stats, kinds, samples
+
+def print_report(stats, kinds, samples):
+    print(f"共 {stats['lines']} 行：相同 {stats['identical']}，仅格式不同 {stats['formatting']}，"
+          f"结构变化 {stats['changed']}，新转换成功 {stats['fixed']}，新转换失败 {stats['broken']}，"
+          f"无法解析 {stats['unparsable']}")
+    if not kinds:
+        return
+    print(f"\n最小差异子树 {stats['subtrees']} 个，按节点类别：")
+    for kind, count in kinds.most_common():
+        print(f"  {kind:<16} {count:>8}")
+        for record in samples.get(kind, []):
+            print(f"      行 {record['line']}  {record['path'] or '(根)'}")
+            print(f"        - {record['old']}")
+            print(f"        + {record['new']}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="两次转换结果的结构化比较（Merkle 哈希，流式）",
+        epilog="示例：python3 sexp_diff.py old_texmacs.txt complex_texmacs.txt --details diff.jsonl",
+    )
+    parser.add_argument("old_file", help="旧版本 moganstem 的输出（每行一个 stree）")
+    parser.add_argument("new_file", help="新版本 moganstem 的输出")
+    parser.add_argument("--details", metavar="PATH", help="逐条差异写入 JSONL 文件")
+    parser.add_argument("--examples", type=int, default=3, help="每个类别显示的示例数（默认3）")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    details = open(args.details, 'w', encoding='utf-8') if args.details else None
+    try:
+        stats, kinds, samples = diff_files(args.old_file, args.new_file, details, args.examples)
+    except (OSError, ValueError) as e:
+        print(f"比较失败：{e}")
+        sys.exit(1)
+    finally:
+        if details:
+            details.close()
+    print_report(stats, kinds, samples)
+    print(f"\n用时 {time.perf_counter() - start:.2f} 秒")
+
+if __name__ == '__main__':
+    main()
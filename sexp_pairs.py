@@ -0,0 +1,194 @@
+import argparse
+import mmap
+import os
+import random
+import shutil
+import struct
+import sys
+from array import array
+
+from sexp_store import parse_sexp
+
+# LaTeX / TeXmacs 对齐语料的配对存储。
+#
+# 两侧文本各自拼成一段字节块，配以 n+1 项的字节偏移索引，第 i 对即两侧
+# [offsets[i], offsets[i+1]) 的切片，O(1) 定位、无需扫描。另存一份“有效对”
+# 下标表（两侧都非空），随机抽样直接在其上取下标。建库时文本流式写入临时文件，
+# 内存中只有偏移表（每行 16 字节）。
+# 建库时校验对齐：行数一致；LaTeX 空行对应 TeXmacs 空行（generate_scheme_script
+# 对空行原样输出空行）；非空 TeXmacs 行必须是单个完整的 stree。
+# 非空 LaTeX 对应空 TeXmacs 行是转换失败的占位，计为缺失而非错位。
+
+MAGIC = b'SEXPPAR1'
+HEADER = struct.Struct('<8sqqqq')  # magic, 对数, 有效对数, LaTeX字节数, TeXmacs字节数
+
+class AlignmentError(ValueError):
+    pass
+
+def check_pair(line_no, latex, texmacs):
+    """校验一对行，返回 True 表示两侧都非空（有效对）；错位时抛出 AlignmentError"""
+    if not latex.strip():
+        if texmacs.strip():
+            raise AlignmentError(f'第{line_no + 1}行：LaTeX 为空行但 TeXmacs 非空，两侧错位')
+        return False
+    if not texmacs.strip():
+        return False
+    try:
+        parse_sexp(texmacs)
+    except ValueError as e:
+        raise AlignmentError(f'第{line_no + 1}行：TeXmacs 不是完整的 stree（{e}）')
+    return True
+
+def build_pairs(latex_file, texmacs_file, store_file):
+    """流式读取两侧文件并写出配对存储，返回 (对数, 有效对数, 缺失数)
+
+    两侧文本先边读边写入存储旁的临时文件，内存中只保留偏移表；
+    读完后写出文件头与偏移表，再把两个临时文件依次拷入。
+    """
+    latex_offsets = array('q', [0])
+    texmacs_offsets = array('q', [0])
+    valid = array('i')
+    missing = 0
+    latex_tmp = store_file + '.latex.tmp'
+    texmacs_tmp = store_file + '.texmacs.tmp'
+
+    try:
+        with open(latex_file, 'r', encoding='utf-8') as fl, open(texmacs_file, 'r', encoding='utf-8') as ft, \
+                open(latex_tmp, 'wb') as latex_blob, open(texmacs_tmp, 'wb') as texmacs_blob:
+            line_no = 0
+            while True:
+                latex = fl.readline()
+                texmacs = ft.readline()
+                if not latex or not texmacs:
+                    if latex or texmacs:
+                        longer = latex_file if latex else texmacs_file
+                        raise AlignmentError(f'行数不一致：{longer} 在第{line_no + 1}行后仍有内容')
+                    break
+                latex = latex.rstrip('\n')
+                texmacs = texmacs.rstrip('\n')
+                if check_pair(line_no, latex, texmacs):
+                    valid.append(line_no)
+                elif latex.strip():
+                    missing += 1
+
+                latex_blob.write(latex.encode('utf-8'))
+                texmacs_blob.write(texmacs.encode('utf-8'))
+                latex_offsets.append(latex_blob.tell())
+                texmacs_offsets.append(texmacs_blob.tell())
+                line_no += 1
+
+        with open(store_file, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, line_no, len(valid), latex_offsets[-1], texmacs_offsets[-1]))
+            for arr in (latex_offsets, texmacs_offsets, valid):
+                f.write(arr.tobytes())
+                pad(f)
+            for path in (latex_tmp, texmacs_tmp):
+                with open(path, 'rb') as blob:
+                    shutil.copyfileobj(blob, f, 1 << 20)
+    finally:
+        for path in (latex_tmp, texmacs_tmp):
+            if os.path.exists(path):
+                os.remove(path)
+    return line_no, len(valid), missing
+
+def pad(f):
+    """8字节对齐，保证 mmap 后各数组可直接 cast"""
+    f.write(b'\0' * (-f.tell() % 8))
+
+class PairStore:
+    """mmap 打开的配对存储，只读"""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, pairs, valid, latex_size, texmacs_size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f'不是配对存储文件：{path}')
+
+        view = memoryview(self.map)
+        pos = HEADER.size
+
+        def take(count, code, itemsize):
+            nonlocal pos
+            arr = view[pos:pos + count * itemsize].cast(code)
+            pos += count * itemsize
+            pos += -pos % 8
+            return arr
+
+        self.latex_offsets = take(pairs + 1, 'q', 8)
+        self.texmacs_offsets = take(pairs + 1, 'q', 8)
+        self.valid = take(valid, 'i', 4)
+        self.latex_blob = view[pos:pos + latex_size]
+        self.texmacs_blob = view[pos + latex_size:pos + latex_size + texmacs_size]
+
+    def __len__(self):
+        return len(self.latex_offsets) - 1
+
+    def latex(self, i):
+        return bytes(self.latex_blob[self.latex_offsets[i]:self.latex_offsets[i + 1]]).decode('utf-8')
+
+    def texmacs(self, i):
+        return bytes(self.texmacs_blob[self.texmacs_offsets[i]:self.texmacs_offsets[i + 1]]).decode('utf-8')
+
+    def pair(self, i):
+        """第 i 对（行号从0开始）：(LaTeX, TeXmacs)"""
+        return self.latex(i), self.texmacs(i)
+
+    def sample(self, k, rng=random):
+        """随机抽取 k 个有效对（不放回），返回 [(行号, LaTeX, TeXmacs)]"""
+        picks = rng.sample(range(len(self.valid)), min(k, len(self.valid)))
+        return [(self.valid[j],) + self.pair(self.valid[j]) for j in picks]
+
+    def close(self):
+        for arr in (self.latex_offsets, self.texmacs_offsets, self.valid, self.latex_blob, self.texmacs_blob):
+            arr.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="LaTeX/TeXmacs 对齐语料的配对存储")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="校验对齐并建库")
+    build.add_argument("latex_file", help="每行一条LaTeX表达式")
+    build.add_argument("texmacs_file", help="逐行对应的 stree 结果")
+    build.add_argument("store_file")
+
+    show = sub.add_parser("show", help="输出第 i 对")
+    show.add_argument("store_file")
+    show.add_argument("index", type=int, help="行号（从0开始）")
+
+    sample = sub.add_parser("sample", help="随机抽取 k 个有效对")
+    sample.add_argument("store_file")
+    sample.add_argument("k", type=int)
+    sample.add_argument("--seed", type=int, default=None, help="随机种子")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        try:
+            pairs, valid, missing = build_pairs(args.latex_file, args.texmacs_file, args.store_file)
+        except AlignmentError as e:
+            print(f"对齐校验失败：{e}")
+            sys.exit(1)
+        print(f"已写入 {pairs} 对（有效 {valid}，转换缺失 {missing}）: {args.store_file}")
+        return
+
+    with PairStore(args.store_file) as store:
+        if args.command == "show":
+            latex, texmacs = store.pair(args.index)
+            print(latex)
+            print(texmacs)
+        else:
+            for line_no, latex, texmacs in store.sample(args.k, random.Random(args.seed)):
+                print(f"[{line_no}] {latex}")
+                print(f"    {texmacs}")
+
+if __name__ == '__main__':
+    main()
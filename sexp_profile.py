@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import latex2sexp
+from bench_compile import percentile
+from sexp_cost import line_features
+
+# 逐表达式计时：在生成的Scheme中记录每条 latex->texmacs 的耗时，
+# 再与输入行的结构特征关联，输出 JSONL 明细和按结构统计的分位数表。
+# 明细末尾另有每个分片一条 {"shard", "lines", "wall_ms", "startup_ms"} 记录：
+# 整个moganstem进程的耗时减去逐条耗时，即启动等固定开销，供 sexp_cost.py 校准。
+
+def read_timings(timing_file):
+    """读取 "行号 毫秒" 格式的计时文件"""
+    timings = {}
+    if not os.path.exists(timing_file):
+        return timings
+    with open(timing_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2:
+                timings[int(parts[0])] = float(parts[1])
+    return timings
+
+def profile_shard(index, start, shard_lines, work_dir, timeout):
+    """带计时地转换一个分片，返回 (输出行, {全局行号: 毫秒}, 提示信息, 进程耗时毫秒)"""
+    shard_output = os.path.join(work_dir, f"shard-{index:04d}.out")
+    timing_file = os.path.join(work_dir, f"shard-{index:04d}.timing")
+    scheme_file = os.path.join(work_dir, f"shard-{index:04d}.scm")
+    with open(scheme_file, 'w', encoding='utf-8') as f:
+        f.write(latex2sexp.generate_scheme_script(shard_lines, shard_output, timing_file))
+
+    message = None
+    start_time = time.perf_counter()
+    try:
+        result = latex2sexp.run_moganstem(scheme_file, timeout)
+        if result.returncode != 0:
+            message = f"分片{index}返回非零代码: {result.returncode}"
+    except subprocess.TimeoutExpired:
+        message = f"分片{index}超时（{timeout}秒）"
+    wall_ms = (time.perf_counter() - start_time) * 1000
+
+    lines = []
+    if os.path.exists(shard_output):
+        with open(shard_output, 'r', encoding='utf-8') as f:
+            lines = [line.rstrip('\n') for line in f]
+    timings = {start + i: ms for i, ms in read_timings(timing_file).items()}
+    return lines, timings, message, wall_ms
+
+def profile_convert(latex_lines, output_file, profile_file, timeout=120, workers=1):
+    """转换并记录逐条耗时，写出输出文件和 JSONL 明细，返回明细记录列表"""
+    shards = latex2sexp.split_shards(latex_lines, workers)
+    starts = []
+    offset = 0
+    for shard in shards:
+        starts.append(offset)
+        offset += len(shard)
+
+    work_dir = tempfile.mkdtemp(prefix='sexp-profile-')
+    try:
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            results = list(pool.map(
+                lambda args: profile_shard(*args, work_dir, timeout),
+                [(i, start, shard) for i, (start, shard) in enumerate(zip(starts, shards))],
+            ))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    timings = {}
+    overheads = []
+    with open(output_file, 'w', encoding='utf-8') as out:
+        for index, ((lines, shard_timings, message, wall_ms), shard) in enumerate(zip(results, shards)):
+            if message:
+                print(f"警告：{message}")
+            # 缺失的输出以空行占位，保持与输入行对齐
+            lines = (lines + [''] * len(shard))[:len(shard)]
+            for line in lines:
+                out.write(line + '\n')
+            timings.update(shard_timings)
+            if not message:
+                overheads.append({'shard': index, 'lines': len(shard), 'wall_ms': wall_ms,
+                                  'startup_ms': max(0.0, wall_ms - sum(shard_timings.values()))})
+
+    records = []
+    with open(profile_file, 'w', encoding='utf-8') as f:
+        for line_no, latex in enumerate(latex_lines):
+            if line_no not in timings:
+                continue
+            record = {'line': line_no + 1, 'ms': timings[line_no]}
+            record.update(line_features(latex))
+            records.append(record)
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        for overhead in overheads:
+            f.write(json.dumps(overhead) + '\n')
+    return records
+
+def summarize(records):
+    """按结构（以及嵌套深度）分组统计 p50/p95/p99"""
+    groups = defaultdict(list)
+    for record in records:
+        groups['(all)'].append(record['ms'])
+        groups[f"depth={record['depth']}"].append(record['ms'])
+        for name in record['constructs']:
+            groups[name].append(record['ms'])
+
+    rows = []
+    for name, values in groups.items():
+        values.sort()
+        rows.append((name, len(values), percentile(values, 50), percentile(values, 95), percentile(values, 99)))
+    rows.sort(key=lambda row: row[4], reverse=True)
+    return rows
+
+def print_summary(rows):
+    print(f"{'结构':<14}{'数量':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    print("-" * 52)
+    for name, count, p50, p95, p99 in rows:
+        print(f"{name:<14}{count:>8}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+def load_profile(profile_file):
+    """读取逐条记录（跳过分片开销记录）"""
+    with open(profile_file, 'r', encoding='utf-8') as f:
+        return [record for record in map(json.loads, filter(str.strip, f)) if 'line' in record]
+
+def main():
+    parser = argparse.ArgumentParser(description="moganstem逐表达式转换耗时分析")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="带计时地转换并输出分析")
+    run.add_argument("input_file", help="输入文件：每行一条LaTeX表达式")
+    run.add_argument("output_file", help="输出文件：每行一个S-expression结果")
+    run.add_argument("profile_file", help="JSONL 明细：每个非空行的耗时与结构特征")
+    run.add_argument("--workers", type=int, default=1, help="并行moganstem进程数（默认1）")
+    run.add_argument("--timeout", type=int, default=120, help="每个moganstem进程的超时秒数（默认120）")
+
+    show = sub.add_parser("summary", help="汇总已有的 JSONL 明细")
+    show.add_argument("profile_file")
+
+    args = parser.parse_args()
+
+    if args.command == "summary":
+        print_summary(summarize(load_profile(args.profile_file)))
+        return
+
+    if not latex2sexp.moganstem_available():
+        sys.exit(1)
+    with open(args.input_file, 'r', encoding='utf-8') as f:
+        latex_lines = [line.rstrip('\n') for line in f]
+
+    records = profile_convert(latex_lines, args.output_file, args.profile_file,
+                              args.timeout, args.workers)
+    print(f"计时 {len(records)} 条表达式，明细写入: {args.profile_file}")
+    print_summary(summarize(records))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import mmap
+import re
+import struct
+import sys
+from array import array
+
+from fast_latex2sexp import write_stree
+
+# batch_convert 输出（每行一个 stree，空行占位）的紧凑存储。
+#
+# 所有树的节点按树依次、树内按广度优先编号，于是节点 i 的子节点恰好是
+# first_child[i] .. first_child[i+1]-1，不需要单独的子节点列表。
+# 标签与叶子字符串都进入去重的字符串表：复合节点的 labels 为标签id，
+# 叶子节点为 ~字符串id（负数）。节点id为32位。文件可直接 mmap，第 N 棵树 O(1) 定位。
+
+MAGIC = b'SEXPSTO1'
+HEADER = struct.Struct('<8sqqqq')  # magic, 树数, 节点数, 字符串数, 字符串字节数
+
+TOKEN_RE = re.compile(r'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+
+def unquote(token):
+    return token[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+
+def parse_sexp(text):
+    """解析一行 stree：复合节点为 [标签, 子节点...]，叶子为 str；空行返回 None"""
+    tokens = TOKEN_RE.findall(text)
+    if not tokens:
+        return None
+    stack = [[]]
+    for tok in tokens:
+        if tok == '(':
+            stack.append([])
+        elif tok == ')':
+            if len(stack) == 1 or not stack[-1]:
+                raise ValueError('括号不匹配或空列表')
+            node = stack.pop()
+            stack[-1].append(node)
+        elif tok.startswith('"'):
+            stack[-1].append(unquote(tok))
+        else:
+            # 裸符号在列表首位是标签，其余位置按字符串叶子处理
+            stack[-1].append(tok)
+    if len(stack) != 1 or len(stack[0]) != 1:
+        raise ValueError('括号不匹配或一行含多个表达式')
+    return stack[0][0]
+
+def iter_sexp_file(path):
+    """流式读取 stree 文件，逐行产生解析结果（空行为 None）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield parse_sexp(line)
+
+class TreeStoreBuilder:
+    """逐棵追加树，最后一次性写出存储文件"""
+
+    def __init__(self):
+        self.tree_offsets = array('q', [0])
+        self.labels = array('i')
+        self.first_child = array('i')
+        self.strings = {}
+
+    def intern(self, text):
+        sid = self.strings.get(text)
+        if sid is None:
+            sid = self.strings[text] = len(self.strings)
+        return sid
+
+    def add(self, tree):
+        """追加一棵树（None 表示空行）"""
+        base = len(self.labels)
+        if tree is not None:
+            # 广度优先编号：子节点总是紧跟在前一个节点的子节点之后
+            queue = [tree]
+            next_id = base + 1
+            for node in queue:
+                if isinstance(node, str):
+                    self.labels.append(~self.intern(node))
+                    self.first_child.append(next_id)
+                else:
+                    self.labels.append(self.intern(node[0]))
+                    self.first_child.append(next_id)
+                    queue.extend(node[1:])
+                    next_id += len(node) - 1
+        self.tree_offsets.append(len(self.labels))
+
+    def write(self, path):
+        blob = bytearray()
+        string_offsets = array('q', [0])
+        for text in self.strings:
+            blob += text.encode('utf-8')
+            string_offsets.append(len(blob))
+
+        # 末尾哨兵：最后一个节点的子节点区间上界
+        first_child = array('i', self.first_child)
+        first_child.append(len(self.labels))
+
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(self.tree_offsets) - 1, len(self.labels),
+                                len(self.strings), len(blob)))
+            for arr in (self.tree_offsets, first_child, string_offsets, self.labels):
+                f.write(arr.tobytes())
+                pad(f)
+            f.write(blob)
+
+def pad(f):
+    """8字节对齐，保证 mmap 后各数组可直接 cast"""
+    f.write(b'\0' * (-f.tell() % 8))
+
+class TreeStore:
+    """mmap 打开的树存储，只读"""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, trees, nodes, strings, blob_size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f'不是树存储文件：{path}')
+
+        view = memoryview(self.map)
+        pos = HEADER.size
+
+        def take(count, code, itemsize):
+            nonlocal pos
+            arr = view[pos:pos + count * itemsize].cast(code)
+            pos += count * itemsize
+            pos += -pos % 8
+            return arr
+
+        self.tree_offsets = take(trees + 1, 'q', 8)
+        self.first_child = take(nodes + 1, 'i', 4)
+        self.string_offsets = take(strings + 1, 'q', 8)
+        self.labels = take(nodes, 'i', 4)
+        self.blob = view[pos:pos + blob_size]
+        self._strings = {}
+
+    def __len__(self):
+        return len(self.tree_offsets) - 1
+
+    def string(self, sid):
+        text = self._strings.get(sid)
+        if text is None:
+            text = bytes(self.blob[self.string_offsets[sid]:self.string_offsets[sid + 1]]).decode('utf-8')
+            self._strings[sid] = text
+        return text
+
+    def root(self, n):
+        """第 n 棵树的根节点id；空行返回 None"""
+        start = self.tree_offsets[n]
+        return start if self.tree_offsets[n + 1] > start else None
+
+    def is_leaf(self, node):
+        return self.labels[node] < 0
+
+    def label(self, node):
+        """复合节点的标签或叶子的字符串"""
+        sid = self.labels[node]
+        return self.string(~sid if sid < 0 else sid)
+
+    def children(self, node):
+        return range(self.first_child[node], self.first_child[node + 1])
+
+    def tree(self, n):
+        """还原第 n 棵树为嵌套列表"""
+        root = self.root(n)
+        return None if root is None else self.node(root)
+
+    def node(self, node):
+        if self.is_leaf(node):
+            return self.label(node)
+        return [self.label(node)] + [self.node(child) for child in self.children(node)]
+
+    def line(self, n):
+        """第 n 行的 stree 文本（与原文件一致）"""
+        tree = self.tree(n)
+        return '' if tree is None else write_stree(tree)
+
+    def close(self):
+        for arr in (self.tree_offsets, self.first_child, self.string_offsets, self.labels, self.blob):
+            arr.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def build_store(input_file, store_file):
+    """把 stree 文本文件转换为树存储，返回树的数量"""
+    builder = TreeStoreBuilder()
+    for tree in iter_sexp_file(input_file):
+        builder.add(tree)
+    builder.write(store_file)
+    return len(builder.tree_offsets) - 1
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == 'build':
+        count = build_store(sys.argv[2], sys.argv[3])
+        print(f"已写入 {count} 棵树: {sys.argv[3]}")
+    elif len(sys.argv) == 4 and sys.argv[1] == 'show':
+        with TreeStore(sys.argv[2]) as store:
+            print(store.line(int(sys.argv[3])))
+    else:
+        print("用法：python3 sexp_store.py build complex_texmacs.txt texmacs.store")
+        print("      python3 sexp_store.py show texmacs.store 行号(从0开始)")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,60 +1,172 @@
+import argparse
+import gzip
 import json
-import sys
+import lzma
 import os
+import re
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
 
-def create_prefix_dataset(input_file, output_file):
+INSTRUCTION = "Complete the mathematical code."
+# Lines handed to the worker pool per round; bounds memory independently of corpus size
+BATCH_LINES = 20000
+
+def open_text(path, mode):
+    """Open a text file, transparently (de)compressing .gz and .xz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if path.endswith('.xz'):
+        return lzma.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+# \begin{name} / \end{name}, control words, control symbols, runs of letters or
+# digits, whitespace runs, and any other single character; split points only fall
+# between these, never inside an environment name or a word
+LATEX_TOKEN_RE = re.compile(r'\\(?:begin|end)\s*\{[^{}]*\}|\\[a-zA-Z]+|\\.|[a-zA-Z]+|[0-9]+|\s+|.', re.S)
+
+def lex_index(line):
+    """Lex a line once into a token-offset index.
+
+    Returns (offsets, depths): the start offset of every non-whitespace token and
+    the brace depth in effect just before it. Escaped braces (\\{ \\}) do not nest.
+    """
+    offsets = []
+    depths = []
+    depth = 0
+    for match in LATEX_TOKEN_RE.finditer(line):
+        tok = match.group()
+        if tok.isspace():
+            continue
+        offsets.append(match.start())
+        depths.append(depth)
+        if tok == '{':
+            depth += 1
+        elif tok == '}':
+            depth = max(0, depth - 1)
+    return offsets, depths
+
+def spread(candidates, k):
+    """Pick up to k evenly spaced entries from a sorted candidate list."""
+    if len(candidates) <= k:
+        return list(candidates)
+    step = len(candidates) / (k + 1)
+    return [candidates[int(step * (i + 1))] for i in range(k)]
+
+def token_candidates(line, balanced=False):
+    offsets, depths = lex_index(line)
+    # Never leave only the math delimiters on either side
+    first = 2 if line.startswith('$') else 1
+    last = len(offsets) - 1 if line.endswith('$') else len(offsets)
+    return [
+        offsets[i] for i in range(first, last)
+        if not balanced or depths[i] == 0
+    ]
+
+def split_midpoint(line, k=1):
+    """Split at the first space at or after the midpoint (one example per line)."""
+    length = len(line)
+    mid_point = length // 2
+    scan_index = mid_point
+    while scan_index < length and line[scan_index] != ' ':
+        scan_index += 1
+    if scan_index < length:
+        mid_point = scan_index + 1
+
+    return [mid_point]
+
+def split_tokens(line, k=1):
+    """Up to k split points, all on LaTeX token boundaries."""
+    return spread(token_candidates(line), k)
+
+def split_balanced(line, k=1):
+    """Up to k split points on token boundaries outside any brace group."""
+    return spread(token_candidates(line, balanced=True), k)
+
+SPLITTERS = {
+    "midpoint": split_midpoint,
+    "token": split_tokens,
+    "balanced": split_balanced,
+}
+
+def serialize_line(line, split="midpoint", k=1):
+    """Turn one raw line into its JSONL records (empty for blank lines)."""
+    line = line.strip()
+    if not line:
+        return []
+
+    records = []
+    for point in SPLITTERS[split](line, k):
+        entry = {
+            "instruction": INSTRUCTION,
+            "input": line[:point],
+            "output": line[point:]
+        }
+        records.append(json.dumps(entry, ensure_ascii=False))
+    return records
+
+def iter_batches(lines, size):
+    while True:
+        batch = list(islice(lines, size))
+        if not batch:
+            return
+        yield batch
+
+def create_prefix_dataset(input_file, output_file, workers=1, split="midpoint", k=1):
     if not os.path.exists(input_file):
         print(f"Error: Input file '{input_file}' not found.")
         return
 
-    dataset = []
-    
     print(f"Processing {input_file}...")
-    
-    with open(input_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
 
     count = 0
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-            
-        length = len(line)
-        mid_point = length // 2
-        scan_index = mid_point
-        while scan_index < length and line[scan_index] != ' ':
-            scan_index += 1
-        if scan_index < length:
-            mid_point = scan_index + 1
-        
-        prefix = line[:mid_point]
-        suffix = line[mid_point:]
-        
-        entry = {
-            "instruction": "Complete the mathematical code.",
-            "input": prefix,
-            "output": suffix
-        }
-        dataset.append(entry)
-        count += 1
-
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for entry in dataset:
-            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
-            
-    print(f"Success! Converted {count} lines.")
+    lines = 0
+    sample = None
+    serialize = partial(serialize_line, split=split, k=k)
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        with open_text(input_file, 'r') as fin, open_text(output_file, 'w') as fout:
+            for batch in iter_batches(fin, BATCH_LINES):
+                if pool is not None:
+                    results = pool.map(serialize, batch, chunksize=max(1, len(batch) // (workers * 4)))
+                else:
+                    results = map(serialize, batch)
+                for records in results:
+                    if records:
+                        lines += 1
+                    for record in records:
+                        fout.write(record + '\n')
+                        count += 1
+                        if sample is None:
+                            sample = json.loads(record)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    print(f"Success! Converted {lines} lines into {count} examples.")
     print(f"Saved to: {output_file}")
-    
-    if dataset:
+
+    if sample:
         print("\n--- Sample Entry ---")
-        print(f"Input:  {dataset[0]['input']}")
-        print(f"Output: {dataset[0]['output']}")
+        print(f"Input:  {sample['input']}")
+        print(f"Output: {sample['output']}")
         print("--------------------\n")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python convert_to_jsonl.py <input_raw_txt> <output_jsonl>")
-        print("Example: python convert_to_jsonl.py complex_latex.txt train_latex.jsonl")
-    else:
-        create_prefix_dataset(sys.argv[1], sys.argv[2])
+    parser = argparse.ArgumentParser(
+        description="Build a prefix-completion JSONL dataset from raw lines.",
+        epilog="Example: python tex2jsonl.py complex_latex.txt train_latex.jsonl "
+               "(.gz/.xz inputs and outputs are (de)compressed automatically)",
+    )
+    parser.add_argument("input_raw_txt")
+    parser.add_argument("output_jsonl")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes for the split/serialize stage (default: 1)")
+    parser.add_argument("--split", choices=sorted(SPLITTERS), default="midpoint",
+                        help="split strategy: midpoint (one example per line, default), "
+                             "token (LaTeX token boundaries) or balanced (outside brace groups)")
+    parser.add_argument("--splits", type=int, default=1,
+                        help="examples per line for the token/balanced strategies (default: 1)")
+    args = parser.parse_args()
+    create_prefix_dataset(args.input_raw_txt, args.output_jsonl, args.workers, args.split, args.splits)
@@ -0,0 +1,301 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from bisect import bisect_right
+
+from tmu_parser import TmuDocument
+
+# .tmu 文档的结构索引：章节、标签与引用、辅助块中的 associate 条目、表格（行/单元格）
+# 与数学节点。索引以 JSON 旁路文件 <文档>.idx.json 保存，记录源文件的 sha256，
+# 源文件变化后自动重建。每个条目：
+#   kind     section/subsection/subsubsection/appendix（及带 * 的不编号标题）/label/ref/pageref/
+#            associate/table/row/cell/math
+#   tag      原始标签（smart-ref、equation* 等）
+#   key      检索键：章节标题、标签名、associate 键、表格编号（t1、t1.2、t1.2.3）
+#   path     从根到该节点的标签路径，如 body/big-table/tformat/table/row
+#   start/end  节点在文件中的字节区间；章节另有 extent（到下一个同级或更高级标题）
+#   excerpt  去掉标记后的文本摘录
+# 查询只在内存中的字典与有序偏移表上进行，取片段时按字节区间 seek 读取原文件。
+
+INDEX_SUFFIX = '.idx.json'
+INDEX_VERSION = 2
+EXCERPT_CHARS = 80
+
+SECTION_LEVELS = {'chapter': 0, 'section': 1, 'subsection': 2, 'subsubsection': 3, 'appendix': 1}
+# 不编号的标题与对应的编号标题同级
+HEADING_LEVELS = dict(SECTION_LEVELS, **{tag + '*': level for tag, level in SECTION_LEVELS.items()})
+REF_TAGS = {'label': 'label', 'reference': 'ref', 'smart-ref': 'ref', 'eqref': 'ref', 'pageref': 'pageref'}
+MATH_TAGS = {'math', 'equation', 'equation*', 'eqnarray', 'eqnarray*', 'align', 'align*'}
+TABLE_CAPTION_TAGS = {'big-table', 'small-table'}
+SKIP_TEXT_TAGS = {'image', 'hidden-binding', 'specific', 'label', 'cwith', 'twith', 'vspace', 'vspace*',
+                  'hspace', 'space', 'htab', 'no-break', 'no-indent', 'next-line', 'new-line', 'page-break'}
+LAST_ARG_TAGS = {'with', 'surround'}
+ESCAPE_RE = re.compile(r'\\(.)')
+SPACE_RE = re.compile(r'\s+')
+
+def plain_text(doc, node):
+    """节点内的纯文本：无参数形式（<TeX> 等符号）取标签名，参数之间以空格分隔，
+    with/surround 只取正文参数，图片、隐藏绑定与排版指令跳过；空白合并为一个空格"""
+    parts = []
+
+    def visit(node):
+        if node.kind == 'text':
+            parts.append(ESCAPE_RE.sub(r'\1', doc.text(node)))
+        elif node.kind != 'form':
+            for child in node.children:
+                visit(child)
+        elif node.tag in SKIP_TEXT_TAGS:
+            return
+        elif not node.children:
+            parts.append(node.tag)
+        else:
+            for arg in node.children[-1:] if node.tag in LAST_ARG_TAGS else node.children:
+                visit(arg)
+                parts.append(' ')
+
+    visit(node)
+    return SPACE_RE.sub(' ', ''.join(parts)).strip()
+
+def excerpt(text, limit=EXCERPT_CHARS):
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def build_entries(doc):
+    """遍历文档树，返回按起始偏移排序的条目列表"""
+    entries = []
+    numbers = {}  # id(table/row 节点) -> 编号，用于给行与单元格编号
+
+    def add(kind, node, key, text=None):
+        entry = {
+            'kind': kind,
+            'tag': node.tag,
+            'key': key,
+            'path': '/'.join(doc.path(node)),
+            'start': node.start,
+            'end': node.end,
+            'excerpt': excerpt(plain_text(doc, node) if text is None else text),
+        }
+        entries.append(entry)
+        return entry
+
+    def enclosing(node, tags):
+        node = node.parent
+        while node is not None and not (node.kind == 'form' and node.tag in tags):
+            node = node.parent
+        return node
+
+    def position(node, form):
+        # 行是 <table|…> 的第几个参数、单元格是 <row|…> 的第几个参数（从1开始）
+        while node.parent is not form:
+            node = node.parent
+        return form.children.index(node) + 1
+
+    for node in doc.walk():
+        if node.kind != 'form':
+            continue
+        tag = node.tag
+        args = node.children
+        if tag in HEADING_LEVELS and args:
+            title = plain_text(doc, args[0])
+            add(tag, node, title, title)
+        elif tag in REF_TAGS and args:
+            # 摘录取所在段落：标签被标注的内容、引用所处的上下文
+            par = node.parent
+            while par is not None and par.kind != 'par':
+                par = par.parent
+            add(REF_TAGS[tag], node, doc.text(args[0]).strip(), plain_text(doc, par) if par is not None else '')
+        elif tag == 'associate' and args:
+            add('associate', node, doc.text(args[0]).strip())
+        elif tag in MATH_TAGS:
+            add('math', node, None)
+        elif tag == 'table':
+            number = f't{sum(1 for e in entries if e["kind"] == "table") + 1}'
+            numbers[id(node)] = number
+            caption = enclosing(node, TABLE_CAPTION_TAGS)
+            text = plain_text(doc, caption.children[-1]) if caption is not None and caption.children else None
+            add('table', node, number, text)
+        elif tag == 'row':
+            table = enclosing(node, {'table'})
+            number = f"{numbers[id(table)]}.{position(node, table)}" if table is not None else '?'
+            numbers[id(node)] = number
+            add('row', node, number)
+        elif tag == 'cell':
+            row = enclosing(node, {'row'})
+            add('cell', node, f"{numbers[id(row)]}.{position(node, row)}" if row is not None else '?')
+
+    # 章节的范围延伸到下一个同级或更高级标题，最后一个延伸到正文结束
+    body = next(doc.find('body'), None)
+    body_end = body.end if body is not None else len(doc.data)
+    sections = [e for e in entries if e['kind'] in HEADING_LEVELS]
+    for i, entry in enumerate(sections):
+        level = HEADING_LEVELS[entry['kind']]
+        entry['extent'] = next((s['start'] for s in sections[i + 1:] if HEADING_LEVELS[s['kind']] <= level),
+                               body_end)
+    entries.sort(key=lambda e: e['start'])
+    return entries
+
+def build_index(tmu_file, index_file=None):
+    """解析文档并写出索引文件，返回索引内容"""
+    doc = TmuDocument.load(tmu_file)
+    index = {
+        'version': INDEX_VERSION,
+        'source': os.path.abspath(tmu_file),
+        'sha256': hashlib.sha256(doc.data).hexdigest(),
+        'entries': build_entries(doc),
+    }
+    with open(index_file or tmu_file + INDEX_SUFFIX, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    return index
+
+class TmuIndex:
+    """结构索引的查询接口；打开时若索引缺失或源文件已变则重建"""
+
+    def __init__(self, tmu_file, index_file=None, rebuild=False):
+        self.tmu_file = tmu_file
+        index_file = index_file or tmu_file + INDEX_SUFFIX
+        index = None
+        if not rebuild and os.path.exists(index_file):
+            with open(index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') != INDEX_VERSION or index.get('sha256') != file_hash(tmu_file):
+                index = None
+        self.rebuilt = index is None
+        if index is None:
+            index = build_index(tmu_file, index_file)
+        self.entries = index['entries']
+        self.starts = [e['start'] for e in self.entries]
+        self.by_kind = {}
+        self.by_key = {}
+        for entry in self.entries:
+            self.by_kind.setdefault(entry['kind'], []).append(entry)
+            if entry['key'] is not None:
+                self.by_key.setdefault(entry['key'], []).append(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def query(self, kind=None, key=None, text=None):
+        """按种类、键（精确）与摘录子串（不区分大小写）过滤"""
+        if key is not None:
+            result = self.by_key.get(key, [])
+            if kind is not None:
+                result = [e for e in result if e['kind'] == kind]
+        elif kind is not None:
+            result = self.by_kind.get(kind, [])
+        else:
+            result = self.entries
+        if text is not None:
+            needle = text.lower()
+            result = [e for e in result if needle in (e['excerpt'] or '').lower()
+                      or needle in (e['key'] or '').lower()]
+        return list(result)
+
+    def references(self, label):
+        """标签的定义、所有引用及辅助块中的 associate 条目"""
+        entries = self.by_key.get(label, [])
+        return {kind: [e for e in entries if e['kind'] == kind] for kind in ('label', 'ref', 'pageref', 'associate')}
+
+    def at(self, offset):
+        """包含 offset 的条目，由外到内"""
+        i = bisect_right(self.starts, offset)
+        return [e for e in self.entries[:i] if offset < e.get('extent', e['end'])]
+
+    def section_of(self, offset):
+        """offset 所在的最内层章节"""
+        sections = [e for e in self.at(offset) if e['kind'] in HEADING_LEVELS]
+        return sections[-1] if sections else None
+
+    def outline(self):
+        return [e for e in self.entries if e['kind'] in HEADING_LEVELS]
+
+    def fragment(self, entry, whole_section=False):
+        """从源文件读取条目对应的原文（章节可取到 extent）"""
+        end = entry['extent'] if whole_section and 'extent' in entry else entry['end']
+        with open(self.tmu_file, 'rb') as f:
+            f.seek(entry['start'])
+            return f.read(end - entry['start']).decode('utf-8', errors='replace')
+
+def format_entry(entry):
+    key = f" {entry['key']}" if entry['key'] is not None else ''
+    return f"{entry['kind']}{key}  [{entry['start']}, {entry['end']})  {entry['path']}\n    {entry['excerpt']}"
+
+def main():
+    parser = argparse.ArgumentParser(description=".tmu 文档的结构索引与查询")
+    parser.add_argument("tmu_file")
+    parser.add_argument("--rebuild", action="store_true", help="忽略已有索引，强制重建")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("build", help="建立（或刷新）索引")
+    sub.add_parser("outline", help="列出章节结构")
+
+    find = sub.add_parser("find", help="按种类/键/文本查找条目")
+    find.add_argument("--kind", choices=sorted(set(HEADING_LEVELS) | set(REF_TAGS.values())
+                                              | {'associate', 'table', 'row', 'cell', 'math'}))
+    find.add_argument("--key", help="精确匹配的键（标题、标签名、表格编号等）")
+    find.add_argument("--text", help="在摘录与键中查找的子串")
+    find.add_argument("--limit", type=int, default=20, help="最多输出条数（默认20）")
+
+    ref = sub.add_parser("ref", help="标签的定义、引用与 associate 条目")
+    ref.add_argument("label")
+
+    at = sub.add_parser("at", help="包含某字节偏移的条目")
+    at.add_argument("offset", type=int)
+
+    show = sub.add_parser("show", help="输出条目原文（章节输出整节）")
+    show.add_argument("key")
+    show.add_argument("--kind")
+
+    args = parser.parse_args()
+    if not os.path.exists(args.tmu_file):
+        print(f"文件不存在：{args.tmu_file}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    index = TmuIndex(args.tmu_file, rebuild=args.rebuild)
+    load_ms = (time.perf_counter() - start) * 1000
+    if args.command == "build":
+        kinds = ', '.join(f"{kind} {len(entries)}" for kind, entries in index.by_kind.items())
+        print(f"{'已重建' if index.rebuilt else '索引已是最新'}：{len(index)} 个条目（{kinds}），用时 {load_ms:.1f} ms")
+        return
+
+    start = time.perf_counter()
+    if args.command == "outline":
+        result = index.outline()
+    elif args.command == "find":
+        result = index.query(args.kind, args.key, args.text)
+    elif args.command == "ref":
+        groups = index.references(args.label)
+        result = [e for kind in groups for e in groups[kind]]
+    elif args.command == "at":
+        result = index.at(args.offset)
+    else:
+        result = index.query(args.kind, args.key)
+    query_us = (time.perf_counter() - start) * 1e6
+
+    if args.command == "show":
+        for entry in result[:1]:
+            print(index.fragment(entry, whole_section=True))
+    elif args.command == "outline":
+        for entry in result:
+            indent = '  ' * (HEADING_LEVELS[entry['kind']] - 1)
+            print(f"{indent}{entry['key']}  [{entry['start']}, {entry['extent']})")
+    else:
+        limit = getattr(args, 'limit', None)
+        for entry in result[:limit]:
+            print(format_entry(entry))
+        if limit is not None and len(result) > limit:
+            print(f"……另有 {len(result) - limit} 条")
+    print(f"{len(result)} 条结果；载入索引 {load_ms:.1f} ms，查询 {query_us:.0f} µs", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
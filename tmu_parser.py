@@ -0,0 +1,424 @@
+import argparse
+import random
+import re
+import sys
+import time
+from bisect import bisect_right
+
+# .tmu（TeXmacs/Mogan 文档格式）的流式解析器，带逐节点字节偏移索引，支持增量重解析。
+#
+# 语法要点：
+#   <tag>、<tag|参数|…>            行内形式（无参数的 <alpha> 即符号）
+#   <\tag|行内参数…>正文<|tag>正文</tag>  块形式，每段正文是一个块参数
+#   \x                              转义，x 按字面处理（\< \> \| \\ …）
+# 文件头 <TMU|<tuple|…>> 就是顶层的一个行内形式。
+#
+# 节点种类：document（顶层）、body（块参数）、par（以空行分隔的段落）、
+# arg（行内参数）、form（形式）、text（文本叶子）。前四种是“容器”。
+# 每个节点只记录相对父节点起点的偏移 rel 与长度，编辑时只需更新祖先链及其
+# 后继兄弟，不必平移整棵树。编辑后从覆盖编辑区间的最深容器开始，只重解析
+# 受影响的那一段子节点；边界对不上时逐级上升，最坏退化为全量解析。
+
+CONTAINERS = ('document', 'body', 'par', 'arg')
+ARG_SPECIAL = re.compile(rb'[\\<|>]')
+BODY_SPECIAL = re.compile(rb'[\\<]')
+NAME_RE = re.compile(rb'[^|<>\s]*')
+PAR_BREAK = re.compile(rb'\n[ \t]*\n')
+
+class ParseError(ValueError):
+    pass
+
+class Node:
+    __slots__ = ('kind', 'tag', 'rel', 'length', 'children', 'parent')
+
+    def __init__(self, kind, tag, start, length, children=()):
+        self.kind = kind
+        self.tag = tag
+        self.rel = start  # 解析时为绝对偏移，挂入树后改为相对父节点
+        self.length = length
+        self.children = list(children)
+        self.parent = None
+
+    @property
+    def start(self):
+        pos = 0
+        node = self
+        while node is not None:
+            pos += node.rel
+            node = node.parent
+        return pos
+
+    @property
+    def end(self):
+        return self.start + self.length
+
+    def __repr__(self):
+        return f'<{self.kind} {self.tag or ""} @{self.start}+{self.length}>'
+
+def attach(node, parent_start):
+    """把解析得到的绝对偏移改为相对偏移，并设置 parent"""
+    start = node.rel
+    node.rel = start - parent_start
+    for child in node.children:
+        attach(child, start)
+        child.parent = node
+    return node
+
+class Parser:
+    def __init__(self, data):
+        self.data = data
+
+    def items(self, pos, limit, ctx):
+        """从 pos 解析文本与形式，直到遇到本层的终止符或 limit
+
+        ctx 为 'arg'（终止于未转义的 | 或 >）或 'body'（终止于 </ 或 <|）。
+        返回 (节点列表, 结束位置, 终止符)，终止符为 'limit'/'|'/'>'/'</'/'<|'。
+        """
+        data = self.data
+        special = ARG_SPECIAL if ctx == 'arg' else BODY_SPECIAL
+        nodes = []
+        text_start = pos
+        while True:
+            m = special.search(data, pos, limit)
+            if m is None:
+                pos = limit
+                stop = 'limit'
+                break
+            pos = m.start()
+            ch = data[pos:pos + 1]
+            if ch == b'\\':
+                pos += 2
+                if pos > limit:
+                    raise ParseError(f'转义越过边界：{pos}')
+                continue
+            if ch in (b'|', b'>'):
+                stop = ch.decode()
+                break
+            nxt = data[pos + 1:pos + 2]
+            if nxt in (b'/', b'|'):
+                stop = '<' + nxt.decode()
+                break
+            if pos > text_start:
+                nodes.append(Node('text', None, text_start, pos - text_start))
+            form = self.form(pos, limit)
+            nodes.append(form)
+            pos = form.rel + form.length
+            text_start = pos
+        if pos > text_start:
+            nodes.append(Node('text', None, text_start, pos - text_start))
+        return nodes, pos, stop
+
+    def name(self, pos, limit):
+        m = NAME_RE.match(self.data, pos, limit)
+        if m is None:
+            raise ParseError(f'标签名越过边界：{pos}')
+        try:
+            return m.group().decode('utf-8'), m.end()
+        except UnicodeDecodeError:
+            raise ParseError(f'标签名不是合法的 UTF-8：{pos}') from None
+
+    def form(self, pos, limit):
+        data = self.data
+        start = pos
+        block = data[pos + 1:pos + 2] == b'\\'
+        tag, pos = self.name(pos + 2 if block else pos + 1, limit)
+        args = []
+        # 行内参数
+        while pos < limit and data[pos:pos + 1] == b'|':
+            nodes, end, stop = self.items(pos + 1, limit, 'arg')
+            if stop not in ('|', '>'):
+                raise ParseError(f'<{tag}| 的参数未闭合：{pos}')
+            args.append(Node('arg', None, pos + 1, end - pos - 1, nodes))
+            pos = end
+        if pos >= limit or data[pos:pos + 1] != b'>':
+            raise ParseError(f'<{tag} 未闭合：{start}')
+        pos += 1
+        if block:
+            # 块参数：正文直到 <|tag> 或 </tag>
+            while True:
+                nodes, end, stop = self.items(pos, limit, 'body')
+                args.append(Node('body', None, pos, end - pos, self.paragraphs(nodes)))
+                close, after = self.name(end + 2, limit)
+                if stop not in ('<|', '</') or close != tag or after >= limit or data[after:after + 1] != b'>':
+                    raise ParseError(f'<\\{tag}> 的块未正确闭合：{end}')
+                pos = after + 1
+                if stop == '</':
+                    break
+        return Node('form', tag, start, pos - start, args)
+
+    def paragraphs(self, nodes):
+        """把正文层的节点按空行切分为段落；段落之间的空白不属于任何节点"""
+        data = self.data
+        pars = []
+        current = []
+
+        def flush():
+            if current:
+                first, last = current[0], current[-1]
+                pars.append(Node('par', None, first.rel, last.rel + last.length - first.rel, current[:]))
+                current.clear()
+
+        for node in nodes:
+            if node.kind != 'text':
+                current.append(node)
+                continue
+            pos = node.rel
+            end = pos + node.length
+            for m in PAR_BREAK.finditer(data, pos, end):
+                if m.start() > pos:
+                    current.append(Node('text', None, pos, m.start() - pos))
+                flush()
+                pos = m.end()
+            if end > pos:
+                current.append(Node('text', None, pos, end - pos))
+        flush()
+        # 去掉只含缩进/换行的段落（块正文首尾的排版空白）
+        return [p for p in pars if p.children[0].kind != 'text' or len(p.children) > 1
+                or data[p.rel:p.rel + p.length].strip()]
+
+    def document(self):
+        nodes, end, stop = self.items(0, len(self.data), 'body')
+        if stop != 'limit':
+            raise ParseError(f'顶层出现多余的 {stop}：{end}')
+        return Node('document', None, 0, len(self.data), self.paragraphs(nodes))
+
+    def region(self, container, start, limit, closed=True):
+        """在 container 的语境下重解析 [start, limit)，必须恰好在 limit 处结束
+
+        closed 为 False 时 limit 是下一个未改动段落的起点，重解析的正文必须恰好以
+        段落分隔结束，否则段落边界已经移动。
+        """
+        data = self.data
+        ctx = 'arg' if container.kind == 'arg' else 'body'
+        nodes, end, stop = self.items(start, limit, ctx)
+        if stop != 'limit' or end != limit:
+            raise ParseError('重解析区间边界不匹配')
+        if container.kind == 'par':
+            if any(n.kind == 'text' and PAR_BREAK.search(data, n.rel, n.rel + n.length) for n in nodes):
+                raise ParseError('段落内出现空行，需要在上一层重解析')
+            if not nodes or len(nodes) == 1 and nodes[0].kind == 'text' and not data[start:limit].strip():
+                raise ParseError('段落变为空白，需要在上一层重解析')
+            # 末尾的换行与其后的段落分隔连成新的空行
+            nl = data.rfind(b'\n', start, limit)
+            if nl >= 0 and not data[nl + 1:limit].strip(b' \t') and PAR_BREAK.match(data, nl):
+                raise ParseError('段落末尾与段落分隔相连，需要在上一层重解析')
+            return nodes
+        if container.kind == 'arg':
+            return nodes
+        if not closed:
+            last = nodes[-1] if nodes else None
+            if last is None or last.kind != 'text' or not any(
+                    m.end() == limit for m in PAR_BREAK.finditer(data, last.rel, limit)):
+                raise ParseError('段落分隔发生移动，需要在上一层重解析')
+        return self.paragraphs(nodes)
+
+class TmuDocument:
+    """带字节偏移索引的 .tmu 文档树"""
+
+    def __init__(self, data):
+        # bytearray：编辑时原地替换，只移动编辑点之后的字节
+        self.data = bytearray(data)
+        self.root = attach(Parser(self.data).document(), 0)
+        self.last_reparsed = len(self.data)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls(f.read())
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.data)
+
+    def source(self, node):
+        return bytes(self.data[node.start:node.end])
+
+    def text(self, node):
+        return self.source(node).decode('utf-8', errors='replace')
+
+    def walk(self, node=None):
+        """先序遍历"""
+        stack = [node or self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def find(self, tag):
+        return (n for n in self.walk() if n.kind == 'form' and n.tag == tag)
+
+    def block(self, tag):
+        """顶层的块形式（body、references、auxiliary 等），不存在时为 None"""
+        for par in self.root.children:
+            for node in par.children:
+                if node.kind == 'form' and node.tag == tag:
+                    return node
+        return None
+
+    def node_at(self, offset):
+        """包含 offset 的最深节点"""
+        node = self.root
+        rel = offset
+        while True:
+            i = bisect_right(node.children, rel, key=lambda c: c.rel) - 1
+            if i < 0:
+                return node
+            child = node.children[i]
+            if rel >= child.rel + child.length:
+                return node
+            rel -= child.rel
+            node = child
+
+    def path(self, node):
+        """从根到节点的形式标签路径"""
+        tags = []
+        while node is not None:
+            if node.kind == 'form':
+                tags.append(node.tag)
+            node = node.parent
+        return tags[::-1]
+
+    @property
+    def header(self):
+        """文件头 <TMU|<tuple|版本…>> 中的字段"""
+        tmu = next(self.find('TMU'), None)
+        if tmu is None or not tmu.children:
+            return None
+        inner = tmu.children[0].children
+        form = next((n for n in inner if n.kind == 'form'), None)
+        return [self.text(arg) for arg in form.children] if form else None
+
+    def edit(self, start, end, replacement):
+        """把 [start, end) 替换为 replacement（bytes），只重解析受影响的子树
+
+        返回重解析的容器节点；编辑后文档不合法时抛出 ParseError，文档保持不变。
+        """
+        delta = len(replacement) - (end - start)
+        old = self.data[start:end]
+        self.data[start:end] = replacement
+        parser = Parser(self.data)
+
+        container = self.node_at(start)
+        while container.kind not in CONTAINERS:
+            container = container.parent
+        while True:
+            c_start = container.start
+            c_end = c_start + container.length
+            # 编辑必须落在容器内部（不触及其边界外的定界符）
+            if c_start <= start and end <= c_end and container.kind != 'document' or container.parent is None:
+                children = container.children
+                # 受影响的子节点区间：与编辑区间相交或相邻的子节点
+                lo = 0
+                while lo < len(children) and c_start + children[lo].rel + children[lo].length < start:
+                    lo += 1
+                hi = lo
+                while hi < len(children) and c_start + children[hi].rel <= end:
+                    hi += 1
+                # 两侧各多带一个兄弟：相邻文本叶子需要合并，段落间空白可能被删掉
+                lo = max(lo - 1, 0)
+                hi = min(hi + 1, len(children))
+                closed = True
+                if container.kind == 'par' or container.kind == 'arg':
+                    r_start = min(start, c_start + children[lo].rel) if lo < len(children) else start
+                    r_end = max(end, c_start + children[hi - 1].rel + children[hi - 1].length) if hi > lo else end
+                elif container.kind == 'body':
+                    # 正文按段落重解析：从段落起点到下一个未改动段落的起点，连同其间的分隔与空白段落
+                    r_start = c_start + children[lo].rel if lo > 0 else c_start
+                    closed = hi == len(children)
+                    r_end = c_end if closed else c_start + children[hi].rel
+                else:
+                    r_start, r_end = 0, c_end
+                    lo, hi = 0, len(children)
+                try:
+                    nodes = parser.region(container, r_start, r_end + delta, closed)
+                except ParseError:
+                    if container.parent is None:
+                        # 编辑后的文档本身不合法：保持编辑前的状态
+                        self.data[start:start + len(replacement)] = old
+                        raise
+                else:
+                    self.splice(container, c_start, lo, hi, nodes, delta)
+                    self.last_reparsed = r_end + delta - r_start
+                    return container
+            container = container.parent
+            while container.kind not in CONTAINERS:
+                container = container.parent
+
+    def splice(self, container, c_start, lo, hi, nodes, delta):
+        for node in nodes:
+            attach(node, c_start)
+            node.parent = container
+        # 受影响区间之后的兄弟节点整体平移
+        for sibling in container.children[hi:]:
+            sibling.rel += delta
+        container.children[lo:hi] = nodes
+        node = container
+        while node is not None:
+            node.length += delta
+            parent = node.parent
+            if parent is not None:
+                index = parent.children.index(node)
+                for sibling in parent.children[index + 1:]:
+                    sibling.rel += delta
+            node = parent
+
+def dump(doc, node, depth=0, max_depth=3):
+    label = node.tag if node.kind == 'form' else node.kind
+    excerpt = doc.text(node)[:50].replace('\n', ' ') if node.kind == 'text' else ''
+    print(f"{'  ' * depth}{label} [{node.start}, {node.end}) {excerpt}")
+    if depth < max_depth:
+        for child in node.children:
+            dump(doc, child, depth + 1, max_depth)
+
+def shape(node):
+    """节点树的结构与偏移，用于比较增量结果与全量解析"""
+    return (node.kind, node.tag, node.rel, node.length, [shape(child) for child in node.children])
+
+def check(path, count, seed):
+    """随机编辑（删除、插入空行与空白、复制片段），每次编辑后与全量解析比较"""
+    rng = random.Random(seed)
+    doc = TmuDocument.load(path)
+    snippets = [b'', b'x', b' ', b'\n', b'\n\n', b'\n  \n', b'<alpha>']
+    applied = 0
+    for n in range(count):
+        start = rng.randrange(len(doc.data) + 1)
+        end = min(len(doc.data), start + rng.choice((0, 1, 2, 5, 20)))
+        if rng.random() < 0.2:
+            text = bytes(doc.data[start:start + rng.randrange(40)])
+        else:
+            text = rng.choice(snippets)
+        try:
+            doc.edit(start, end, text)
+        except ParseError:
+            continue  # 编辑后文档不合法，文档保持不变
+        applied += 1
+        if shape(doc.root) != shape(TmuDocument(doc.data).root):
+            print(f"第 {n} 次编辑后增量结果与全量解析不一致（{text!r} @ {start}-{end}）")
+            return False
+    print(f"{applied} 次编辑（共尝试 {count} 次）的增量结果与全量解析一致")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=".tmu 文档的解析与节点偏移索引")
+    parser.add_argument("tmu_file")
+    parser.add_argument("offset", nargs="?", type=int, help="显示包含该字节偏移的最深节点")
+    parser.add_argument("--check", type=int, metavar="N", help="做 N 次随机编辑，校验增量重解析与全量解析一致")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(0 if check(args.tmu_file, args.check, args.seed) else 1)
+    start = time.perf_counter()
+    doc = TmuDocument.load(args.tmu_file)
+    elapsed = (time.perf_counter() - start) * 1000
+    nodes = sum(1 for _ in doc.walk())
+    print(f"解析 {len(doc.data)} 字节，{nodes} 个节点，用时 {elapsed:.1f} ms；文件头：{doc.header}")
+    if args.offset is not None:
+        node = doc.node_at(args.offset)
+        print(f"{' / '.join(doc.path(node))}  {node}")
+        print(doc.text(node)[:200])
+    else:
+        dump(doc, doc.root, max_depth=2)
+
+if __name__ == '__main__':
+    main()
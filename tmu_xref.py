@@ -0,0 +1,460 @@
+import argparse
+import random
+import re
+import sys
+import time
+from bisect import bisect_left
+
+from tmu_index import SECTION_LEVELS
+from tmu_parser import TmuDocument
+
+# .tmu 文档交叉引用的增量解析。
+#
+# 正文按文档顺序产生一串事件：
+#   counter  计数器推进（章节、big-figure/big-table、equation、footnote、定理类环境…），
+#            同时设定“当前标签值” the-label
+#   anchor   目录/图表目录的锚点，对应自动标签 auto-N（章节、浮动体、摘要、参考文献…）
+#   label    <label|名字>，取当前的 the-label
+#   ref      <smart-ref|…>/<reference|…>/<pageref|…>，依赖于同名 label
+# 每个事件记录处理后的编号状态。编辑后只重新收集编辑区间内的事件，从前一个事件的
+# 状态开始重放，直到某个旧事件重放后的状态与原先相同——之后的编号不会再变。
+# 受影响的键（label 与 auto-N）再与 <\references> 中的 <associate|键|<tuple|编号|页码>>
+# 比较，只改写不一致的条目；<\auxiliary> 中目录、图表目录条目的编号与 auto 键随之更新。
+# 页码需要排版才能得到：已有条目保留原页码，新条目记为 ?。新增锚点的目录条目需要
+# 在编辑器中重新生成（结果中的 unlisted）。
+
+APPENDIX_TAGS = {'appendix'}
+FLOAT_TAGS = {'big-figure', 'big-table'}
+UNNUMBERED_ANCHORS = {'abstract', 'bibliography', 'the-index', 'the-glossary', 'big-figure*', 'big-table*',
+                      'chapter*', 'section*', 'subsection*', 'subsubsection*', 'appendix*'}
+COUNTED_TAGS = {'equation', 'footnote', 'example', 'remark', 'theorem', 'lemma', 'proposition', 'corollary',
+                'definition', 'exercise', 'problem', 'note', 'warning', 'algorithm', 'conjecture', 'axiom'}
+REF_TAGS = {'smart-ref', 'reference', 'eqref', 'pageref'}
+EVENT_TAGS = (set(SECTION_LEVELS) | APPENDIX_TAGS | FLOAT_TAGS | UNNUMBERED_ANCHORS | COUNTED_TAGS | REF_TAGS
+              | {'label', 'bibitem*'})
+LIST_NUMBER_RE = r'<tuple\|{key}>\|[^|>]*>'
+INITIAL_STATE = ((0, 0, 0, 0), None, 0, (), '?', 0)  # 各级章节、最高级别、附录、计数器、the-label、auto 数
+
+class Event:
+    __slots__ = ('pos', 'length', 'kind', 'tag', 'key', 'value', 'page', 'state')
+
+    def __init__(self, pos, length, kind, tag, key=None):
+        self.pos = pos
+        self.length = length  # 整个形式的长度：编辑与之重叠时事件本身可能改变
+        self.kind = kind
+        self.tag = tag
+        self.key = key
+        self.value = None
+        self.page = '?'
+        self.state = None
+
+    def __repr__(self):
+        return f'<{self.kind} {self.tag} {self.key}={self.value} @{self.pos}>'
+
+def section_number(levels, top, appendix, level):
+    parts = [str(n) for n in levels[top:level + 1]]
+    if appendix:
+        parts[0] = chr(ord('A') + appendix - 1)
+    return '.'.join(parts)
+
+def advance(state, event):
+    """处理一个事件，返回新状态；事件定义的键的值写入 event.value"""
+    levels, top, appendix, counts, the_label, auto = state
+    tag = event.tag
+    if event.kind == 'label':
+        event.value = the_label
+        return state
+    if event.kind == 'ref':
+        return state
+    if tag in SECTION_LEVELS or tag in APPENDIX_TAGS:
+        if tag in APPENDIX_TAGS:
+            appendix += 1
+            level = top if top is not None else SECTION_LEVELS['section']
+            levels = tuple(0 if i >= level else n for i, n in enumerate(levels))
+        else:
+            level = SECTION_LEVELS[tag]
+            levels = tuple(n + 1 if i == level else 0 if i > level else n for i, n in enumerate(levels))
+        top = level if top is None else min(top, level)
+        the_label = section_number(levels, top, appendix, level)
+    elif tag in FLOAT_TAGS or tag in COUNTED_TAGS:
+        table = dict(counts)
+        table[tag] = table.get(tag, 0) + 1
+        counts = tuple(sorted(table.items()))
+        the_label = str(table[tag])
+    elif tag == 'bibitem*':
+        the_label = event.key
+    if event.kind == 'anchor':
+        auto += 1
+        event.key = f'auto-{auto}'
+        event.value = the_label
+    elif tag == 'footnote':
+        event.value = the_label
+    return levels, top, appendix, counts, the_label, auto
+
+def defined_keys(event):
+    """事件定义的引用键（footnote 同时定义 footnote-N 与 footnr-N）"""
+    if event.kind in ('label', 'anchor'):
+        return [event.key]
+    if event.tag == 'footnote':
+        return [f'footnote-{event.value}', f'footnr-{event.value}']
+    return []
+
+def collect(doc, lo, hi):
+    """收集正文中起点落在 [lo, hi) 的事件形式，按文档顺序"""
+    body = doc.block('body')
+    if body is None:
+        return []
+    events = []
+    stack = [(body, body.start)]
+    while stack:
+        node, start = stack.pop()
+        end = start + node.length
+        if end <= lo or start >= hi:
+            continue
+        if node.kind == 'form' and node.tag in EVENT_TAGS and start >= lo:
+            tag = node.tag
+            if tag == 'label' or tag in REF_TAGS or tag == 'bibitem*':
+                if not node.children:
+                    continue
+                key = doc.text(node.children[0]).strip()
+                kind = 'label' if tag == 'label' else 'ref' if tag in REF_TAGS else 'counter'
+                events.append(Event(start, node.length, kind, tag, key))
+            elif tag in SECTION_LEVELS or tag in APPENDIX_TAGS or tag in FLOAT_TAGS or tag in UNNUMBERED_ANCHORS:
+                events.append(Event(start, node.length, 'anchor', tag))
+            else:
+                events.append(Event(start, node.length, 'counter', tag))
+        for child in reversed(node.children):
+            stack.append((child, start + child.rel))
+    return events
+
+class XrefEngine:
+    """维护 .tmu 文档的标签→引用依赖图，编辑后增量更新辅助数据"""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.events = collect(doc, 0, len(doc.data))
+        pages = {key: page for key, (_, page, _) in self.entries().items()}
+        state = INITIAL_STATE
+        for event in self.events:
+            state = event.state = advance(state, event)
+            for key in defined_keys(event):
+                event.page = pages.get(key, '?')
+        self.last = {}
+
+    @classmethod
+    def load(cls, path):
+        return cls(TmuDocument.load(path))
+
+    def values(self):
+        """{键: (编号, 页码)}，由事件计算得到"""
+        result = {}
+        for event in self.events:
+            for key in defined_keys(event):
+                result[key] = (event.value, event.page)
+        return result
+
+    def references(self, label):
+        """引用某个标签的位置"""
+        return [e.pos for e in self.events if e.kind == 'ref' and e.key == label]
+
+    def references_block(self):
+        refs = self.doc.block('references')
+        if refs is None or not refs.children:
+            return None
+        return next((n for n in self.doc.walk(refs) if n.kind == 'form' and n.tag == 'collection'), None)
+
+    def entries(self):
+        """<\\references> 中的条目：{键: (编号, 页码, associate 节点)}"""
+        collection = self.references_block()
+        result = {}
+        if collection is None:
+            return result
+        for node in self.doc.walk(collection):
+            if node.kind != 'form' or node.tag != 'associate' or len(node.children) < 2:
+                continue
+            tuple_form = next((n for n in node.children[1].children if n.kind == 'form' and n.tag == 'tuple'), None)
+            if tuple_form is None or len(tuple_form.children) < 2:
+                continue
+            number, page = (self.doc.text(arg) for arg in tuple_form.children[:2])
+            result[self.doc.text(node.children[0])] = (number, page, node)
+        return result
+
+    def list_entries(self):
+        """<\\auxiliary> 中目录、图表目录的条目：{auto 键: [段落节点…]}"""
+        aux = self.doc.block('auxiliary')
+        result = {}
+        if aux is None:
+            return result
+        for node in self.doc.walk(aux):
+            if node.kind == 'form' and node.tag == 'associate' and len(node.children) > 1:
+                for par in node.children[-1].children:
+                    for key in re.findall(rb'<pageref\|(auto-\d+)>', self.doc.source(par)):
+                        result.setdefault(key.decode(), []).append(par)
+        return result
+
+    def edit(self, start, end, replacement):
+        """在文档上做一次编辑并增量更新交叉引用；返回本次的变化摘要"""
+        t0 = time.perf_counter()
+        if isinstance(replacement, str):
+            replacement = replacement.encode('utf-8')
+        delta = len(replacement) - (end - start)
+        old_events = self.events
+        self.doc.edit(start, end, replacement)
+        t1 = time.perf_counter()
+
+        # 形式范围与编辑区间重叠的旧事件（包括标签名、参数被改的形式及包含编辑处的环境）作废
+        positions = [e.pos for e in old_events]
+        i0 = bisect_left(positions, start)
+        lo = min([start] + [e.pos for e in old_events[:i0] if e.pos + e.length > start])
+        i0 = bisect_left(positions, lo, hi=i0)
+        j0 = bisect_left(positions, end, lo=i0)
+        node = self.doc.node_at(start)
+        while node is not None and node.kind != 'form':
+            node = node.parent
+        if node is not None and node.start + len(node.tag) + 2 >= start:
+            lo = min(lo, node.start)
+        fresh = collect(self.doc, lo, start + len(replacement))
+
+        # 从前一个事件的状态开始重放，旧事件重放后状态不变即收敛
+        state = old_events[i0 - 1].state if i0 > 0 else INITIAL_STATE
+        before = {}
+        for event in old_events[i0:j0]:
+            for key in defined_keys(event):
+                before[key] = (event.value, event.page)
+        for event in fresh:
+            state = event.state = advance(state, event)
+            for key in defined_keys(event):
+                # 原样重建的标签保留原来的页码
+                if key in before:
+                    event.page = before[key][1]
+        moved = []
+        k = j0
+        while k < len(old_events):
+            event = old_events[k]
+            event.pos += delta
+            old_keys, old_state, old_value = defined_keys(event), event.state, event.value
+            for key in old_keys:
+                before.setdefault(key, (old_value, event.page))
+            state = event.state = advance(state, event)
+            k += 1
+            if event.kind == 'anchor' and (old_keys[0], old_value) != (event.key, event.value):
+                moved.append((old_keys[0], old_value, event.key, event.value))
+            if state == old_state and event.value == old_value and event.kind != 'ref':
+                break
+        for event in old_events[k:]:
+            event.pos += delta
+        removed = [e.key for e in old_events[i0:j0] if e.kind == 'anchor']
+        self.events = old_events[:i0] + fresh + old_events[j0:]
+        replayed = fresh + old_events[j0:k]
+
+        # 受影响的键：作废或重放的事件定义过或现在定义的键
+        after = {}
+        for event in replayed:
+            for key in defined_keys(event):
+                after[key] = (event.value, event.page)
+        current = self.values()
+        targets = {key: current.get(key) for key in set(before) | set(after)}
+        changed = self.sync(targets, moved, removed) if targets or moved or removed else set()
+        changed_labels = {key for key in changed if not key.startswith('auto-')}
+        t2 = time.perf_counter()
+        self.last = {
+            'replayed': len(replayed),
+            'changed': sorted(changed),
+            'moved': [f'{old}={old_value} -> {key}={value}' for old, old_value, key, value in moved],
+            'references': [e.pos for e in self.events if e.kind == 'ref' and e.key in changed_labels],
+            'unlisted': [e.key for e in fresh if e.kind == 'anchor'],
+            'parse_ms': (t1 - t0) * 1000,
+            'resolve_ms': (t2 - t1) * 1000,
+        }
+        return self.last
+
+    def sync(self, targets, moved=(), removed=()):
+        """让 <\\references> 与 targets（{键: (编号, 页码) 或 None}）一致，并更新目录条目
+
+        moved 为编号或 auto 键变化的锚点 [(旧键, 旧编号, 新键, 新编号)]，removed 为被删掉的
+        锚点的旧键。只改写不一致的条目，返回改写过的键。所有编辑先按当前偏移算好，
+        再从后往前应用。
+        """
+        entries = self.entries()
+        edits = []
+        changed = set()
+        collection = self.references_block()
+        added = []
+        for key in sorted(targets):
+            target = targets[key]
+            entry = entries.get(key)
+            if target is None:
+                if entry is not None:
+                    node = entry[2]
+                    line_start = self.doc.data.rfind(b'\n', 0, node.start)
+                    edits.append((line_start, node.end, b''))
+                    changed.add(key)
+            elif entry is None:
+                added.append((key, target))
+                changed.add(key)
+            elif entry[:2] != target:
+                arg = entry[2].children[1]
+                edits.append((arg.start, arg.end, f'<tuple|{target[0]}|{target[1]}>'.encode('utf-8')))
+                changed.add(key)
+
+        if collection is None and added:
+            # 文档还没有 references 块：整块追加到末尾
+            lines = ''.join(f'\n    <associate|{key}|<tuple|{number}|{page}>>' for key, (number, page) in added)
+            block = f'\n\n<\\references>\n  <\\collection>{lines}\n  </collection>\n</references>'
+            end = len(self.doc.data.rstrip())
+            edits.append((end, end, block.encode('utf-8')))
+        else:
+            # 新条目只能挨着保留下来的条目插入，否则会落进被删除的范围
+            kept = {key: entry for key, entry in entries.items() if targets.get(key, entry) is not None}
+            edits.extend(self.insertion(collection, kept, key, target) for key, target in added)
+
+        # 目录与图表目录：条目按锚点原来的 auto 键查找
+        listed = self.list_entries() if moved or removed else {}
+        for old_key, old_value, key, value in moved:
+            for par in listed.get(old_key, []):
+                source = self.doc.source(par)
+                text = self.list_entry(source, old_key, old_value, key, value)
+                if text != source:
+                    edits.append((par.start, par.end, text))
+        for old_key in removed:
+            for par in listed.get(old_key, []):
+                edits.append(self.removal(par))
+
+        for start, end, text in sorted(set(edits), reverse=True):
+            self.doc.edit(start, end, text)
+        return changed
+
+    def insertion(self, collection, entries, key, target):
+        text = f'<associate|{key}|<tuple|{target[0]}|{target[1]}>>'.encode('utf-8')
+        following = sorted(k for k in entries if k > key)
+        if following:
+            node = entries[following[0]][2]
+            indent = node.start - self.doc.data.rfind(b'\n', 0, node.start) - 1
+            return node.start, node.start, text + b'\n' + b' ' * indent
+        if entries:
+            node = entries[max(entries)][2]
+            indent = node.start - self.doc.data.rfind(b'\n', 0, node.start) - 1
+            return node.end, node.end, b'\n' + b' ' * indent + text
+        body = collection.children[0]
+        return body.start, body.start, b'\n    ' + text
+
+    def list_entry(self, source, old_key, old_value, key, value):
+        text = source.replace(f'<pageref|{old_key}>'.encode(), f'<pageref|{key}>'.encode())
+        binding = re.compile(LIST_NUMBER_RE.format(key=re.escape(old_key)).encode())
+        if binding.search(text):
+            # 图表目录条目：<hidden-binding|<tuple|auto-N>|编号>
+            return binding.sub(f'<tuple|{key}>|{value}>'.encode('utf-8'), text)
+        if old_value != value:
+            # 目录条目：编号在 <space|2spc> 之前
+            text = text.replace(f'|{old_value}<space|2spc>'.encode('utf-8'), f'|{value}<space|2spc>'.encode('utf-8'), 1)
+        return text
+
+    def removal(self, par):
+        """删除目录条目所在段落及其前面的空行"""
+        start = self.doc.data.rfind(b'\n\n', 0, par.start)
+        return (start if start >= 0 else par.start), par.end, b''
+
+    def refresh(self):
+        """全量重算并同步全部条目（基准）"""
+        self.__init__(self.doc)
+        entries = self.entries()
+        targets = {key: None for key in entries}
+        targets.update(self.values())
+        moved = [(e.key, entries[e.key][0], e.key, e.value) for e in self.events
+                 if e.kind == 'anchor' and e.key in entries and entries[e.key][0] != e.value]
+        return self.sync(targets, moved)
+
+    def stale(self):
+        """与正文计算结果不一致的条目：[(键, 文件中的值, 计算值)]"""
+        entries = {key: entry[:2] for key, entry in self.entries().items()}
+        values = self.values()
+        return [(key, entries.get(key), values.get(key)) for key in sorted(set(entries) | set(values))
+                if entries.get(key) != values.get(key)]
+
+def bench(path, count, seed):
+    """随机编辑（插入、改标签名、删除形式）：增量更新与全量重算的耗时对比，并校验两者结果一致"""
+    rng = random.Random(seed)
+    engine = XrefEngine.load(path)
+    engine.refresh()
+    body = engine.doc.block('body')
+    snippets = [
+        ' word',
+        '<section|Inserted section><label|sec:inserted-{n}>\n\n  ',
+        '<big-figure|<no-figure>|<label|fig:inserted-{n}>Inserted figure>\n\n  ',
+        '<\\equation>\n    x<label|eq:inserted-{n}>\n  </equation>\n\n  ',
+        'See <smart-ref|sec:inserted-{n}>. ',
+    ]
+    incremental = []
+    full = []
+    for n in range(count):
+        operation = rng.choice(('insert', 'insert', 'rename', 'delete'))
+        labels = [e for e in engine.events if e.kind == 'label']
+        removable = [e for e in engine.events if e.kind in ('label', 'ref') or e.tag in SECTION_LEVELS]
+        if operation == 'rename' and labels:
+            # 改写 <label|名字> 的参数：形式头不变，只有参数变化
+            event = rng.choice(labels)
+            pos, end, text = event.pos + len('<label|'), event.pos + event.length - 1, f'renamed-{n}'
+        elif operation == 'delete' and removable:
+            # 删除整个标签、引用或章节标题形式
+            event = rng.choice(removable)
+            pos, end, text = event.pos, event.pos + event.length, ''
+        else:
+            # 在正文的段落边界插入，保证编辑后文档合法
+            pars = [p for p in body.children[0].children if p.kind == 'par']
+            pos = end = rng.choice(pars).start
+            text = rng.choice(snippets).format(n=n)
+        start = time.perf_counter()
+        engine.edit(pos, end, text)
+        incremental.append((time.perf_counter() - start) * 1000)
+
+        # 全量：重新解析整篇文档、重算全部编号；增量结果正确时它不应再有任何改写
+        start = time.perf_counter()
+        reference = XrefEngine(TmuDocument(engine.doc.data))
+        changed = reference.refresh()
+        full.append((time.perf_counter() - start) * 1000)
+        if changed or reference.doc.data != engine.doc.data:
+            print(f"第 {n} 次编辑后增量结果与全量结果不一致（{operation} {text!r} @ {pos}-{end}）")
+            return False
+        body = engine.doc.block('body')
+    print(f"{count} 次编辑：增量平均 {sum(incremental) / count:.2f} ms，全量平均 {sum(full) / count:.2f} ms")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=".tmu 文档交叉引用的增量解析")
+    parser.add_argument("tmu_file")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("check", help="列出与正文不一致的 references 条目")
+    sync = sub.add_parser("sync", help="改写不一致的条目")
+    sync.add_argument("-o", "--output", help="输出文件（默认覆盖原文件）")
+    edit = sub.add_parser("edit", help="做一次编辑并增量更新，输出变化")
+    edit.add_argument("start", type=int)
+    edit.add_argument("end", type=int)
+    edit.add_argument("text", help="替换文本（换行可用 shell 的 $'…' 写法）")
+    edit.add_argument("-o", "--output", help="输出文件（默认覆盖原文件）")
+    bench_cmd = sub.add_parser("bench", help="随机编辑，对比增量与全量耗时")
+    bench_cmd.add_argument("--edits", type=int, default=50)
+    bench_cmd.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        sys.exit(0 if bench(args.tmu_file, args.edits, args.seed) else 1)
+    start = time.perf_counter()
+    engine = XrefEngine.load(args.tmu_file)
+    print(f"{len(engine.events)} 个事件，用时 {(time.perf_counter() - start) * 1000:.1f} ms")
+    if args.command == "check":
+        stale = engine.stale()
+        for key, stored, computed in stale:
+            print(f"{key}: 文件中 {stored}，应为 {computed}")
+        print(f"{len(stale)} 个条目不一致")
+        return
+    if args.command == "sync":
+        changed = engine.refresh()
+        print(f"改写 {len(changed)} 个条目")
+    else:
+        result = engine.edit(args.start, args.end, args.text)
+        for name, value in result.items():
+            print(f"{name}: {value}")
+    engine.doc.save(args.output or args.tmu_file)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+from __future__ import annotations
+import argparse, json, os, re, time
+from typing import Optional
+
+import numpy as np
+
+
+# Bytes read per update() round; bounds memory independently of the log size
+READ_CHUNK = 1 << 24
+DURATION_RE = re.compile(r'(?:(\d+) days?, )?(\d+):(\d\d):(\d\d)')
+
+
+def moving_avg(xs, k: int) -> np.ndarray:
+	"""Trailing moving average; the first k-1 points average what is available."""
+	xs = np.asarray(xs, dtype=float)
+	if k <= 1 or xs.size == 0:
+		return xs
+	csum = np.cumsum(xs)
+	out = csum.copy()
+	out[k:] = csum[k:] - csum[:-k]
+	return out / np.minimum(np.arange(1, xs.size + 1), k)
+
+
+def parse_duration(text) -> Optional[float]:
+	"""Seconds in an "H:MM:SS" (or "N days, H:MM:SS") duration; None if unparsable."""
+	m = DURATION_RE.fullmatch(str(text).strip())
+	if not m:
+		return None
+	days, h, mnt, s = m.groups()
+	return int(days or 0) * 86400 + int(h) * 3600 + int(mnt) * 60 + int(s)
+
+
+def format_duration(seconds: Optional[float]) -> str:
+	if seconds is None:
+		return '?'
+	seconds = int(round(seconds))
+	return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+class TrainLog:
+	"""Incrementally tailed training log (one JSON object per line).
+
+	Each update() parses only the bytes appended since the previous call and
+	appends to numpy-backed step/loss/lr arrays (grown by doubling). Records
+	without a loss still update the progress fields (steps, elapsed/remaining).
+	"""
+
+	def __init__(self, path: str):
+		self.path = path
+		self.reset()
+
+	def reset(self):
+		self.offset = 0
+		self.line_no = 0
+		self._partial = b''
+		self._n = 0
+		self._steps = np.empty(1024, dtype=np.int64)
+		self._loss = np.empty(1024, dtype=float)
+		self._lr = np.empty(1024, dtype=float)
+		self.current_step: Optional[int] = None
+		self.total_steps: Optional[int] = None
+		self.elapsed: Optional[float] = None
+		self.remaining: Optional[float] = None
+
+	@property
+	def steps(self) -> np.ndarray:
+		return self._steps[:self._n]
+
+	@property
+	def losses(self) -> np.ndarray:
+		return self._loss[:self._n]
+
+	@property
+	def lrs(self) -> np.ndarray:
+		return self._lr[:self._n]
+
+	def update(self, flush: bool = False) -> int:
+		"""Read what was appended since the last call; returns the number of new records.
+
+		An unterminated last line is held back until it is completed, unless flush
+		is set (the writer is known to be done).
+		"""
+		if not os.path.isfile(self.path):
+			return 0
+		if os.path.getsize(self.path) < self.offset:
+			# Truncated or replaced: start over
+			self.reset()
+		added = 0
+		with open(self.path, 'rb') as f:
+			f.seek(self.offset)
+			while True:
+				chunk = f.read(READ_CHUNK)
+				if not chunk:
+					break
+				self.offset += len(chunk)
+				lines = (self._partial + chunk).split(b'\n')
+				# An unterminated last line may still be being written
+				self._partial = lines.pop()
+				added += self._ingest(lines)
+		if flush and self._partial:
+			added += self._ingest([self._partial])
+			self._partial = b''
+		return added
+
+	def _ingest(self, lines) -> int:
+		records = 0
+		steps, losses, lrs = [], [], []
+		for line in lines:
+			self.line_no += 1
+			if not line.strip():
+				continue
+			try:
+				obj = json.loads(line)
+			except json.JSONDecodeError:
+				continue
+			if not isinstance(obj, dict):
+				continue
+			records += 1
+			self._progress(obj)
+			if 'loss' not in obj:
+				continue
+			try:
+				loss = float(obj['loss'])
+			except (TypeError, ValueError):
+				continue
+			steps.append(obj.get('step', obj.get('current_steps', self.line_no)))
+			losses.append(loss)
+			try:
+				lrs.append(float(obj.get('lr', 'nan')))
+			except (TypeError, ValueError):
+				lrs.append(float('nan'))
+		if steps:
+			self._append(steps, losses, lrs)
+		return records
+
+	def _progress(self, obj: dict):
+		if 'current_steps' in obj:
+			self.current_step = obj['current_steps']
+		if 'total_steps' in obj:
+			self.total_steps = obj['total_steps']
+		for key in ('elapsed_time', 'remaining_time'):
+			if key in obj:
+				setattr(self, key.split('_')[0], parse_duration(obj[key]))
+
+	def _append(self, steps, losses, lrs):
+		end = self._n + len(steps)
+		if end > self._steps.size:
+			size = max(end, 2 * self._steps.size)
+			for name in ('_steps', '_loss', '_lr'):
+				old = getattr(self, name)
+				grown = np.empty(size, dtype=old.dtype)
+				grown[:self._n] = old[:self._n]
+				setattr(self, name, grown)
+		self._steps[self._n:end] = steps
+		self._loss[self._n:end] = losses
+		self._lr[self._n:end] = lrs
+		self._n = end
+
+	def steps_per_sec(self) -> Optional[float]:
+		if not self.current_step or not self.elapsed:
+			return None
+		return self.current_step / self.elapsed
+
+	def eta(self) -> Optional[float]:
+		"""Remaining seconds: the logged remaining_time, else extrapolated from steps/sec."""
+		if self.remaining is not None:
+			return self.remaining
+		rate = self.steps_per_sec()
+		if rate and self.total_steps is not None:
+			return (self.total_steps - self.current_step) / rate
+		return None
+
+	def finished(self) -> bool:
+		return self.total_steps is not None and self.current_step == self.total_steps
+
+	def status(self, smooth: int) -> str:
+		loss = moving_avg(self.losses, smooth)[-1] if self._n else float('nan')
+		lr = self.lrs[-1] if self._n else float('nan')
+		rate = self.steps_per_sec()
+		return (f'step {self.current_step}/{self.total_steps}  loss(MA{smooth}) {loss:.4f}  lr {lr:.3g}  '
+				f'{rate or 0:.3f} steps/s  elapsed {format_duration(self.elapsed)}  ETA {format_duration(self.eta())}')
+
+
+def export_plot(texmacs: Optional[TrainLog], latex: Optional[TrainLog], name: str, smooth: int):
+	"""Write <name>.pdf/.png with the fine-tune figure layout of draw_bench3.py."""
+	import matplotlib
+	matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+	import draw_bench3
+
+	fig, ax = plt.subplots(figsize=(8, 5))
+	if texmacs is not None:
+		draw_bench3.plot_loss(ax, texmacs.steps, texmacs.losses, draw_bench3.TEXMACS_COLOR, 'Mogan Loss', smooth)
+	if latex is not None:
+		draw_bench3.plot_loss(ax, latex.steps, latex.losses, draw_bench3.LATEX_COLOR, 'LaTeX Loss', smooth)
+	ax.set_xlabel('Step')
+	ax.set_ylabel('Loss')
+	ax.legend()
+	ax.grid(True, alpha=0.3)
+	fig.tight_layout()
+	fig.savefig(f'{name}.pdf', bbox_inches='tight')
+	fig.savefig(f'{name}.png', dpi=300, bbox_inches='tight', facecolor='white')
+	plt.close(fig)
+
+
+def main():
+	parser = argparse.ArgumentParser(
+		description='Summarize (and optionally follow) fine-tuning loss logs.',
+		epilog='Example: python train_log.py --latex log_latex.jsonl --follow --plot fine-tune',
+	)
+	parser.add_argument('--texmacs', default='log_texmacs.jsonl', help='Mogan run log (default: log_texmacs.jsonl)')
+	parser.add_argument('--latex', default='log_latex.jsonl', help='LaTeX run log (default: log_latex.jsonl)')
+	parser.add_argument('--smooth', type=int, default=7, help='moving-average window (default: 7)')
+	parser.add_argument('--follow', action='store_true', help='keep tailing the logs until the runs finish')
+	parser.add_argument('--interval', type=float, default=5.0, help='seconds between polls in follow mode (default: 5)')
+	parser.add_argument('--idle-timeout', type=float, default=600.0,
+						help='stop following once no log has grown for this many seconds, e.g. after a crashed '
+							 'or abandoned run; 0 waits forever (default: 600)')
+	parser.add_argument('--plot', metavar='NAME', help='also write NAME.pdf/NAME.png after every update')
+	args = parser.parse_args()
+
+	logs = {label: TrainLog(path) for label, path in (('Mogan', args.texmacs), ('LaTeX', args.latex)) if path}
+	for label, log in logs.items():
+		if not os.path.isfile(log.path):
+			print(f'Warning: cannot read {log.path}')
+
+	last_growth = time.monotonic()
+	try:
+		while True:
+			offsets = [log.offset for log in logs.values()]
+			changed = [label for label, log in logs.items() if log.update(flush=not args.follow)]
+			if [log.offset for log in logs.values()] != offsets:
+				last_growth = time.monotonic()
+			for label in changed:
+				print(f'[{label}] {logs[label].status(args.smooth)}')
+			if changed and args.plot:
+				export_plot(logs.get('Mogan'), logs.get('LaTeX'), args.plot, args.smooth)
+			if not args.follow or all(log.finished() for log in logs.values()):
+				break
+			if args.idle_timeout > 0 and time.monotonic() - last_growth >= args.idle_timeout:
+				print(f'No log has grown for {format_duration(args.idle_timeout)}; '
+					  'stopping (a run may have crashed or been abandoned)')
+				break
+			time.sleep(args.interval)
+	except KeyboardInterrupt:
+		pass
+
+
+if __name__ == '__main__':
+	main()